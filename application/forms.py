@@ -1,6 +1,8 @@
 from django import forms
 from django.core.validators import FileExtensionValidator
 from django.core.exceptions import ValidationError
+from decoding import get_profile
+from model_registry import resolve_model
 
 
 class DocumentForm(forms.Form):
@@ -15,6 +17,30 @@ class DocumentForm(forms.Form):
             "required": "A file is required in order to submit a translation."
         },
     )
+    # optional, the default profile of the documents is used if empty
+    decoding_profile = forms.CharField(max_length=32, required=False)
+    # optional name or tier of the model, the default one is used if empty
+    model = forms.CharField(max_length=64, required=False)
+    # profile the translation of this document, see ``profiling''
+    profile = forms.BooleanField(required=False)
+
+    def clean_decoding_profile(self):
+        decoding_profile = self.cleaned_data.get("decoding_profile")
+        if decoding_profile:
+            try:
+                get_profile(decoding_profile)
+            except ValueError as error:
+                raise ValidationError(str(error))
+        return decoding_profile
+
+    def clean_model(self):
+        model = self.cleaned_data.get("model")
+        if model:
+            try:
+                model = resolve_model(model)
+            except ValueError as error:
+                raise ValidationError(str(error))
+        return model
 
     def clean_translated_document(self):
         translated_document = self.cleaned_data.get("translated_document")
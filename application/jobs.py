@@ -0,0 +1,295 @@
+"""Background execution of the document translations.
+
+Each upload creates a ``Translation`` row with the ``pending`` status and
+the job is executed by a local pool of worker threads sharing the models
+loaded by the server. The rows are the only state of the queue, so no broker
+is needed: when the server starts, one of its processes queues again the
+pending jobs left by a previous server and marks as failed the jobs
+interrupted while running, see ``start_jobs''.
+"""
+import fcntl
+import os
+import shutil
+import socket
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import reverse
+from django.utils import timezone
+
+from translation_app import translate_document
+from profiling import artifact_paths, profiling_enabled
+from decoding import endpoint_profile
+from model_registry import get_model, resolve_model
+
+from .models import Translation
+
+
+# folder where the uploaded documents are stored until they are translated
+INPUT_FOLDER = os.path.join("input", "tmp")
+# lock of the process which recovers the jobs, see ``start_jobs''
+RECOVERY_LOCK = os.path.join(INPUT_FOLDER, "recovery.lock")
+
+executor = None
+executor_lock = threading.Lock()
+# lock file held by the process if it has recovered the jobs
+recovery_lock_file = None
+jobs_started = False
+# translation parameters shared by all the jobs
+job_options = {}
+
+
+def configure_jobs(**translation_options):
+    """Function to set the keyword arguments passed to
+    ``translation_app.translate_document'' in every job, the model of each
+    job is taken from ``model_registry''."""
+    job_options.clear()
+    job_options.update(translation_options)
+
+
+def get_executor():
+    """Returns the pool of workers, it is created the first time"""
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=settings.TRANSLATION_JOB_WORKERS,
+                thread_name_prefix="translation-job",
+            )
+    return executor
+
+
+def start_jobs(forked=False):
+    """Function to recover the jobs of a previous server when the server
+    starts. Every process of the server calls it once, but only the first
+    one to lock ``RECOVERY_LOCK'' recovers the jobs: the lock is held as
+    long as the process lives, so the other processes skip the recovery
+    and a process started after the death of the one holding it (e.g. a
+    gunicorn worker replacing a crashed one) recovers the jobs left by it.
+
+    Parameters
+    ----------
+    forked : bool
+        Whether the function is called by a gunicorn worker. The gunicorn
+        master imports the application before forking the workers, the pool
+        threads must not be started there: under gunicorn the call made
+        when ``views'' is imported is ignored and each worker calls the
+        function from the ``post_worker_init'' hook, see
+        ``gunicorn.conf.py''.
+
+    Returns
+    -------
+    recovered : bool
+        Whether the process has recovered the jobs
+    """
+    global recovery_lock_file, jobs_started
+    if not forked and os.environ.get("SERVER_SOFTWARE", "").startswith(
+        "gunicorn"
+    ):
+        return False
+    with executor_lock:
+        if jobs_started:
+            return recovery_lock_file is not None
+        jobs_started = True
+        os.makedirs(INPUT_FOLDER, exist_ok=True)
+        lock_file = open(RECOVERY_LOCK, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        recovery_lock_file = lock_file
+    recover_jobs()
+    return True
+
+
+def worker_alive(worker):
+    """Checks if the process ``host:pid'' which runs a job is still alive"""
+    host, _, pid = worker.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover_jobs():
+    """Queues again the pending jobs and fails the ones interrupted by a
+    restart of the server"""
+    running = Translation.objects.filter(status=Translation.STATUS_RUNNING)
+    for job in running:
+        if not worker_alive(job.worker):
+            Translation.objects.filter(
+                pk=job.pk, status=Translation.STATUS_RUNNING
+            ).update(
+                status=Translation.STATUS_FAILED,
+                finished_at=timezone.now(),
+                error="Interrupted by a restart of the server.",
+            )
+    pending = Translation.objects.filter(
+        status=Translation.STATUS_PENDING
+    ).order_by("translation_date")
+    for job in pending:
+        get_executor().submit(run_job, job.pk)
+
+
+def job_folder(job_id):
+    """Folder where the input document of a job is stored"""
+    return os.path.join(INPUT_FOLDER, f"job_{job_id}")
+
+
+def create_job(
+    uploaded_file,
+    target_language,
+    decoding_profile="",
+    model_name="",
+    profile=False,
+):
+    """Function to store an uploaded document and queue its translation.
+
+    Parameters
+    ----------
+    uploaded_file : django.core.files.uploadedfile.UploadedFile
+        Document to translate
+    target_language : str
+        Langugage code in BCP-47 of the desired output
+    decoding_profile : str
+        Name of the decoding profile, see ``decoding''. If empty, the one of
+        the document endpoint.
+    model_name : str
+        Name or tier of the model, see ``model_registry''. If empty, the
+        default one.
+    profile : bool
+        Whether the translation is profiled, see ``profiling''. Every job is
+        profiled if the ``enabled'' profiling option is set.
+
+    Returns
+    -------
+    job : Translation
+        Created row, with the ``pending'' status
+    """
+    job = Translation.objects.create(
+        source_document=uploaded_file.name,
+        target_language=target_language,
+        decoding_profile=decoding_profile,
+        # the tier is resolved now, the job keeps the model it was queued for
+        model_name=resolve_model(model_name),
+        profile=profiling_enabled(profile or None),
+    )
+    # the job id is part of the name, so the jobs of documents with the
+    # same name do not overwrite their translations (and profiles)
+    job.translated_document = f"translated_{job.pk}_{uploaded_file.name}"
+    job.save(update_fields=["translated_document"])
+
+    # save the file on its own folder so jobs do not interfere
+    folder = job_folder(job.pk)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, uploaded_file.name), "wb") as temp_file:
+        for chunk in uploaded_file.chunks():
+            temp_file.write(chunk)
+
+    get_executor().submit(run_job, job.pk)
+
+    return job
+
+
+def run_job(job_id):
+    """Executes the translation of a job, its row is updated with the
+    progress, the timings and the error if it fails."""
+    close_old_connections()
+    try:
+        # the job is claimed atomically, so it runs once even if it has been
+        # submitted twice
+        claimed = Translation.objects.filter(
+            pk=job_id, status=Translation.STATUS_PENDING
+        ).update(
+            status=Translation.STATUS_RUNNING,
+            started_at=timezone.now(),
+            worker=f"{socket.gethostname()}:{os.getpid()}",
+        )
+        if not claimed:
+            return
+        job = Translation.objects.get(pk=job_id)
+
+        def update_progress(progress):
+            Translation.objects.filter(pk=job_id).update(progress=progress)
+
+        try:
+            model_name, loaded_model = get_model(job.model_name)
+            timings = translate_document(
+                job.source_document,
+                job.target_language,
+                loaded_model=loaded_model,
+                model_name=model_name,
+                input_path=job_folder(job_id),
+                decoding_profile=job.decoding_profile
+                or endpoint_profile("document"),
+                progress_callback=update_progress,
+                profile=job.profile,
+                output_filename=job.translated_document.name,
+                **job_options,
+            )
+        except Exception:
+            traceback.print_exc()
+            job.refresh_from_db(fields=["progress"])
+            job.status = Translation.STATUS_FAILED
+            job.error = traceback.format_exc()
+            shutil.rmtree(job_folder(job_id), ignore_errors=True)
+        else:
+            job.status = Translation.STATUS_DONE
+            job.progress = 1.0
+            job.timings = timings
+        if job.profile:
+            # the artifacts are also written when the translation fails
+            output_file = os.path.join(
+                settings.MEDIA_ROOT, job.translated_document.name
+            )
+            job.profile_files = [
+                os.path.basename(path)
+                for path in artifact_paths(output_file)
+                if os.path.exists(path)
+            ]
+        job.finished_at = timezone.now()
+        job.save(
+            update_fields=[
+                "status",
+                "progress",
+                "timings",
+                "error",
+                "profile_files",
+                "finished_at",
+            ]
+        )
+    finally:
+        close_old_connections()
+
+
+def job_status(job):
+    """Serializable status of a job"""
+    return {
+        "id": job.pk,
+        "document": job.source_document,
+        "translated_document": job.translated_document.name,
+        "target_language": job.target_language,
+        "model": job.model_name or resolve_model(),
+        "decoding_profile": job.decoding_profile
+        or endpoint_profile("document"),
+        "status": job.status,
+        "progress": job.progress,
+        "created_at": job.translation_date.isoformat(),
+        "started_at": job.started_at and job.started_at.isoformat(),
+        "finished_at": job.finished_at and job.finished_at.isoformat(),
+        "timings": job.timings,
+        "profile": [
+            reverse("serve_translated_document", args=[name])
+            for name in job.profile_files
+        ],
+        "error": job.error,
+    }
@@ -0,0 +1,78 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from inference_server import (
+    configure_inference_server,
+    request_server,
+    serve,
+    server_options,
+)
+from model_registry import (
+    configure_model_registry,
+    get_model,
+    registry_lock,
+    resident,
+    resident_models,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the local inference server, which loads the translation models "
+        "once and translates the requests of all the server processes in "
+        "micro-batches (see the INFERENCE_SERVER setting)."
+    )
+    # the checks import the views, which send the translations to this
+    # server when it is enabled
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--address",
+            help="Unix socket path or host:port, by default the setting one",
+        )
+        parser.add_argument(
+            "--max-wait-ms",
+            type=float,
+            help="Milliseconds the requests wait to be batched together",
+        )
+        parser.add_argument(
+            "--max-batch-size",
+            type=int,
+            help="Max number of sequences of each generate call",
+        )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="Print the statistics of the running server and exit",
+        )
+
+    def handle(self, *args, **options):
+        configure_inference_server(**settings.INFERENCE_SERVER)
+        for name in ("address", "max_wait_ms", "max_batch_size"):
+            if options[name] is not None:
+                configure_inference_server(**{name: options[name]})
+        address = server_options["address"]
+
+        if options["stats"]:
+            stats = request_server(address, {"op": "stats"}, timeout=10)
+            self.stdout.write(json.dumps(stats, indent=2))
+            return
+
+        # the models are loaded in this process, see TRANSLATION_MODELS. If
+        # the views have been imported with the server enabled, their remote
+        # models would point to this server
+        configure_model_registry(
+            **settings.TRANSLATION_MODELS,
+            backend_options={
+                **settings.TRANSLATION_BACKEND,
+                **settings.TRANSLATION_MODEL,
+            },
+            remote=None,
+        )
+        with registry_lock:
+            resident.clear()
+        # the default model is ready before the first request
+        get_model()
+        serve(lambda name: get_model(name)[1], address, resident_models)
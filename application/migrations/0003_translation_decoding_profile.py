@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0002_translation_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='translation',
+            name='decoding_profile',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
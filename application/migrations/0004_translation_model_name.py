@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0003_translation_decoding_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='translation',
+            name='model_name',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0004_translation_model_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='translation',
+            name='profile',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='translation',
+            name='profile_files',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
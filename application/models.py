@@ -2,8 +2,46 @@ from django.db import models
 
 
 class Translation(models.Model):
+    """Translated document. Each row is also the job which translates it,
+    uploads are translated in the background by ``application.jobs''."""
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
     translated_document = models.FileField(upload_to="translated_documents/")
     translation_date = models.DateTimeField(auto_now_add=True)
+    source_document = models.CharField(max_length=255, blank=True)
+    target_language = models.CharField(max_length=32, blank=True)
+    # decoding profile of the translation, see ``decoding'', empty for the
+    # default one of the documents
+    decoding_profile = models.CharField(max_length=32, blank=True)
+    # model which translates the document, see ``model_registry'', empty for
+    # the default one
+    model_name = models.CharField(max_length=64, blank=True)
+    # whether the translation is profiled, see ``profiling'', and the names
+    # of the artifacts written next to the translated document
+    profile = models.BooleanField(default=False)
+    profile_files = models.JSONField(default=list, blank=True)
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    # fraction of the job completed, from 0 to 1
+    progress = models.FloatField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # ``host:pid'' of the server process running the job
+    worker = models.CharField(max_length=128, blank=True)
+    # seconds spent on each stage of the translation
+    timings = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
 
     def __str__(self):
         return self.translated_document.name
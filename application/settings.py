@@ -134,3 +134,192 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 MEDIA_URL = os.path.join(BASE_DIR, "media/")
 MEDIA_ROOT = os.path.join(BASE_DIR, "media", "translated_documents")
+
+# Batched generation: max number of text chunks and max number of tokens
+# (padding included) sent to the model in each ``generate`` call. Tune them
+# per deployment depending on the available cores and memory.
+TRANSLATION_BATCH_SIZE = 16
+TRANSLATION_MAX_BATCH_TOKENS = 4096
+
+# Translation memory: translated segments are cached in-process and in a
+# SQLite database next to db.sqlite3, so they are not translated again in
+# later documents or requests. ``ttl`` is given in seconds (None = no expiry),
+# the expired and exceeding segments are removed every ``eviction_interval``
+# stores
+TRANSLATION_MEMORY = {
+    "enabled": True,
+    "db_path": os.path.join(BASE_DIR, "translation_memory.sqlite3"),
+    "max_memory_entries": 10000,
+    "max_db_entries": 1000000,
+    "ttl": 90 * 24 * 3600,
+    "eviction_interval": 100,
+}
+
+# Number of documents translated at the same time by the background workers,
+# all of them share the model loaded by the server process
+TRANSLATION_JOB_WORKERS = 1
+
+# Language identification (lid218e model): it is loaded when the server
+# starts if ``preload`` is True. Documents are identified from a sample of
+# at most ``max_segments`` paragraphs and ``max_characters`` characters
+LANGUAGE_IDENTIFICATION = {
+    "preload": True,
+    "cache_size": 1024,
+    "max_segments": 200,
+    "max_characters": 20000,
+}
+
+# OCR readers (easyocr) are kept warm per language. The readers of
+# ``prewarm_languages`` (BCP-47 codes) are loaded when the server starts and
+# the least recently used ones are evicted above ``memory_budget_mb``
+OCR_READERS = {
+    "prewarm_languages": ["eng_Latn"],
+    "memory_budget_mb": 1024,
+    "gpu": False,
+}
+
+# PDF rasterization: pages are rasterized ``pages_per_batch`` at a time with
+# ``thread_count`` poppler threads and kept in memory as arrays, they are
+# only written to disk above ``max_memory_mb``
+PDF_RASTERIZATION = {
+    "dpi": 200,
+    "pages_per_batch": 4,
+    "thread_count": 2,
+    "max_memory_mb": 1024,
+}
+
+# PDF pipeline: the pages flow independently through rasterization, OCR
+# (``ocr_workers`` threads sharing the reader), translation (the shared
+# model, up to ``pages_per_translation`` pages per batch) and rendering
+# (``render_workers`` processes). At most ``queue_size`` pages wait between
+# two stages
+PDF_PIPELINE = {
+    "enabled": True,
+    "ocr_workers": 2,
+    "render_workers": 2,
+    "queue_size": 4,
+    "pages_per_translation": 4,
+}
+
+# PDF text layer: the embedded text of digitally-born PDFs is extracted with
+# ``pdftotext`` (poppler) and those pages skip the OCR. A page needs at least
+# ``min_characters`` characters, ``min_alphanumeric`` of them letters or
+# digits
+PDF_TEXT_LAYER = {
+    "enabled": True,
+    "min_characters": 20,
+    "min_alphanumeric": 0.5,
+}
+
+# Numeric precision of the translation model: "fp32", "bf16" or "int8"
+# (dynamic quantization of the Linear layers). The int8 weights are cached
+# in ``cache_dir`` so the model is only quantized the first time. Compare
+# the modes with ``python benchmarks/precision_benchmark.py``. With
+# ``mmap`` the fp32 or bf16 weights are written to ``cache_dir`` and memory
+# mapped, so every server process shares them even without the preload of
+# ``gunicorn.conf.py``
+TRANSLATION_MODEL = {
+    "precision": "fp32",
+    "cache_dir": os.path.join(BASE_DIR, "models", "quantized"),
+    "mmap": False,
+}
+
+# Inference engine of the translation model: "torch" (Hugging Face
+# ``generate`` with the precision of TRANSLATION_MODEL) or "onnx" (ONNX
+# Runtime, the graphs are exported offline to ``onnx_path`` with
+# ``python src/export_onnx.py --model nllb-200-distilled-600M [--quantize]``)
+TRANSLATION_BACKEND = {
+    "engine": "torch",
+    "onnx_path": os.path.join(
+        BASE_DIR, "models", "onnx", "nllb-200-distilled-600M"
+    ),
+    "threads": None,
+}
+
+# Translation models which can be served, with the options of each one
+# which differ from TRANSLATION_MODEL and TRANSLATION_BACKEND (e.g. its
+# ``onnx_path`` or ``precision``). The requests and the uploads choose one by
+# its name or its tier with the ``model`` field, the ``default`` one if they
+# do not. The models are loaded when first requested, and the least recently
+# used ones are evicted when the weights of the resident models would exceed
+# ``memory_budget_mb`` (None for no limit). The ``models/`` endpoint lists
+# the resident models, their memory and load times
+TRANSLATION_MODELS = {
+    "models": {
+        "nllb-200-distilled-600M": {},
+        "nllb-200-distilled-1.3B": {
+            "onnx_path": os.path.join(
+                BASE_DIR, "models", "onnx", "nllb-200-distilled-1.3B"
+            ),
+        },
+    },
+    "tiers": {
+        "fast": "nllb-200-distilled-600M",
+        "quality": "nllb-200-distilled-1.3B",
+    },
+    "default": "fast",
+    "memory_budget_mb": None,
+}
+
+# Decoding profiles of the translation model: number of beams, cap of the
+# generated tokens of each chunk (``length_factor`` * tokens of the chunk *
+# ratio of the language pair + ``length_margin``, at most
+# ``max_new_tokens``) and repetition guard (a chunk which repeats the same
+# n-gram ``max_repeats`` times is ended, None disables it). ``endpoints``
+# sets the profile of the text box and of the documents, the requests can
+# choose another one with the ``decoding_profile`` field. The generated
+# length of every chunk can be appended to ``length_log`` (a path, None
+# disables it; the file grows with every translation, enable it while
+# collecting lengths), ``python src/decoding.py generation_lengths.jsonl``
+# suggests the ``length_ratios`` of each ``src>tgt`` pair from it
+DECODING = {
+    "profiles": {
+        "interactive": {
+            "num_beams": 1,
+            "length_factor": 1.5,
+            "length_margin": 8,
+            "max_new_tokens": 160,
+            "max_repeats": 4,
+        },
+        "document": {
+            "num_beams": 2,
+            "length_factor": 2.0,
+            "length_margin": 16,
+            "max_new_tokens": 256,
+            "max_repeats": 4,
+        },
+    },
+    "endpoints": {"text": "interactive", "document": "document"},
+    "length_ratios": {},
+    "length_log": None,
+}
+
+# Local inference server (``python manage.py inference_server``). When it is
+# ``enabled``, the server processes do not load the translation model: they
+# send the token ids of their chunks to the inference server at ``address``
+# (path of a Unix socket or ``host:port``), which loads the model with the
+# settings above and translates together the requests received within
+# ``max_wait_ms`` (up to ``max_batch_size`` sequences and
+# ``max_batch_tokens`` tokens per call). ``python manage.py inference_server
+# --stats`` prints its queue depth, batch sizes and latencies
+INFERENCE_SERVER = {
+    "enabled": False,
+    "address": os.path.join(BASE_DIR, "inference.sock"),
+    "max_wait_ms": 10,
+    "max_batch_size": 32,
+    "max_batch_tokens": 8192,
+    "timeout": 600,
+}
+
+# Profiling of the document translations (see ``src/profiling.py``). The
+# jobs uploaded with the ``profile`` field, or all of them when it is
+# ``enabled`` (``TRANSLATION_PROFILING=1`` environment variable), run under
+# cProfile and, with ``torch``, the PyTorch profiler. The pstats file, a
+# summary of the ``top`` functions by ``sort`` and the Chrome trace are
+# written next to the translated document and linked from the job
+PROFILING = {
+    "enabled": os.environ.get("TRANSLATION_PROFILING", "") == "1",
+    "torch": True,
+    "sort": "cumulative",
+    "top": 50,
+}
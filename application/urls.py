@@ -30,10 +30,28 @@ urlpatterns = [
         views.translation_interface,
         name="translation_interface",
     ),
+    path(
+        "translation-interface/stream/",
+        views.translation_stream,
+        name="translation_stream",
+    ),
     path(
         "delete_all_translations/",
         views.delete_all_translations,
         name="delete_all_translations",
     ),
     path("detect_language/", views.detect_language, name="detect_language"),
+    path("memory/", views.worker_memory, name="worker_memory"),
+    path("models/", views.translation_models, name="translation_models"),
+    path("metrics/", views.translation_metrics, name="translation_metrics"),
+    path(
+        "jobs/<int:job_id>/",
+        views.translation_job_status,
+        name="translation_job_status",
+    ),
+    path(
+        "jobs/<int:job_id>/result/",
+        views.translation_job_result,
+        name="translation_job_result",
+    ),
 ]
@@ -1,4 +1,4 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from .models import Translation
 from django.conf import settings
 from django.http import (
@@ -6,13 +6,38 @@ from django.http import (
     HttpResponseNotFound,
     HttpResponse,
     JsonResponse,
+    StreamingHttpResponse,
 )
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 import os
+import time
+import traceback
 from .forms import DocumentForm
-from translation_app import translate_document
+from .jobs import configure_jobs, create_job, job_status, start_jobs
 import json
-from transformers import AutoTokenizer
-from utils import load_model, convert_text, language_detection
+from inference_server import configure_inference_server, server_options
+from model_registry import (
+    configure_model_registry,
+    get_model,
+    model_choices,
+    resident_models,
+)
+from batch_translation import stream_translation, translate_batch
+from translation_memory import configure_translation_memory
+from tokenizer_registry import get_tokenizer
+from ocr_readers import configure_reader_pool
+from pdf_pages import configure_rasterization
+from pdf_pipeline import configure_pipeline
+from pdf_text_layer import configure_text_layer
+from decoding import configure_decoding, endpoint_profile, get_profile
+from memory_report import process_memory
+from metrics import observe_stage, render_metrics, stage_timer
+from profiling import configure_profiling
+from language_identification import (
+    configure_language_identifier,
+    get_language_identifier,
+)
 
 
 # JSON file
@@ -22,10 +47,44 @@ with open("json/reversed_available_languages.json", "r") as f:
 with open("json/available_languages.json", "r") as f:
     available_language_codes = json.load(f)
 
-# load the model in the first place
-model_name = "nllb-200-distilled-600M"
 max_tokens = 150
-model = load_model(f"facebook/{model_name}")
+# max number of candidate languages of ``detect_language''
+max_language_candidates = 10
+batch_size = settings.TRANSLATION_BATCH_SIZE
+max_batch_tokens = settings.TRANSLATION_MAX_BATCH_TOKENS
+configure_inference_server(**settings.INFERENCE_SERVER)
+# the models are loaded when they are first requested, or by
+# ``python manage.py inference_server'' if it is enabled
+configure_model_registry(
+    **settings.TRANSLATION_MODELS,
+    backend_options={
+        **settings.TRANSLATION_BACKEND,
+        **settings.TRANSLATION_MODEL,
+    },
+    remote=server_options["address"] if server_options["enabled"] else None,
+    remote_timeout=server_options["timeout"],
+)
+# load the default model in the first place
+model_name, model = get_model()
+# the tokenizer is also loaded once and shared by all the requests
+get_tokenizer(model_name)
+# cache of translated segments shared by all the translations
+configure_translation_memory(**settings.TRANSLATION_MEMORY)
+# language identification model shared by the requests and the documents
+configure_language_identifier(**settings.LANGUAGE_IDENTIFICATION)
+# warm OCR readers and rasterization parameters for the PDF documents
+configure_reader_pool(**settings.OCR_READERS)
+configure_rasterization(**settings.PDF_RASTERIZATION)
+configure_pipeline(**settings.PDF_PIPELINE)
+configure_text_layer(**settings.PDF_TEXT_LAYER)
+# decoding profiles of the text box and of the documents
+configure_decoding(**settings.DECODING)
+# documents translated under the profilers, on demand
+configure_profiling(**settings.PROFILING)
+# uploaded documents are translated in background jobs with the same models
+configure_jobs(batch_size=batch_size, max_batch_tokens=max_batch_tokens)
+# the jobs left by a previous server are recovered at startup
+start_jobs()
 
 
 def home(request):
@@ -38,88 +97,212 @@ def home(request):
 def detect_language(request):
     if request.method == "POST":
         input_text = request.POST.get("input_text", "")
-        detected_language_code = language_detection([input_text])
-        detected_language = available_language_codes.get(
-            detected_language_code
+        try:
+            k = int(request.POST.get("k", 1))
+        except ValueError:
+            return JsonResponse({"error": "k must be an integer."}, status=400)
+        k = min(max(k, 1), max_language_candidates)
+        # cached prediction of the shared language identification model
+        candidates = get_language_identifier().detect(input_text, k=k)
+        detected_language = (
+            available_language_codes.get(candidates[0][0])
+            if candidates
+            else None
+        )
+        return JsonResponse(
+            {
+                "detected_language": detected_language,
+                "candidates": [
+                    {
+                        "code": code,
+                        "language": available_language_codes.get(code),
+                        "probability": probability,
+                    }
+                    for code, probability in candidates
+                ],
+            }
         )
-        return JsonResponse({"detected_language": detected_language})
 
     return JsonResponse({"error": "Invalid request method."})
 
 
 def translation_interface(request):
-    tokenizer = None
     context = {
         "available_languages": available_languages,
+        "available_models": model_choices(),
         "tokenizer_loaded": False,
     }
     if request.method == "POST":
-        translated_text = []
         input_text = request.POST.get("input_text", "")
         selected_language = request.POST.get("original_language", "")
         target_language = request.POST.get("target_language", "")
-        # load the tokenizer
-        tokenizer = AutoTokenizer.from_pretrained(
-            os.path.join("facebook/", model_name),
-            src_lang=selected_language,
-        )
+        # the text box uses its own profile unless the request chooses one
+        decoding_profile = request.POST.get(
+            "decoding_profile"
+        ) or endpoint_profile("text")
+        try:
+            get_profile(decoding_profile)
+            # model or tier chosen by the request, the default one if empty
+            model_name, model = get_model(request.POST.get("model"))
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=400)
+        # shared tokenizer, loaded with the first request of the model
+        tokenizer = get_tokenizer(model_name)
 
-        text_chunks = convert_text(input_text, tokenizer, max_tokens)
-        for text_chunk in text_chunks:
-            inputs = tokenizer(text_chunk, return_tensors="pt")
-            translated_tokens = model.generate(
-                **inputs,
-                forced_bos_token_id=tokenizer.lang_code_to_id[target_language],
-            )
-
-            translated_text_block = tokenizer.batch_decode(
-                translated_tokens, skip_special_tokens=True
+        # the chunks of the input text are translated in batches
+        with stage_timer("total"):
+            translated_text = translate_batch(
+                [input_text],
+                tokenizer,
+                model,
+                max_tokens,
+                target_language,
+                batch_size,
+                max_batch_tokens,
+                model_name,
+                selected_language,
+                decoding_profile,
             )[0]
-            translated_text.append(translated_text_block)
-
-        # join and substitute in docx properties
-        translated_text = " ".join(translated_text)
         return JsonResponse({"translated_text": translated_text})
 
     return render(request, "translation_interface.html", context=context)
 
 
-def upload_document(request):
-    if request.method == "POST":
-        form = DocumentForm(request.POST, request.FILES)
-        if form.is_valid():
-            # path to temp folder
-            temp_folder = "input/tmp/"
+def translation_stream(request):
+    """Translation of the text box as server-sent events: a ``chunk''
+    event with the translation of each chunk as soon as it is generated and
+    a final ``done'' event with the whole translation and the timings."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method."}, status=405)
+
+    input_text = request.POST.get("input_text", "")
+    selected_language = request.POST.get("original_language", "")
+    target_language = request.POST.get("target_language", "")
+    decoding_profile = request.POST.get(
+        "decoding_profile"
+    ) or endpoint_profile("text")
+    try:
+        get_profile(decoding_profile)
+        model_name, model = get_model(request.POST.get("model"))
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    translations = stream_translation(
+        input_text,
+        get_tokenizer(model_name),
+        model,
+        max_tokens,
+        target_language,
+        batch_size,
+        max_batch_tokens,
+        model_name,
+        selected_language,
+        decoding_profile,
+    )
+    events = translation_events(translations)
+    if isinstance(request, ASGIRequest):
+        # the translation runs in a thread so the event loop is not blocked
+        events = iterate_in_thread(events)
+
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # proxies must not buffer the events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 
-            if not os.path.exists(temp_folder):
-                os.makedirs(temp_folder)
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-            # save the file on temp folder
-            temp_file_path = os.path.join(
-                temp_folder, form.cleaned_data["translated_document"].name
+
+def translation_events(translations):
+    """Server-sent events of the translated chunks, see
+    ``translation_stream''"""
+    start = time.time()
+    translated_chunks = []
+    first_chunk = None
+    try:
+        for translated_chunk in translations:
+            if first_chunk is None:
+                first_chunk = time.time() - start
+            yield server_sent_event(
+                "chunk",
+                {"index": len(translated_chunks), "text": translated_chunk},
             )
-            with open(temp_file_path, "wb") as temp_file:
-                for chunk in form.cleaned_data["translated_document"].chunks():
-                    temp_file.write(chunk)
+            translated_chunks.append(translated_chunk)
+    except Exception as error:
+        # the response has already started, the error is the last event
+        traceback.print_exc()
+        yield server_sent_event("error", {"error": str(error)})
+        return
+    if first_chunk is not None:
+        observe_stage("first_chunk", first_chunk)
+    observe_stage("total", time.time() - start)
+    yield server_sent_event(
+        "done",
+        {
+            "translated_text": " ".join(translated_chunks),
+            "timings": {
+                "first_chunk": first_chunk,
+                "total": time.time() - start,
+                "chunks": len(translated_chunks),
+            },
+        },
+    )
 
+
+async def iterate_in_thread(iterator):
+    """Asynchronous iterator over a blocking one, each item is computed in
+    a worker thread. Under ASGI, Django reads the whole synchronous
+    iterators of the streaming responses before sending them."""
+    end = object()
+    next_item = sync_to_async(next, thread_sensitive=False)
+    while True:
+        item = await next_item(iterator, end)
+        if item is end:
+            break
+        yield item
+
+
+def worker_memory(request):
+    """Memory of the process serving the request, see ``memory_report''"""
+    return JsonResponse(process_memory())
+
+
+def translation_metrics(request):
+    """Metrics of the process serving the request in the Prometheus text
+    format, see ``metrics''"""
+    return HttpResponse(
+        render_metrics(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def translation_models(request):
+    """Models which can be requested and the resident ones, see
+    ``model_registry.resident_models''"""
+    return JsonResponse(resident_models())
+
+
+def upload_document(request):
+    if request.method == "POST":
+        form = DocumentForm(request.POST, request.FILES)
+        if form.is_valid():
             # get the target language selected on the form
             target_language = request.POST.get("target_language")
 
-            # translate the document
-            translate_document(
-                form.cleaned_data["translated_document"].name,
+            # store the document and queue its translation, the job row is
+            # the one listed on the main page
+            job = create_job(
+                form.cleaned_data["translated_document"],
                 target_language,
-                model,
+                form.cleaned_data["decoding_profile"],
+                form.cleaned_data["model"],
+                form.cleaned_data["profile"],
             )
 
-            # add a new row in the table when saving the file in `translate_document`
-            # added manually the preffix translated
-            translated_file_name = (
-                "translated_" + form.cleaned_data["translated_document"].name
-            )
-            Translation.objects.create(
-                translated_document=translated_file_name
-            )
+            if "application/json" in request.headers.get("Accept", ""):
+                return JsonResponse(job_status(job), status=202)
             return redirect("home")
     else:
         form = DocumentForm()
@@ -127,10 +310,26 @@ def upload_document(request):
     return render(
         request,
         "upload_document.html",
-        {"form": form, "available_languages": available_languages},
+        {
+            "form": form,
+            "available_languages": available_languages,
+            "available_models": model_choices(),
+        },
     )
 
 
+def translation_job_status(request, job_id):
+    job = get_object_or_404(Translation, pk=job_id)
+    return JsonResponse(job_status(job))
+
+
+def translation_job_result(request, job_id):
+    job = get_object_or_404(Translation, pk=job_id)
+    if job.status != Translation.STATUS_DONE:
+        return JsonResponse(job_status(job), status=409)
+    return serve_translated_document(request, job.translated_document.name)
+
+
 def serve_translated_document(request, filename):
     file_path = os.path.join(settings.MEDIA_ROOT, filename)
     if os.path.exists(file_path):
@@ -0,0 +1,154 @@
+"""Micro-benchmark of the text chunking: number of tokenizer calls and
+tokenized characters per paragraph with the former quadratic algorithm
+(re-tokenizing the growing chunk for every added sentence) and with
+``utils.chunk_text'' (every sentence tokenized once).
+
+Usage:
+    python benchmarks/chunking_benchmark.py [--tokenizer PATH_OR_NAME]
+
+Without --tokenizer a whitespace tokenizer is used, so no model has to be
+downloaded. Tokenizer calls are counted the same way in both cases.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+sys.path.insert(0, os.path.join(projpath, "src"))
+
+from utils import chunk_text  # noqa: E402
+
+SENTENCE = "The parties agree that the payment shall be made within thirty days"
+
+
+class WhitespaceTokenizer:
+    """Minimal tokenizer with one token per word and two special tokens"""
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 2
+
+    def encode(self, text, add_special_tokens=True):
+        ids = [hash(word) % 1000 for word in text.split()]
+        return [0] + ids + [2] if add_special_tokens else ids
+
+    def decode(self, ids):
+        return " ".join(str(idx) for idx in ids)
+
+    def __call__(self, text, add_special_tokens=True, return_tensors=None):
+        if isinstance(text, list):
+            ids = [self.encode(t, add_special_tokens) for t in text]
+        else:
+            ids = self.encode(text, add_special_tokens)
+        if return_tensors is not None:
+            ids = np.array([ids])
+        return {"input_ids": ids}
+
+
+class CountingTokenizer:
+    """Proxy which counts the calls and the characters sent to a tokenizer"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.calls = 0
+        self.characters = 0
+
+    def __call__(self, text, *args, **kwargs):
+        self.calls += 1
+        texts = text if isinstance(text, list) else [text]
+        self.characters += sum(len(t) for t in texts)
+        return self.tokenizer(text, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.tokenizer, name)
+
+
+def legacy_convert_text(original_paragraph, tokenizer, max_tokens):
+    """Former ``utils.convert_text'', kept here as the baseline"""
+    limited_tokens_sentences = []
+    original_paragraph = original_paragraph.strip()
+    sentences_list = original_paragraph.split(". ")
+    cummulative_sentence = sentences_list[0].strip()
+    for text in sentences_list[1:]:
+        t_cummulative_sentence = cummulative_sentence + ". " + text.strip()
+        n_tokens = tokenizer(t_cummulative_sentence, return_tensors="pt")[
+            "input_ids"
+        ].shape[1]
+        if n_tokens > max_tokens:
+            limited_tokens_sentences.append(cummulative_sentence.strip() + ".")
+            cummulative_sentence = text.strip()
+        else:
+            cummulative_sentence += ". " + text
+    limited_tokens_sentences.append(cummulative_sentence.strip())
+    # the caller tokenized every chunk again before ``generate''
+    for chunk in limited_tokens_sentences:
+        tokenizer(chunk, return_tensors="pt")
+    return limited_tokens_sentences
+
+
+def new_convert_text(original_paragraph, tokenizer, max_tokens):
+    """``utils.chunk_text'', the token ids are reused for ``generate''"""
+    return chunk_text(original_paragraph, tokenizer, max_tokens)
+
+
+def measure(function, paragraph, tokenizer, max_tokens, repeat):
+    # warm up, the first call of some tokenizers is much slower
+    function(paragraph, tokenizer, max_tokens)
+    counting_tokenizer = CountingTokenizer(tokenizer)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        chunks = function(paragraph, counting_tokenizer, max_tokens)
+    elapsed = (time.perf_counter() - start) / repeat
+    return {
+        "chunks": len(chunks),
+        "calls": counting_tokenizer.calls // repeat,
+        "characters": counting_tokenizer.characters // repeat,
+        "ms": elapsed * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--tokenizer", default=None)
+    parser.add_argument("--max-tokens", type=int, default=150)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(
+            args.tokenizer, src_lang="eng_Latn"
+        )
+    else:
+        tokenizer = WhitespaceTokenizer()
+
+    header = (
+        f"{'sentences':>9} | {'calls before':>12} {'calls after':>11} | "
+        f"{'chars before':>12} {'chars after':>11} | "
+        f"{'ms before':>9} {'ms after':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for n_sentences in [1, 5, 10, 25, 50, 100, 200]:
+        paragraph = ". ".join([SENTENCE] * n_sentences) + "."
+        before = measure(
+            legacy_convert_text, paragraph, tokenizer, args.max_tokens,
+            args.repeat,
+        )
+        after = measure(
+            new_convert_text, paragraph, tokenizer, args.max_tokens,
+            args.repeat,
+        )
+        print(
+            f"{n_sentences:>9} | {before['calls']:>12} {after['calls']:>11} | "
+            f"{before['characters']:>12} {after['characters']:>11} | "
+            f"{before['ms']:>9.2f} {after['ms']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
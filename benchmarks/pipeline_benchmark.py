@@ -0,0 +1,374 @@
+"""End-to-end benchmark of the document translation: synthetic documents
+of every supported type are translated with ``translation_app.translate_text''
+and a tiny randomly initialised model built locally, so it runs offline on a
+CPU-only machine. The translations are meaningless, the benchmark measures
+the pipeline: wall time of each stage, ``generate'' calls and generated
+tokens per second, peak resident memory and size of the output documents.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py [--formats docx pptx pdf
+        scanned_pdf] [--paragraphs 40] [--slides 10] [--pages 4]
+        [--repeat 3] [--output report.json]
+        [--baseline report.json --tolerance 0.25]
+
+The report is printed (or written to --output) as JSON. With --baseline,
+the number of ``generate'' calls and of generated tokens of every document
+must be the same as in the baseline report (they only depend on the seeds)
+and the wall time at most --tolerance slower, otherwise the script exits
+with status 1.
+
+The pdfs need the poppler utilities (``pdftoppm'' and ``pdftotext''), and
+the scanned pdf the easyocr models already downloaded: the documents whose
+requirements are missing are reported as skipped.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+sys.path.insert(0, os.path.join(projpath, "src"))
+
+import torch  # noqa: E402
+import transformers  # noqa: E402
+from transformers import AutoModelForSeq2SeqLM  # noqa: E402
+
+import pipeline_fixtures  # noqa: E402
+from decoding import configure_decoding  # noqa: E402
+from inference_backends import InferenceBackend, TorchBackend  # noqa: E402
+from save_document import save_translated_doc  # noqa: E402
+from tokenizer_registry import get_tokenizer  # noqa: E402
+from translation_app import translate_text  # noqa: E402
+from translation_memory import configure_translation_memory  # noqa: E402
+
+# document types of the benchmark and their extension
+FORMATS = {
+    "docx": "docx",
+    "pptx": "pptx",
+    "pdf": "pdf",
+    "scanned_pdf": "pdf",
+}
+# files of the easyocr models needed by the scanned pdf
+OCR_MODELS = ("craft_mlt_25k.pth", "english_g2.pth")
+
+
+class CountingBackend(InferenceBackend):
+    """Proxy which counts the ``generate'' calls of a backend, their
+    sequences and tokens and the time spent in them"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.sequences = 0
+        self.source_tokens = 0
+        self.generated_tokens = 0
+        self.seconds = 0.0
+
+    def generate(self, input_ids, lang_dest_id, **options):
+        start = time.perf_counter()
+        output_ids = self.backend.generate(input_ids, lang_dest_id, **options)
+        self.seconds += time.perf_counter() - start
+        self.calls += 1
+        self.sequences += len(input_ids)
+        self.source_tokens += sum(len(ids) for ids in input_ids)
+        self.generated_tokens += sum(len(ids) for ids in output_ids)
+        return output_ids
+
+
+def reset_peak_rss():
+    """Resets the peak resident memory of the process (Linux only), returns
+    whether the peak of each document can be measured"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak resident memory of the process in MiB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # kB on Linux, the peak of the whole process
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def missing_requirements(document_format):
+    """Reason why a document type can not be benchmarked here, or None"""
+    if document_format in ("pdf", "scanned_pdf"):
+        for command in ("pdftoppm", "pdftotext"):
+            if shutil.which(command) is None:
+                return f"{command} (poppler) not found"
+    if document_format == "scanned_pdf":
+        easyocr_path = os.environ.get(
+            "EASYOCR_MODULE_PATH", os.path.expanduser("~/.EasyOCR")
+        )
+        for name in OCR_MODELS:
+            if not os.path.exists(os.path.join(easyocr_path, "model", name)):
+                return f"easyocr model {name} not found in {easyocr_path}"
+    return None
+
+
+def make_document(document_format, path, args):
+    """Writes the synthetic document of a type, returns its size"""
+    if document_format == "docx":
+        pipeline_fixtures.make_docx(path, args.paragraphs, seed=args.seed)
+        size = {"paragraphs": args.paragraphs}
+    elif document_format == "pptx":
+        pipeline_fixtures.make_pptx(path, args.slides, seed=args.seed)
+        size = {"slides": args.slides}
+    elif document_format == "pdf":
+        pipeline_fixtures.make_text_pdf(
+            path, args.pages, args.paragraphs_per_page, args.seed
+        )
+        size = {"pages": args.pages}
+    else:
+        pipeline_fixtures.make_scanned_pdf(
+            path, args.pages, args.paragraphs_per_page, args.seed
+        )
+        size = {"pages": args.pages}
+    return size
+
+
+def run_document(document_format, input_path, output_path, backend, args):
+    """Translates a document once and measures it"""
+    backend.reset()
+    per_document_peak = reset_peak_rss()
+    timings = {}
+    start = time.perf_counter()
+    translated_document = translate_text(
+        doc_filepath=input_path,
+        max_tokens=args.max_tokens,
+        models_path=args.models_path,
+        model_name=args.model_name,
+        lang_orig_code="eng_Latn",
+        lang_dest_code="spa_Latn",
+        document_type=FORMATS[document_format],
+        loaded_model=backend,
+        batch_size=args.batch_size,
+        max_batch_tokens=args.max_batch_tokens,
+        decoding_profile=args.decoding_profile,
+        timings=timings,
+    )
+    save_start = time.perf_counter()
+    save_translated_doc(
+        translated_document, output_path, FORMATS[document_format]
+    )
+    timings["save"] = time.perf_counter() - save_start
+    wall_time = time.perf_counter() - start
+
+    return {
+        "wall_time": wall_time,
+        "timings": timings,
+        "generate_calls": backend.calls,
+        "sequences": backend.sequences,
+        "source_tokens": backend.source_tokens,
+        "generated_tokens": backend.generated_tokens,
+        "generate_time": backend.seconds,
+        "tokens_per_second": backend.generated_tokens
+        / max(backend.seconds, 1e-9),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_scope": "document" if per_document_peak else "process",
+        "output_size": os.path.getsize(output_path),
+    }
+
+
+def benchmark_document(document_format, workdir, backend, args):
+    """Translates a document ``args.repeat'' times, the run with the median
+    wall time is reported"""
+    reason = missing_requirements(document_format)
+    if reason is not None:
+        return {"format": document_format, "skipped": reason}
+
+    extension = FORMATS[document_format]
+    input_path = os.path.join(workdir, f"{document_format}.{extension}")
+    output_path = os.path.join(
+        workdir, f"translated_{document_format}.{extension}"
+    )
+    size = make_document(document_format, input_path, args)
+    runs = [
+        run_document(document_format, input_path, output_path, backend, args)
+        for _ in range(args.repeat)
+    ]
+    wall_times = [run["wall_time"] for run in runs]
+    report = sorted(runs, key=lambda run: run["wall_time"])[len(runs) // 2]
+    return {
+        "format": document_format,
+        "size": size,
+        "input_size": os.path.getsize(input_path),
+        **report,
+        "wall_times": wall_times,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Regressions of a report with respect to a baseline report"""
+    regressions = []
+    for key in ("model", "settings"):
+        ignored = ("parameters", "setup_time", "repeat")
+        report_values = {
+            name: value
+            for name, value in report[key].items()
+            if name not in ignored
+        }
+        baseline_values = {
+            name: value
+            for name, value in baseline[key].items()
+            if name not in ignored
+        }
+        if report_values != baseline_values:
+            regressions.append(
+                f"{key} {report_values} differs from the baseline "
+                f"{baseline_values}"
+            )
+    baseline_documents = {
+        document["format"]: document
+        for document in baseline["documents"]
+        if "skipped" not in document
+    }
+    for document in report["documents"]:
+        reference = baseline_documents.get(document["format"])
+        if reference is None or "skipped" in document:
+            continue
+        if document["size"] != reference["size"]:
+            regressions.append(
+                f"{document['format']}: size {document['size']} differs "
+                f"from the baseline {reference['size']}"
+            )
+            continue
+        for key in ("generate_calls", "generated_tokens"):
+            if document[key] != reference[key]:
+                regressions.append(
+                    f"{document['format']}: {key} {document[key]} "
+                    f"(baseline {reference[key]})"
+                )
+        if document["wall_time"] > reference["wall_time"] * (1 + tolerance):
+            regressions.append(
+                f"{document['format']}: wall time "
+                f"{document['wall_time']:.3f} s (baseline "
+                f"{reference['wall_time']:.3f} s)"
+            )
+    return regressions
+
+
+def run_benchmark(args):
+    """Builds the model and the documents and benchmarks them, returns the
+    report"""
+    workdir = args.workdir or tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    args.models_path = os.path.join(workdir, "models")
+
+    # every chunk is translated by the model, and nothing is logged
+    configure_translation_memory(enabled=False)
+    configure_decoding(length_log=None)
+
+    start = time.perf_counter()
+    model_path = pipeline_fixtures.build_tiny_model(
+        args.models_path, args.d_model, args.layers, seed=args.seed
+    )
+    args.model_name = os.path.basename(model_path)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_path).eval()
+    backend = CountingBackend(TorchBackend(model))
+    get_tokenizer(args.model_name, args.models_path)
+    setup_time = time.perf_counter() - start
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "cpus": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+        },
+        "model": {
+            "d_model": args.d_model,
+            "layers": args.layers,
+            "parameters": sum(p.numel() for p in model.parameters()),
+            "setup_time": setup_time,
+        },
+        "settings": {
+            "max_tokens": args.max_tokens,
+            "batch_size": args.batch_size,
+            "max_batch_tokens": args.max_batch_tokens,
+            "decoding_profile": args.decoding_profile,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "documents": [],
+    }
+    for document_format in args.formats:
+        report["documents"].append(
+            benchmark_document(document_format, workdir, backend, args)
+        )
+
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--formats", nargs="+", choices=list(FORMATS), default=list(FORMATS)
+    )
+    parser.add_argument("--paragraphs", type=int, default=40)
+    parser.add_argument("--slides", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--paragraphs-per-page", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--d-model", type=int, default=64)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--max-tokens", type=int, default=150)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-batch-tokens", type=int, default=4096)
+    parser.add_argument("--decoding-profile", default="document")
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        help="Folder of the model and the documents, a temporary one if "
+        "not given (the model is reused from it)",
+    )
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # the progress printed by the pipeline does not mix with the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmark(args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
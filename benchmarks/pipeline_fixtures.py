@@ -0,0 +1,257 @@
+"""Synthetic fixtures of the pipeline benchmark: documents of every
+supported type with generated text, and a tiny randomly initialised NLLB
+model (M2M100 architecture with a sentencepiece vocabulary trained on the
+same words), so the benchmark needs no download.
+
+The texts and the weights only depend on the seeds, so two runs with the
+same parameters translate the same chunks and generate the same tokens.
+"""
+import os
+import random
+import textwrap
+
+from PIL import Image, ImageDraw, ImageFont
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+FONT_PATH = os.path.join(projpath, "fonts", "arial.ttf")
+
+WORDS = (
+    "the parties agree that payment shall be made within thirty days of "
+    "receipt of the corresponding invoice unless otherwise stated in annex "
+    "supplier customer contract term clause notice written delivery goods "
+    "services price total amount period agreement"
+).split()
+
+# prefix of the name of the tiny models, in the models folder of the
+# benchmark
+TINY_MODEL_NAME = "nllb-tiny-random"
+# letter page, in points (pdf) and in pixels at 150 dpi (scanned pdf)
+PAGE_POINTS = (612, 792)
+SCAN_DPI = 150
+
+
+def synthetic_paragraphs(n_paragraphs, sentences=4, seed=0):
+    """Paragraphs of random sentences of ``WORDS''"""
+    rng = random.Random(seed)
+    paragraphs = []
+    for _ in range(n_paragraphs):
+        paragraph = []
+        for _ in range(sentences):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(8, 20))]
+            paragraph.append(" ".join(words).capitalize() + ".")
+        paragraphs.append(" ".join(paragraph))
+    return paragraphs
+
+
+def make_docx(path, n_paragraphs, sentences=4, seed=0):
+    """Word document with a title, ``n_paragraphs'' paragraphs, a table and
+    a header"""
+    from docx import Document
+
+    paragraphs = synthetic_paragraphs(n_paragraphs + 5, sentences, seed)
+    document = Document()
+    document.sections[0].header.paragraphs[0].text = paragraphs.pop()
+    document.add_heading(paragraphs.pop(), level=1)
+    for paragraph in paragraphs[:n_paragraphs]:
+        document.add_paragraph(paragraph)
+    table = document.add_table(rows=1, cols=3)
+    for cell, text in zip(table.rows[0].cells, paragraphs[n_paragraphs:]):
+        cell.text = text
+    document.save(path)
+
+
+def make_pptx(path, n_slides, paragraphs_per_slide=3, sentences=2, seed=0):
+    """Presentation with ``n_slides'' title and content slides"""
+    from pptx import Presentation
+
+    paragraphs = synthetic_paragraphs(
+        n_slides * (paragraphs_per_slide + 1), sentences, seed
+    )
+    presentation = Presentation()
+    layout = presentation.slide_layouts[1]
+    for idx in range(n_slides):
+        slide = presentation.slides.add_slide(layout)
+        texts = paragraphs[idx * (paragraphs_per_slide + 1) :]
+        slide.shapes.title.text = texts[0][:60]
+        body = slide.placeholders[1].text_frame
+        body.text = texts[1]
+        for text in texts[2 : paragraphs_per_slide + 1]:
+            body.add_paragraph().text = text
+    presentation.save(path)
+
+
+def page_lines(paragraphs, width):
+    """Lines of the paragraphs wrapped to ``width'' characters, with an
+    empty line between paragraphs"""
+    lines = []
+    for paragraph in paragraphs:
+        lines.extend(textwrap.wrap(paragraph, width))
+        lines.append("")
+    return lines
+
+
+def make_text_pdf(path, n_pages, paragraphs_per_page=5, seed=0):
+    """Born-digital pdf: every page has a text layer (Helvetica text
+    objects), written directly as PDF 1.4 so no pdf library is needed"""
+    paragraphs = synthetic_paragraphs(n_pages * paragraphs_per_page, 3, seed)
+    # catalog, page tree and font, then a page and its content per page
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(n_pages):
+        lines = page_lines(
+            paragraphs[page * paragraphs_per_page :][:paragraphs_per_page],
+            95,
+        )
+        text = "".join(
+            "({}) Tj T* ".format(
+                line.replace("\\", "\\\\")
+                .replace("(", "\\(")
+                .replace(")", "\\)")
+            )
+            for line in lines
+        )
+        stream = f"BT /F1 10 Tf 13 TL 50 {PAGE_POINTS[1] - 60} Td {text}ET"
+        page_id = len(objects) + 1
+        kids.append(f"{page_id} 0 R")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R "
+            f"/MediaBox [0 0 {PAGE_POINTS[0]} {PAGE_POINTS[1]}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {page_id + 1} 0 R >>"
+        )
+        objects.append(
+            f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream"
+        )
+    objects[1] = (
+        f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {n_pages} >>"
+    )
+
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(content)
+    content += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        content += f"{offset:010d} 00000 n \n".encode()
+    content += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n"
+    ).encode()
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def make_scanned_pdf(path, n_pages, paragraphs_per_page=5, seed=0):
+    """Scanned pdf: every page is an image of its text, without text layer,
+    so it has to be OCR'd"""
+    paragraphs = synthetic_paragraphs(n_pages * paragraphs_per_page, 3, seed)
+    size = [int(points * SCAN_DPI / 72) for points in PAGE_POINTS]
+    font = ImageFont.truetype(FONT_PATH, 20)
+    images = []
+    for page in range(n_pages):
+        image = Image.new("RGB", size, "white")
+        draw = ImageDraw.Draw(image)
+        lines = page_lines(
+            paragraphs[page * paragraphs_per_page :][:paragraphs_per_page],
+            95,
+        )
+        for idx, line in enumerate(lines):
+            draw.text((100, 120 + 28 * idx), line, fill="black", font=font)
+        images.append(image)
+    images[0].save(
+        path, "PDF", resolution=SCAN_DPI, save_all=True,
+        append_images=images[1:],
+    )
+
+
+def build_tiny_model(
+    models_path, d_model=64, layers=2, vocab_size=120, seed=0
+):
+    """Function to build (once) the tiny model of the benchmark.
+
+    Parameters
+    ----------
+    models_path : str
+        Folder where the model is saved
+    d_model : int
+        Hidden size of the model
+    layers : int
+        Number of encoder and decoder layers
+    vocab_size : int
+        Max pieces of the sentencepiece vocabulary, without the language
+        codes
+    seed : int
+        Seed of the vocabulary and of the weights
+
+    Returns
+    -------
+    model_path : str
+        Folder of the model and its tokenizer, its name depends on the
+        parameters
+    """
+    model_path = os.path.join(
+        models_path,
+        f"{TINY_MODEL_NAME}-d{d_model}-l{layers}-v{vocab_size}-s{seed}",
+    )
+    if os.path.exists(os.path.join(model_path, "config.json")):
+        return model_path
+
+    import sentencepiece
+    import torch
+    from transformers import (
+        M2M100Config,
+        M2M100ForConditionalGeneration,
+        NllbTokenizer,
+    )
+
+    os.makedirs(model_path, exist_ok=True)
+    corpus_path = os.path.join(model_path, "corpus.txt")
+    with open(corpus_path, "w") as f:
+        f.write("\n".join(synthetic_paragraphs(500, 1, seed)))
+    sentencepiece.SentencePieceTrainer.train(
+        input=corpus_path,
+        model_prefix=os.path.join(model_path, "sentencepiece"),
+        vocab_size=vocab_size,
+        # smaller vocabulary if the words do not have enough pieces
+        hard_vocab_limit=False,
+        model_type="unigram",
+        bos_id=0,
+        pad_id=1,
+        eos_id=2,
+        unk_id=3,
+        num_threads=1,
+        minloglevel=2,
+    )
+    tokenizer = NllbTokenizer(
+        vocab_file=os.path.join(model_path, "sentencepiece.model"),
+        src_lang="eng_Latn",
+    )
+    tokenizer.save_pretrained(model_path)
+
+    config = M2M100Config(
+        vocab_size=len(tokenizer),
+        d_model=d_model,
+        encoder_layers=layers,
+        decoder_layers=layers,
+        encoder_attention_heads=4,
+        decoder_attention_heads=4,
+        encoder_ffn_dim=4 * d_model,
+        decoder_ffn_dim=4 * d_model,
+        max_position_embeddings=1024,
+        pad_token_id=tokenizer.pad_token_id,
+        bos_token_id=0,
+        eos_token_id=2,
+        decoder_start_token_id=2,
+    )
+    torch.manual_seed(seed)
+    M2M100ForConditionalGeneration(config).save_pretrained(model_path)
+    for name in ("corpus.txt", "sentencepiece.model", "sentencepiece.vocab"):
+        os.remove(os.path.join(model_path, name))
+    return model_path
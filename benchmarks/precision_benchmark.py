@@ -0,0 +1,207 @@
+"""Quality and speed of the precision modes of the translation model
+(``utils.load_model''): load time, BLEU and chrF against the references of
+a small bundled sample, and generated tokens per second.
+
+Usage:
+    python benchmarks/precision_benchmark.py [--model MODEL]
+        [--precisions fp32 bf16 int8] [--cache-dir models/quantized]
+        [--onnx models/onnx/nllb-200-distilled-600M]
+
+With ``--onnx'' the graphs exported with ``src/export_onnx.py'' are also
+run with the ONNX Runtime backend (``inference_backends.OnnxBackend'').
+
+By default the facebook/nllb-200-distilled-600M model is used.
+
+BLEU (4-grams, brevity penalty, words and punctuation as tokens) and chrF
+(character 6-grams, beta 2) are computed here with the usual corpus-level
+definitions, so no extra package is needed. Scores are only comparable
+between runs of this script.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+sys.path.insert(0, os.path.join(projpath, "src"))
+
+from transformers import AutoTokenizer  # noqa: E402
+
+from batch_translation import generate_translations  # noqa: E402
+from inference_backends import OnnxBackend  # noqa: E402
+from utils import load_model, PRECISIONS  # noqa: E402
+
+SAMPLE_PATH = os.path.join(
+    projpath, "benchmarks", "data", "eng_spa_sample.json"
+)
+
+
+def ngrams(tokens, n):
+    return Counter(
+        tuple(tokens[i : i + n]) for i in range(len(tokens) - n + 1)
+    )
+
+
+def corpus_bleu(hypotheses, references, max_order=4):
+    """Corpus BLEU (0-100) of the hypotheses against one reference each"""
+    matches = [0] * max_order
+    totals = [0] * max_order
+    hypothesis_length = reference_length = 0
+    for hypothesis, reference in zip(hypotheses, references):
+        hypothesis = re.findall(r"\w+|[^\w\s]", hypothesis.lower())
+        reference = re.findall(r"\w+|[^\w\s]", reference.lower())
+        hypothesis_length += len(hypothesis)
+        reference_length += len(reference)
+        for n in range(1, max_order + 1):
+            hypothesis_ngrams = ngrams(hypothesis, n)
+            matches[n - 1] += sum(
+                (hypothesis_ngrams & ngrams(reference, n)).values()
+            )
+            totals[n - 1] += max(len(hypothesis) - n + 1, 0)
+
+    if min(matches) == 0:
+        return 0.0
+    log_precision = sum(
+        math.log(match / total) for match, total in zip(matches, totals)
+    )
+    brevity_penalty = min(0.0, 1 - reference_length / hypothesis_length)
+    return 100 * math.exp(brevity_penalty + log_precision / max_order)
+
+
+def corpus_chrf(hypotheses, references, max_order=6, beta=2):
+    """Corpus chrF (0-100) of the hypotheses against one reference each"""
+    matches = [0] * max_order
+    hypothesis_totals = [0] * max_order
+    reference_totals = [0] * max_order
+    for hypothesis, reference in zip(hypotheses, references):
+        hypothesis = "".join(hypothesis.split())
+        reference = "".join(reference.split())
+        for n in range(1, max_order + 1):
+            hypothesis_ngrams = ngrams(hypothesis, n)
+            reference_ngrams = ngrams(reference, n)
+            matches[n - 1] += sum(
+                (hypothesis_ngrams & reference_ngrams).values()
+            )
+            hypothesis_totals[n - 1] += sum(hypothesis_ngrams.values())
+            reference_totals[n - 1] += sum(reference_ngrams.values())
+
+    precision = sum(
+        match / total if total else 0
+        for match, total in zip(matches, hypothesis_totals)
+    ) / max_order
+    recall = sum(
+        match / total if total else 0
+        for match, total in zip(matches, reference_totals)
+    ) / max_order
+    if precision + recall == 0:
+        return 0.0
+    return (
+        100
+        * (1 + beta**2)
+        * precision
+        * recall
+        / (beta**2 * precision + recall)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--model", default="facebook/nllb-200-distilled-600M")
+    parser.add_argument("--tokenizer", default=None)
+    parser.add_argument(
+        "--precisions", nargs="+", default=list(PRECISIONS), choices=PRECISIONS
+    )
+    parser.add_argument(
+        "--cache-dir", default=os.path.join(projpath, "models", "quantized")
+    )
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=150)
+    parser.add_argument("--sample", default=SAMPLE_PATH)
+    parser.add_argument("--onnx", default=None)
+    args = parser.parse_args()
+
+    with open(args.sample) as f:
+        sample = json.load(f)
+    sources = [source for source, _ in sample["pairs"]]
+    references = [reference for _, reference in sample["pairs"]]
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer or args.model)
+
+    loaders = [
+        (
+            precision,
+            lambda p=precision: load_model(args.model, p, args.cache_dir),
+        )
+        for precision in args.precisions
+    ]
+    if args.onnx:
+        loaders.append(("onnx", lambda: OnnxBackend(args.onnx)))
+
+    results = []
+    for precision, loader in loaders:
+        start = time.perf_counter()
+        model = loader()
+        load_time = time.perf_counter() - start
+
+        # warm up, the first generation allocates the buffers
+        generate_translations(
+            sources[:1],
+            tokenizer,
+            model,
+            args.max_tokens,
+            sample["tgt_lang"],
+            lang_origin_code=sample["src_lang"],
+        )
+        start = time.perf_counter()
+        hypotheses = generate_translations(
+            sources,
+            tokenizer,
+            model,
+            args.max_tokens,
+            sample["tgt_lang"],
+            args.batch_size,
+            lang_origin_code=sample["src_lang"],
+        )
+        elapsed = time.perf_counter() - start
+        generated_tokens = sum(
+            len(ids)
+            for ids in tokenizer(hypotheses, add_special_tokens=False)[
+                "input_ids"
+            ]
+        )
+        results.append(
+            {
+                "precision": precision,
+                "load_s": load_time,
+                "bleu": corpus_bleu(hypotheses, references),
+                "chrf": corpus_chrf(hypotheses, references),
+                "tokens_per_s": generated_tokens / elapsed,
+                "total_s": elapsed,
+            }
+        )
+        del model
+
+    print(
+        f"{len(sources)} sentences "
+        f"{sample['src_lang']} -> {sample['tgt_lang']}"
+    )
+    header = (
+        f"{'precision':>9} | {'load s':>7} | {'BLEU':>6} {'chrF':>6} | "
+        f"{'tokens/s':>9} {'total s':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['precision']:>9} | {result['load_s']:>7.2f} | "
+            f"{result['bleu']:>6.2f} {result['chrf']:>6.2f} | "
+            f"{result['tokens_per_s']:>9.1f} {result['total_s']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
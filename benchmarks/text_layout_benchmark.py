@@ -0,0 +1,170 @@
+"""Micro-benchmark of the text fitting used to render the translated pdf
+pages: time and glyph measurements to write the text of a dense page with
+the former algorithm (font reloaded and text rewrapped for every size from
+72 down in steps of 2, measuring every growing line prefix) and with
+``text_layout.draw_text'' (cached fonts and word widths, binary-searched
+size, linear wrap).
+
+Usage:
+    python benchmarks/text_layout_benchmark.py [--boxes 120] [--repeat 3]
+
+The former algorithm takes seconds per box, so it is only run on the first
+--baseline-boxes boxes and its time is extrapolated to the whole page.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import warnings
+
+from PIL import Image, ImageDraw, ImageFont
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+sys.path.insert(0, os.path.join(projpath, "src"))
+
+import text_layout  # noqa: E402
+
+WORDS = (
+    "the parties agree that payment shall be made within thirty days of "
+    "receipt of the corresponding invoice unless otherwise stated in annex"
+).split()
+PAGE_SIZE = (1700, 2200)
+
+
+def dense_page(n_boxes, seed=0):
+    """Boxes of a text dense page (two columns of paragraphs) with random
+    texts, as (text, coords)"""
+    random.seed(seed)
+    boxes = []
+    rows = (n_boxes + 1) // 2
+    row_height = (PAGE_SIZE[1] - 100) // rows
+    for idx in range(n_boxes):
+        column, row = idx % 2, idx // 2
+        left = 50 + column * 825
+        top = 50 + row * row_height
+        text = " ".join(random.choices(WORDS, k=random.randint(5, 40)))
+        coords = {
+            "left": left,
+            "top": top,
+            "right": left + 800,
+            "bottom": top + row_height - 4,
+        }
+        boxes.append((text, coords))
+    return boxes
+
+
+class CountingFont:
+    """Proxy which counts the measurements of a font"""
+
+    calls = 0
+
+    def __init__(self, font):
+        self.font = font
+
+    def getsize(self, text):
+        CountingFont.calls += 1
+        return self.font.getsize(text)
+
+    def __getattr__(self, name):
+        return getattr(self.font, name)
+
+
+def legacy_text_wrap(text, font, max_width):
+    """Former ``save_document.text_wrap'', kept here as the baseline"""
+    lines = []
+    if font.getsize(text)[0] <= max_width:
+        lines.append(text)
+    else:
+        words = text.split(" ")
+        i = 0
+        while i < len(words):
+            line = ""
+            while (
+                i < len(words)
+                and font.getsize(line + words[i])[0] <= max_width
+            ):
+                line = line + words[i] + " "
+                i += 1
+            if not line:
+                line = words[i]
+                i += 1
+            lines.append(line.strip())
+    return lines
+
+
+def legacy_draw_text(draw, text, coords):
+    """Former ``save_document.write_text_on_rectangle'' fitting loop"""
+    max_width = coords["right"] - coords["left"]
+    max_height = coords["bottom"] - coords["top"]
+    font_size = 72
+    font_path = os.path.join(text_layout.FONTS_PATH, text_layout.DEFAULT_FONT)
+    origin = (coords["left"], coords["top"])
+    line_heights = 1e10
+    while line_heights > max_height and font_size > 0:
+        font = CountingFont(ImageFont.truetype(font_path, size=font_size))
+        lines = legacy_text_wrap(text, font, max_width)
+        bbox = draw.textbbox(origin, "\n".join(lines), font=font.font)
+        line_heights = bbox[3] - bbox[1]
+        font_size -= 2
+    draw.text(origin, "\n".join(lines), font=font.font, fill="black")
+
+
+def new_draw_text(draw, text, coords):
+    """``text_layout.draw_text''"""
+    text_layout.draw_text(draw, text, coords)
+
+
+def measure(function, boxes, repeat):
+    timings = []
+    for _ in range(repeat):
+        image = Image.new("RGB", PAGE_SIZE, "white")
+        draw = ImageDraw.Draw(image)
+        start = time.perf_counter()
+        for text, coords in boxes:
+            function(draw, text, coords)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--boxes", type=int, default=120)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline-boxes", type=int, default=10)
+    args = parser.parse_args()
+    # ``getsize'' is deprecated in recent Pillow versions
+    warnings.simplefilter("ignore", DeprecationWarning)
+
+    boxes = dense_page(args.boxes)
+
+    baseline_boxes = boxes[: args.baseline_boxes]
+    CountingFont.calls = 0
+    before = measure(legacy_draw_text, baseline_boxes, 1)
+    scale = len(boxes) / len(baseline_boxes)
+    before *= scale
+    measurements = int(CountingFont.calls * scale)
+
+    # the first page pays the loading of the fonts, the next ones use the
+    # cached fonts and widths
+    text_layout.load_font.cache_clear()
+    text_layout.word_width.cache_clear()
+    text_layout.line_metrics.cache_clear()
+    cold = measure(new_draw_text, boxes, 1)
+    warm = measure(new_draw_text, dense_page(args.boxes, 1), args.repeat)
+    info = text_layout.word_width.cache_info()
+
+    print(f"{args.boxes} boxes on a {PAGE_SIZE[0]}x{PAGE_SIZE[1]} page")
+    print(
+        f"before: {before:9.1f} ms, {measurements} text measurements "
+        f"(extrapolated from {len(baseline_boxes)} boxes)"
+    )
+    print(
+        f"after:  {cold:9.1f} ms on the first page, {warm:.1f} ms on the "
+        f"next ones, {info.misses} word measurements"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Configuration of gunicorn for serving the application with several
+worker processes sharing a single copy of the translation model:
+
+    gunicorn -c gunicorn.conf.py
+
+The application (and so the model, see ``application/views.py``) is loaded
+once in the master process before the workers are forked, and the weights
+are shared copy-on-write by all of them as they are only read. The memory
+of the workers can be checked with ``python src/memory_report.py <pid>``
+or the ``memory/`` endpoint of each worker.
+"""
+import gc
+import multiprocessing
+import os
+
+wsgi_app = "application.wsgi:application"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+# threads of each worker, the text box streams its translation
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+# documents are translated in background jobs, but a long text can take a
+# while
+timeout = 300
+preload_app = True
+
+
+def when_ready(server):
+    # Django imports the views, which load the model, on the first request,
+    # so they are imported in the master before forking the workers
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+
+
+def pre_fork(server, worker):
+    # the objects of the master are moved to a permanent generation, so the
+    # garbage collector of the workers does not write on (and copy) their
+    # pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import torch
+
+    # the cores are split between the workers instead of every worker using
+    # all of them
+    torch.set_num_threads(max(1, multiprocessing.cpu_count() // workers))
+
+
+def post_worker_init(worker):
+    # the job threads are started in the workers, not in the master which
+    # imported the application, see ``application.jobs.start_jobs''
+    from application.jobs import start_jobs
+
+    start_jobs(forked=True)
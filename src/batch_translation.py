@@ -0,0 +1,308 @@
+import time
+from tqdm import tqdm
+from utils import chunk_text
+from translation_memory import get_translation_memory
+from tokenizer_registry import build_inputs
+from inference_backends import as_backend
+from decoding import (
+    generation_cap,
+    get_profile,
+    length_ratio,
+    record_lengths,
+    trim_repetition,
+)
+from metrics import (
+    BATCH_SIZE,
+    CHUNKS,
+    SEGMENTS,
+    TOKENS,
+    count_cache,
+    document_type,
+    observe_stage,
+)
+
+
+def make_batches(lengths, batch_size, max_batch_tokens):
+    """Function to group chunks into length buckets. Chunks are sorted by
+    their number of tokens so that every batch contains sequences of similar
+    length and the padding added by the tokenizer stays small.
+
+    Parameters
+    ----------
+    lengths : list
+        Number of tokens of each chunk
+    batch_size : int
+        Max number of chunks included in each batch
+    max_batch_tokens : int
+        Max number of tokens (padding included) in each batch
+
+    Returns
+    -------
+    batches : list
+        List of lists with the indexes of the chunks in each batch
+    """
+    # sort the chunks from the shortest to the longest
+    order = sorted(range(len(lengths)), key=lambda idx: lengths[idx])
+
+    batches = []
+    batch = []
+    for idx in order:
+        # the padded size of a batch is given by its longest element, which
+        # is always the last one appended as the chunks are sorted
+        padded_tokens = (len(batch) + 1) * lengths[idx]
+        if batch and (
+            len(batch) >= batch_size or padded_tokens > max_batch_tokens
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def translate_batch(
+    texts,
+    tokenizer,
+    model,
+    max_tokens,
+    lang_dest_code,
+    batch_size=16,
+    max_batch_tokens=4096,
+    model_name=None,
+    lang_origin_code=None,
+    decoding_profile=None,
+):
+    """Function to translate a list of texts with padded batched generation.
+    Repeated texts are translated once and, when the model name is given,
+    the texts already stored in the translation memory are not translated
+    again. The rest are translated with ``generate_translations''.
+
+    Parameters
+    ----------
+    texts : list
+        Texts to translate, already preprocessed
+    tokenizer : NllbTokenizerFast
+        tool that converts text to tokens
+    model : AutoModelForSeq2SeqLM | InferenceBackend
+        Loaded translation model or backend running it, see
+        ``inference_backends''
+    max_tokens : int
+        Max number of tokens included in each chunk
+    lang_dest_code : str
+        Langugage code in BCP-47 of the desired output
+    batch_size : int
+        Max number of chunks translated in each ``generate'' call
+    max_batch_tokens : int
+        Max number of tokens (padding included) in each ``generate'' call
+    model_name : str | None
+        Name of the model, used as part of the translation memory key. If
+        None the translation memory is not used.
+    lang_origin_code : str | None
+        Langugage code in BCP-47 of the original text. If None, the source
+        language of the tokenizer is used.
+    decoding_profile : str | None
+        Name of the decoding profile, see ``decoding''. By default, the one
+        of the documents.
+
+    Returns
+    -------
+    translated_texts : list
+        Translated texts in the same order as the input
+    """
+    # the same segment is only translated once, empty ones are not
+    unique_texts = [text for text in dict.fromkeys(texts) if text]
+    translations = {"": ""}
+
+    memory = get_translation_memory() if model_name else None
+    if memory is not None:
+        # the translations of other decoding profiles or model precisions
+        # are not reused, see ``TranslationMemory.store''
+        variant = "{}|{}".format(
+            get_profile(decoding_profile)[0], as_backend(model).variant
+        )
+        found = memory.lookup(
+            model_name,
+            lang_origin_code,
+            lang_dest_code,
+            unique_texts,
+            variant,
+        )
+        for idx, translation in found.items():
+            translations[unique_texts[idx]] = translation
+        count_cache(
+            "translation_memory", len(found), len(unique_texts) - len(found)
+        )
+
+    pending = [text for text in unique_texts if text not in translations]
+    SEGMENTS.inc(len(texts), document_type=document_type())
+    if pending:
+        pending_translations = generate_translations(
+            pending,
+            tokenizer,
+            model,
+            max_tokens,
+            lang_dest_code,
+            batch_size,
+            max_batch_tokens,
+            lang_origin_code,
+            decoding_profile,
+        )
+        translations.update(zip(pending, pending_translations))
+        if memory is not None:
+            memory.store(
+                model_name,
+                lang_origin_code,
+                lang_dest_code,
+                pending,
+                pending_translations,
+                variant,
+            )
+
+    return [translations[text] for text in texts]
+
+
+def stream_translation(
+    text,
+    tokenizer,
+    model,
+    max_tokens,
+    lang_dest_code,
+    batch_size=16,
+    max_batch_tokens=4096,
+    model_name=None,
+    lang_origin_code=None,
+    decoding_profile=None,
+):
+    """Function to translate a text chunk by chunk, in order. The first
+    chunk is translated alone so its translation is available after the
+    latency of a single chunk, and the next groups double their size up to
+    ``batch_size'' chunks. See ``translate_batch'' for the parameters.
+
+    Yields
+    ------
+    translated_chunk : str
+        Translation of each chunk of the text
+    """
+    chunks = [
+        chunk
+        for chunk, chunk_ids in chunk_text(text, tokenizer, max_tokens)
+        if chunk_ids
+    ]
+    start, size = 0, 1
+    while start < len(chunks):
+        yield from translate_batch(
+            chunks[start : start + size],
+            tokenizer,
+            model,
+            max_tokens,
+            lang_dest_code,
+            batch_size,
+            max_batch_tokens,
+            model_name,
+            lang_origin_code,
+            decoding_profile,
+        )
+        start += size
+        size = min(2 * size, batch_size)
+
+
+def generate_translations(
+    texts,
+    tokenizer,
+    model,
+    max_tokens,
+    lang_dest_code,
+    batch_size=16,
+    max_batch_tokens=4096,
+    lang_origin_code=None,
+    decoding_profile=None,
+):
+    """Function to translate a list of texts with the model. Every text is
+    split into chunks of limited length, all the chunks of all the texts are
+    sorted into length buckets and translated together with padded batched
+    generation, and finally the translated chunks are joined back into their
+    texts. The generated tokens of each batch are capped by its longest
+    chunk, see ``decoding.generation_cap''. See ``translate_batch'' for the
+    parameters.
+    """
+    profile_name, profile = get_profile(decoding_profile)
+    source_lang = lang_origin_code or tokenizer.src_lang
+    ratio = length_ratio(source_lang, lang_dest_code)
+
+    # split every text into chunks and keep track of the text they belong to,
+    # the token ids computed while chunking are reused for the generation
+    start = time.time()
+    input_ids = []
+    owners = []
+    for idx, text in enumerate(texts):
+        for _, chunk_ids in chunk_text(text, tokenizer, max_tokens):
+            if not chunk_ids:
+                continue
+            input_ids.append(
+                build_inputs(tokenizer, chunk_ids, lang_origin_code)
+            )
+            owners.append(idx)
+
+    translated_chunks = [""] * len(input_ids)
+    doc_type = document_type()
+    observe_stage("chunking", time.time() - start, doc_type)
+    CHUNKS.inc(len(input_ids), document_type=doc_type)
+
+    if input_ids:
+        lengths = [len(ids) for ids in input_ids]
+        batches = make_batches(lengths, batch_size, max_batch_tokens)
+
+        # the model can be a PyTorch model or an inference backend
+        backend = as_backend(model)
+        caps = [generation_cap(length, profile, ratio) for length in lengths]
+        for batch in tqdm(batches):
+            start = time.time()
+            translated_tokens = backend.generate(
+                [input_ids[idx] for idx in batch],
+                tokenizer.lang_code_to_id[lang_dest_code],
+                num_beams=profile["num_beams"],
+                max_new_tokens=max(caps[idx] for idx in batch),
+                max_repeats=profile["max_repeats"],
+            )
+            observe_stage("generate", time.time() - start, doc_type)
+            BATCH_SIZE.observe(len(batch), document_type=doc_type)
+
+            records = []
+            for idx, tokens in zip(batch, translated_tokens):
+                repetition = False
+                if profile["max_repeats"] is not None:
+                    # a loop stopped by the guard is kept once
+                    tokens, repetition = trim_repetition(
+                        tokens, profile["max_repeats"], tokenizer.eos_token_id
+                    )
+                records.append(
+                    {
+                        "profile": profile_name,
+                        "src": source_lang,
+                        "tgt": lang_dest_code,
+                        "source_tokens": lengths[idx],
+                        "generated_tokens": len(tokens),
+                        "cap": caps[idx],
+                        "repetition": repetition,
+                    }
+                )
+                translated_chunks[idx] = tokenizer.decode(
+                    tokens, skip_special_tokens=True
+                )
+            record_lengths(records)
+            for kind in ("source", "generated"):
+                TOKENS.inc(
+                    sum(record[f"{kind}_tokens"] for record in records),
+                    document_type=doc_type,
+                    kind=kind,
+                )
+
+    # join the translated chunks of each text
+    translated_texts = [[] for _ in texts]
+    for idx, translated_chunk in zip(owners, translated_chunks):
+        translated_texts[idx].append(translated_chunk)
+
+    return [" ".join(translated_text) for translated_text in translated_texts]
@@ -0,0 +1,232 @@
+"""Decoding profiles of the translation model.
+
+A profile sets the search (number of beams), the cap of generated tokens of
+each chunk, derived from its number of tokens and the language pair, and the
+repetition guard that ends the sequences stuck in a loop. The length of the
+translation of every chunk can be recorded to tune the ratios:
+
+    python src/decoding.py generation_lengths.jsonl
+"""
+import json
+import math
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# n-grams up to this length are checked by the repetition guard
+MAX_REPEAT_PERIOD = 8
+
+PROFILE_KEYS = {
+    "num_beams",
+    "length_factor",
+    "length_margin",
+    "max_new_tokens",
+    "max_repeats",
+}
+
+decoding_options = {
+    "profiles": {
+        # greedy search with tight caps for the text box
+        "interactive": {
+            "num_beams": 1,
+            "length_factor": 1.5,
+            "length_margin": 8,
+            "max_new_tokens": 160,
+            "max_repeats": 4,
+        },
+        # small beam for the documents
+        "document": {
+            "num_beams": 2,
+            "length_factor": 2.0,
+            "length_margin": 16,
+            "max_new_tokens": 256,
+            "max_repeats": 4,
+        },
+    },
+    # profile used by each endpoint when the request does not choose one
+    "endpoints": {"text": "interactive", "document": "document"},
+    # expected ratio between the tokens of the translation and the tokens of
+    # the source, by ``src>tgt'' pair, ``*'' matches any language
+    "length_ratios": {},
+    # JSON lines file where the generated length of every chunk is appended,
+    # None to disable it
+    "length_log": None,
+}
+
+length_log_lock = threading.Lock()
+
+
+def configure_decoding(**kwargs):
+    """Function to set the decoding profiles, see ``decoding_options''"""
+    unknown = set(kwargs) - set(decoding_options)
+    if unknown:
+        raise ValueError(f"Unknown decoding options: {unknown}")
+    for name, profile in kwargs.get("profiles", {}).items():
+        unknown = set(profile) - PROFILE_KEYS
+        if unknown:
+            raise ValueError(f"Unknown options of profile {name}: {unknown}")
+    decoding_options.update(kwargs)
+    for name in decoding_options["endpoints"].values():
+        get_profile(name)
+
+
+def get_profile(name=None):
+    """Returns the name and the options of a profile, by default the one of
+    the documents"""
+    if name is None:
+        name = decoding_options["endpoints"]["document"]
+    if name not in decoding_options["profiles"]:
+        raise ValueError(
+            f"Unknown decoding profile {name}, use "
+            f"{sorted(decoding_options['profiles'])}"
+        )
+    return name, decoding_options["profiles"][name]
+
+
+def endpoint_profile(endpoint):
+    """Name of the profile used by an endpoint, ``text'' or ``document''"""
+    return decoding_options["endpoints"][endpoint]
+
+
+def length_ratio(lang_origin_code, lang_dest_code):
+    """Expected ratio of target to source tokens of a language pair"""
+    ratios = decoding_options["length_ratios"]
+    for pair in (
+        f"{lang_origin_code}>{lang_dest_code}",
+        f"*>{lang_dest_code}",
+        f"{lang_origin_code}>*",
+    ):
+        if pair in ratios:
+            return ratios[pair]
+    return 1.0
+
+
+def generation_cap(source_length, profile, ratio=1.0):
+    """Max number of generated tokens of a chunk with ``source_length''
+    tokens, special tokens included"""
+    cap = math.ceil(
+        source_length * ratio * profile["length_factor"]
+        + profile["length_margin"]
+    )
+    return min(cap, profile["max_new_tokens"])
+
+
+def repetition_period(tokens, max_repeats, max_period=MAX_REPEAT_PERIOD):
+    """Length of the n-gram repeated ``max_repeats'' times in a row at the
+    end of the tokens, 0 if there is none"""
+    for period in range(1, max_period + 1):
+        span = period * max_repeats
+        if len(tokens) < span:
+            break
+        tail = tokens[-span:]
+        if tail[:-period] == tail[period:]:
+            return period
+    return 0
+
+
+def trim_repetition(tokens, max_repeats, eos_token_id):
+    """Keeps a single copy of the loop at the end of the generated tokens,
+    returns the tokens and whether they have been trimmed"""
+    end = len(tokens)
+    if end and tokens[-1] == eos_token_id:
+        end -= 1
+    period = repetition_period(tokens[:end], max_repeats)
+    if not period:
+        return tokens, False
+    start = end - period * (max_repeats - 1)
+    return tokens[:start] + tokens[end:], True
+
+
+class RepetitionStop:
+    """Logits processor that forces the end of the sequences whose last
+    tokens repeat the same n-gram ``max_repeats'' times. It works with the
+    torch tensors of ``generate'' and the numpy arrays of the ONNX backend.
+    """
+
+    def __init__(self, max_repeats, eos_token_id):
+        self.max_repeats = max_repeats
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids, scores):
+        for row, tokens in enumerate(input_ids.tolist()):
+            if repetition_period(tokens, self.max_repeats):
+                scores[row] = -math.inf
+                scores[row, self.eos_token_id] = 0
+        return scores
+
+
+def record_lengths(records):
+    """Appends the generated length of the chunks to the length log"""
+    path = decoding_options["length_log"]
+    if path is None or not records:
+        return
+    now = time.time()
+    lines = "".join(
+        json.dumps({"time": now, **record}) + "\n" for record in records
+    )
+    with length_log_lock:
+        with open(path, "a") as f:
+            f.write(lines)
+
+
+def suggest_ratios(path, quantile=0.5):
+    """Function to compute the target to source token ratio of each
+    language pair from the length log.
+
+    Parameters
+    ----------
+    path : str
+        Length log, see ``record_lengths''
+    quantile : float
+        Quantile of the ratios of the chunks of each pair, the median by
+        default as the profiles already add room with their
+        ``length_factor''
+
+    Returns
+    -------
+    ratios : dict
+        ``src>tgt'' pairs and their number of chunks, ratio, and fraction of
+        chunks which reached the cap or the repetition guard
+    """
+    pairs = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            pairs[f"{record['src']}>{record['tgt']}"].append(record)
+
+    ratios = {}
+    for pair, records in sorted(pairs.items()):
+        # the chunks cut by the cap or the guard do not give their ratio
+        complete = sorted(
+            record["generated_tokens"] / record["source_tokens"]
+            for record in records
+            if record["generated_tokens"] < record["cap"]
+            and not record["repetition"]
+        )
+        ratio = None
+        if complete:
+            position = min(len(complete) - 1, int(quantile * len(complete)))
+            ratio = complete[position]
+        ratios[pair] = {
+            "chunks": len(records),
+            "ratio": ratio,
+            "capped": sum(
+                record["generated_tokens"] >= record["cap"]
+                for record in records
+            )
+            / len(records),
+            "repetition": sum(record["repetition"] for record in records)
+            / len(records),
+        }
+    return ratios
+
+
+if __name__ == "__main__":
+    for pair, stats in suggest_ratios(sys.argv[1]).items():
+        ratio = "-" if stats["ratio"] is None else f"{stats['ratio']:.2f}"
+        print(
+            f"{pair}: {stats['chunks']} chunks, ratio {ratio}, "
+            f"{stats['capped']:.1%} capped, "
+            f"{stats['repetition']:.1%} repetitions"
+        )
@@ -0,0 +1,235 @@
+"""Offline export of a translation model to the ONNX graphs of
+``inference_backends.OnnxBackend'': the encoder (which also computes the
+keys and values of the cross-attention) and the decoder with the keys and
+values of the previous tokens as inputs.
+
+Usage:
+    python src/export_onnx.py [--model nllb-200-distilled-600M]
+        [--output models/onnx/nllb-200-distilled-600M] [--quantize]
+
+The model is read from ``models/<model>'' if it has been saved there (see
+``save_models.py'') and from the local Hugging Face cache if not, nothing is
+downloaded.
+"""
+import argparse
+import os
+import shutil
+
+import torch
+from transformers import AutoModelForSeq2SeqLM
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+models_path = os.path.join(projpath, "models")
+
+OPSET_VERSION = 14
+
+
+class EncoderGraph(torch.nn.Module):
+    """Encoder followed by the key and value projections of the
+    cross-attention of every decoder layer"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.get_encoder()
+        self.layers = model.get_decoder().layers
+
+    def forward(self, input_ids, attention_mask):
+        hidden_states = self.encoder(
+            input_ids=input_ids, attention_mask=attention_mask
+        ).last_hidden_state
+        batch_size = input_ids.shape[0]
+        cross = []
+        for layer in self.layers:
+            attention = layer.encoder_attn
+            cross.append(
+                attention._shape(
+                    attention.k_proj(hidden_states), -1, batch_size
+                )
+            )
+            cross.append(
+                attention._shape(
+                    attention.v_proj(hidden_states), -1, batch_size
+                )
+            )
+        return tuple(cross)
+
+
+class DecoderGraph(torch.nn.Module):
+    """Decoder step with the keys and values of the previous tokens and of
+    the cross-attention as inputs, returns the logits of the next token and
+    the keys and values of the self-attention"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.lm_head = model.lm_head
+
+    def forward(self, decoder_input_ids, encoder_attention_mask, *past):
+        past_key_values = tuple(
+            tuple(past[4 * layer : 4 * layer + 4])
+            for layer in range(len(self.decoder.layers))
+        )
+        # only the shape of the encoder states is used, the cross-attention
+        # keys and values are given
+        cross_key = past[2]
+        encoder_hidden_states = cross_key.new_zeros(
+            cross_key.shape[0],
+            cross_key.shape[2],
+            self.decoder.config.d_model,
+        )
+        outputs = self.decoder(
+            input_ids=decoder_input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        logits = self.lm_head(outputs.last_hidden_state[:, -1])
+        present = [
+            array for layer in outputs.past_key_values for array in layer[:2]
+        ]
+        return (logits, *present)
+
+
+def load_local_model(model_name):
+    """Loads a model without network access, from ``models/<model_name>''
+    or from the Hugging Face cache"""
+    local_path = os.path.join(models_path, model_name)
+    if os.path.isdir(local_path):
+        model_path = local_path
+    elif os.path.isdir(model_name):
+        model_path = model_name
+    else:
+        model_path = f"facebook/{model_name}"
+    model = AutoModelForSeq2SeqLM.from_pretrained(
+        model_path, local_files_only=True
+    )
+    return model.eval()
+
+
+def export_model(model, output_path):
+    """Function to export the encoder and decoder graphs of a model.
+
+    Parameters
+    ----------
+    model : AutoModelForSeq2SeqLM
+        Translation model in fp32
+    output_path : str
+        Folder where the ``encoder.onnx'', ``decoder.onnx'' graphs and the
+        configuration files are written
+    """
+    os.makedirs(output_path, exist_ok=True)
+    config = model.config
+    n_layers = config.decoder_layers
+    n_heads = config.decoder_attention_heads
+    head_dim = config.d_model // n_heads
+
+    input_ids = torch.tensor([[256047, 94124, 248, 2], [256047, 94, 2, 1]])
+    input_ids = input_ids.clamp(max=config.vocab_size - 1)
+    attention_mask = torch.tensor([[1, 1, 1, 1], [1, 1, 1, 0]])
+    batch_size = input_ids.shape[0]
+
+    encoder = EncoderGraph(model).eval()
+    cross_names = [
+        f"cross_{layer}_{name}"
+        for layer in range(n_layers)
+        for name in ("key", "value")
+    ]
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder,
+            (input_ids, attention_mask),
+            os.path.join(output_path, "encoder.onnx"),
+            input_names=["input_ids", "attention_mask"],
+            output_names=cross_names,
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "source"},
+                "attention_mask": {0: "batch", 1: "source"},
+                **{name: {0: "batch", 2: "source"} for name in cross_names},
+            },
+            opset_version=OPSET_VERSION,
+        )
+        cross = encoder(input_ids, attention_mask)
+
+    # example with previous tokens, the graph also runs without them
+    past_length = 3
+    decoder_input_ids = torch.full((batch_size, 1), config.eos_token_id)
+    past = []
+    past_names, present_names = [], []
+    for layer in range(n_layers):
+        for name in ("key", "value"):
+            past.append(torch.rand(batch_size, n_heads, past_length, head_dim))
+            past_names.append(f"past_{layer}_{name}")
+            present_names.append(f"present_{layer}_{name}")
+        past.extend(cross[2 * layer : 2 * layer + 2])
+    decoder_input_names = ["decoder_input_ids", "encoder_attention_mask"]
+    for layer in range(n_layers):
+        decoder_input_names += past_names[2 * layer : 2 * layer + 2]
+        decoder_input_names += cross_names[2 * layer : 2 * layer + 2]
+
+    decoder = DecoderGraph(model).eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            decoder,
+            (decoder_input_ids, attention_mask, *past),
+            os.path.join(output_path, "decoder.onnx"),
+            input_names=decoder_input_names,
+            output_names=["logits", *present_names],
+            dynamic_axes={
+                "decoder_input_ids": {0: "batch"},
+                "encoder_attention_mask": {0: "batch", 1: "source"},
+                "logits": {0: "batch"},
+                **{name: {0: "batch", 2: "past"} for name in past_names},
+                **{name: {0: "batch", 2: "source"} for name in cross_names},
+                **{
+                    name: {0: "batch", 2: "present"}
+                    for name in present_names
+                },
+            },
+            opset_version=OPSET_VERSION,
+        )
+
+    config.to_json_file(os.path.join(output_path, "config.json"))
+    model.generation_config.to_json_file(
+        os.path.join(output_path, "generation_config.json")
+    )
+    print(f"Model exported to {output_path}")
+
+
+def quantize_graphs(output_path):
+    """Dynamic int8 quantization of the exported graphs, the
+    ``*.int8.onnx'' graphs are used by ``OnnxBackend'' when they exist"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    for name in ("encoder", "decoder"):
+        quantize_dynamic(
+            os.path.join(output_path, f"{name}.onnx"),
+            os.path.join(output_path, f"{name}.int8.onnx"),
+            weight_type=QuantType.QInt8,
+            use_external_data_format=True,
+        )
+    print(f"Quantized graphs written to {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--model", default="nllb-200-distilled-600M")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--quantize", action="store_true")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.join(
+        models_path, "onnx", os.path.basename(args.model.rstrip("/"))
+    )
+    # the graphs of a previous export are replaced
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+
+    export_model(load_local_model(args.model), output_path)
+    if args.quantize:
+        quantize_graphs(output_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,453 @@
+import json
+import os
+
+from decoding import RepetitionStop
+
+
+class InferenceBackend:
+    """Engine running the translation model. The backends receive the token
+    ids of the source texts (with their special tokens) and return the token
+    ids of the translations, the tokenization stays in the callers, see
+    ``batch_translation.generate_translations''."""
+
+    # engine and precision of the model, the translation memory does not
+    # share the translations of different variants
+    variant = ""
+
+    def generate(self, input_ids, lang_dest_id, **options):
+        """Function to translate a batch of texts.
+
+        Parameters
+        ----------
+        input_ids : list
+            Token ids of each text, with their special tokens
+        lang_dest_id : int
+            Token id of the language of the translations, it is forced as
+            the first generated token
+        options :
+            Decoding options: ``num_beams'', ``max_new_tokens'' (the
+            language and end tokens included), ``max_repeats'' (the
+            sequences which repeat the same n-gram ``max_repeats'' times in a
+            row are ended, see ``decoding.RepetitionStop'')...
+
+        Returns
+        -------
+        output_ids : list
+            Generated token ids of each translation, the language token
+            included, without the decoder start token or the padding
+        """
+        raise NotImplementedError
+
+
+def pad_batch(input_ids, pad_token_id):
+    """Right pads a batch of token ids, returns the padded ids and the
+    attention mask as lists of lists"""
+    length = max(len(ids) for ids in input_ids)
+    padded = [ids + [pad_token_id] * (length - len(ids)) for ids in input_ids]
+    mask = [[1] * len(ids) + [0] * (length - len(ids)) for ids in input_ids]
+    return padded, mask
+
+
+class TorchBackend(InferenceBackend):
+    """Hugging Face ``generate'' of a PyTorch model.
+
+    Parameters
+    ----------
+    model : transformers model
+        Translation model, see ``utils.load_model''
+    precision : str | None
+        Precision the model has been loaded with, inferred from the model
+        if None
+    """
+
+    def __init__(self, model, precision=None):
+        self.model = model
+        self.precision = precision
+
+    @property
+    def variant(self):
+        if self.precision is None:
+            self.precision = model_precision(self.model)
+        return f"torch:{self.precision}"
+
+    def inputs(self, input_ids):
+        import torch
+
+        padded, mask = pad_batch(input_ids, self.model.config.pad_token_id)
+        return {
+            "input_ids": torch.tensor(padded),
+            "attention_mask": torch.tensor(mask),
+        }
+
+    def generate(self, input_ids, lang_dest_id, max_repeats=None, **options):
+        from transformers import LogitsProcessorList
+
+        config = self.model.config
+        processors = LogitsProcessorList()
+        if max_repeats is not None:
+            processors.append(RepetitionStop(max_repeats, config.eos_token_id))
+        output_ids = self.model.generate(
+            **self.inputs(input_ids),
+            forced_bos_token_id=lang_dest_id,
+            logits_processor=processors,
+            **options,
+        ).tolist()
+
+        for idx, ids in enumerate(output_ids):
+            # without the decoder start token and the padding
+            end = len(ids)
+            while end > 1 and ids[end - 1] == config.pad_token_id:
+                end -= 1
+            output_ids[idx] = ids[1:end]
+        return output_ids
+
+
+def model_precision(model):
+    """Precision of a model loaded with ``utils.load_model''"""
+    import torch
+
+    if any(
+        type(module).__module__.startswith("torch.ao.nn.quantized")
+        for module in model.modules()
+    ):
+        return "int8"
+    return "bf16" if model.dtype == torch.bfloat16 else "fp32"
+
+
+def as_backend(model):
+    """Backend of a model, the models loaded with ``utils.load_model'' are
+    run with the PyTorch backend"""
+    if isinstance(model, InferenceBackend):
+        return model
+    return TorchBackend(model)
+
+
+# inference engines, see ``load_backend''
+ENGINES = ("torch", "onnx")
+
+
+def load_backend(
+    model_path, engine="torch", onnx_path=None, threads=None, **model_options
+):
+    """Function to load the translation model in one of the engines.
+
+    Parameters
+    ----------
+    model_path : str
+        Path or Hugging Face name of the model, used by the PyTorch engine
+    engine : str
+        ``torch'' or ``onnx''
+    onnx_path : str | None
+        Folder of the graphs exported with ``export_onnx.py'', used by the
+        ONNX engine
+    threads : int | None
+        Intra-op threads of the ONNX Runtime sessions
+    model_options :
+        Options of ``utils.load_model'', e.g. ``precision''
+
+    Returns
+    -------
+    backend : InferenceBackend
+        Loaded backend
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, use {ENGINES}")
+    if engine == "onnx":
+        if onnx_path is None or not os.path.isdir(onnx_path):
+            raise ValueError(
+                f"No ONNX graphs in {onnx_path}, export the model with "
+                "src/export_onnx.py"
+            )
+        return OnnxBackend(onnx_path, threads)
+
+    from utils import load_model
+
+    return TorchBackend(
+        load_model(model_path, **model_options),
+        model_options.get("precision", "fp32"),
+    )
+
+
+class OnnxBackend(InferenceBackend):
+    """ONNX Runtime engine of a model exported with ``export_onnx.py''. The
+    encoder graph also computes the keys and values of the cross-attention,
+    so the decoder graph only runs the new token at each step, with the keys
+    and values of the previous tokens (``past'') as inputs. torch is not
+    needed to run it.
+
+    Parameters
+    ----------
+    model_path : str
+        Folder with the ``encoder.onnx'', ``decoder.onnx'',
+        ``config.json'' and ``generation_config.json'' files
+    threads : int | None
+        Intra-op threads of each session, by default the ONNX Runtime one
+    """
+
+    # decoding options supported by ``generate''
+    options = (
+        "num_beams",
+        "max_new_tokens",
+        "length_penalty",
+        "early_stopping",
+        "max_repeats",
+    )
+
+    def __init__(self, model_path, threads=None):
+        import onnxruntime
+
+        self.model_path = model_path
+        with open(os.path.join(model_path, "config.json")) as f:
+            self.config = json.load(f)
+        # default decoding options of the model, as in Hugging Face
+        with open(os.path.join(model_path, "generation_config.json")) as f:
+            generation_config = json.load(f)
+        self.defaults = {
+            "num_beams": generation_config.get("num_beams", 1),
+            "max_length": generation_config.get("max_length", 20),
+            "length_penalty": generation_config.get("length_penalty", 1.0),
+            "early_stopping": generation_config.get("early_stopping", False),
+        }
+        self.n_layers = self.config["decoder_layers"]
+        self.n_heads = self.config["decoder_attention_heads"]
+        self.head_dim = self.config["d_model"] // self.n_heads
+
+        session_options = onnxruntime.SessionOptions()
+        if threads is not None:
+            session_options.intra_op_num_threads = threads
+        providers = ["CPUExecutionProvider"]
+        self.encoder = onnxruntime.InferenceSession(
+            self.graph_path(model_path, "encoder"),
+            session_options,
+            providers=providers,
+        )
+        self.decoder = onnxruntime.InferenceSession(
+            self.graph_path(model_path, "decoder"),
+            session_options,
+            providers=providers,
+        )
+        self.decoder_inputs = {i.name for i in self.decoder.get_inputs()}
+        # fp32 or int8 graphs
+        self.variant = "onnx:" + os.path.basename(
+            self.graph_path(model_path, "encoder")
+        )
+
+    @staticmethod
+    def graph_path(model_path, name):
+        """Quantized graph if it has been exported, full precision if not"""
+        quantized = os.path.join(model_path, f"{name}.int8.onnx")
+        if os.path.exists(quantized):
+            return quantized
+        return os.path.join(model_path, f"{name}.onnx")
+
+    def encode(self, input_ids):
+        """Keys and values of the cross-attention of each decoder layer and
+        the attention mask of the batch"""
+        import numpy as np
+
+        padded, mask = pad_batch(input_ids, self.config["pad_token_id"])
+        mask = np.array(mask, dtype=np.int64)
+        cross = self.encoder.run(
+            None,
+            {
+                "input_ids": np.array(padded, dtype=np.int64),
+                "attention_mask": mask,
+            },
+        )
+        return cross, mask
+
+    def decode_step(self, tokens, mask, past, cross):
+        """Runs the decoder over the last generated tokens, returns the
+        logits and the keys and values of the self-attention"""
+        feed = {"decoder_input_ids": tokens, "encoder_attention_mask": mask}
+        for layer in range(self.n_layers):
+            feed[f"past_{layer}_key"] = past[2 * layer]
+            feed[f"past_{layer}_value"] = past[2 * layer + 1]
+            feed[f"cross_{layer}_key"] = cross[2 * layer]
+            feed[f"cross_{layer}_value"] = cross[2 * layer + 1]
+        feed = {
+            name: value
+            for name, value in feed.items()
+            if name in self.decoder_inputs
+        }
+        outputs = self.decoder.run(None, feed)
+        return outputs[0], outputs[1:]
+
+    def generate(
+        self,
+        input_ids,
+        lang_dest_id,
+        num_beams=None,
+        max_new_tokens=None,
+        length_penalty=None,
+        early_stopping=None,
+        max_repeats=None,
+        **options,
+    ):
+        """Beam search (greedy search with one beam) with the stopping rules
+        of the Hugging Face one, see ``InferenceBackend.generate''. The
+        options not given take the values of the generation configuration of
+        the model."""
+        import numpy as np
+
+        if options:
+            raise ValueError(
+                f"Unsupported decoding options {set(options)}, "
+                f"the ONNX backend supports {self.options}"
+            )
+        if num_beams is None:
+            num_beams = self.defaults["num_beams"]
+        if max_new_tokens is None:
+            # the length limit of the model counts the decoder start token
+            max_new_tokens = self.defaults["max_length"] - 1
+        if length_penalty is None:
+            length_penalty = self.defaults["length_penalty"]
+        if early_stopping is None:
+            early_stopping = self.defaults["early_stopping"]
+        eos = self.config["eos_token_id"]
+        pad = self.config["pad_token_id"]
+
+        repetition_stop = None
+        if max_repeats is not None:
+            repetition_stop = RepetitionStop(max_repeats, eos)
+
+        cross, mask = self.encode(input_ids)
+        batch_size = len(input_ids)
+        # every sentence is expanded to its beams
+        beams = np.repeat(np.arange(batch_size), num_beams)
+        cross = [array[beams] for array in cross]
+        mask = mask[beams]
+        past = [
+            np.zeros(
+                (len(beams), self.n_heads, 0, self.head_dim), dtype=np.float32
+            )
+        ] * (2 * self.n_layers)
+
+        sequences = np.full(
+            (len(beams), 1), self.config["decoder_start_token_id"]
+        )
+        scores = np.zeros((batch_size, num_beams), dtype=np.float32)
+        # only the first beam is alive at the beginning
+        scores[:, 1:] = -np.inf
+        # best ``num_beams'' finished hypotheses of each sentence
+        hypotheses = [BeamHypotheses(num_beams) for _ in range(batch_size)]
+        done = np.zeros(batch_size, dtype=bool)
+
+        for step in range(max_new_tokens):
+            logits, past = self.decode_step(
+                sequences[:, -1:], mask, past, cross
+            )
+            logits = logits.astype(np.float32)
+            log_probs = logits - logits.max(axis=-1, keepdims=True)
+            log_probs -= np.log(np.exp(log_probs).sum(axis=-1, keepdims=True))
+            if step == 0:
+                # the language of the translation is forced
+                log_probs[:] = -np.inf
+                log_probs[:, lang_dest_id] = 0
+            elif repetition_stop is not None:
+                log_probs = repetition_stop(sequences, log_probs)
+
+            vocab_size = log_probs.shape[-1]
+            candidates = (
+                scores.reshape(-1, 1) + log_probs
+            ).reshape(batch_size, -1)
+            # the best 2 * num_beams candidates of each sentence, so there
+            # are enough candidates that do not end the sentence
+            n_candidates = min(2 * num_beams, candidates.shape[1])
+            top = np.argpartition(-candidates, n_candidates - 1, axis=1)[
+                :, :n_candidates
+            ]
+
+            length = sequences.shape[1]
+            origins = np.zeros(len(beams), dtype=np.int64)
+            next_tokens = np.full(len(beams), pad)
+            next_scores = np.full((batch_size, num_beams), -np.inf)
+            for sentence in range(batch_size):
+                first_beam = sentence * num_beams
+                origins[first_beam : first_beam + num_beams] = first_beam
+                if done[sentence]:
+                    continue
+                order = top[sentence][
+                    np.argsort(-candidates[sentence, top[sentence]])
+                ]
+                n_beams = 0
+                for rank, candidate in enumerate(order):
+                    beam, token = divmod(int(candidate), vocab_size)
+                    score = float(candidates[sentence, candidate])
+                    if token == eos:
+                        # only the candidates among the best ones end a
+                        # sentence
+                        if rank < num_beams:
+                            sequence = sequences[first_beam + beam, 1:]
+                            hypotheses[sentence].add(
+                                score / length**length_penalty,
+                                sequence.tolist() + [eos],
+                            )
+                        continue
+                    origins[first_beam + n_beams] = first_beam + beam
+                    next_tokens[first_beam + n_beams] = token
+                    next_scores[sentence, n_beams] = score
+                    n_beams += 1
+                    if n_beams == num_beams:
+                        break
+
+                best_score = float(candidates[sentence, order[0]])
+                done[sentence] = hypotheses[sentence].is_done(
+                    num_beams == 1
+                    or early_stopping
+                    or best_score / length**length_penalty
+                )
+
+            if done.all():
+                break
+            sequences = np.concatenate(
+                (sequences[origins], next_tokens[:, None]), axis=1
+            )
+            past = [array[origins] for array in past]
+            scores = next_scores.astype(np.float32)
+
+        output_ids = []
+        length = sequences.shape[1]
+        for sentence in range(batch_size):
+            if not done[sentence]:
+                # the beams not finished at the length limit are hypotheses
+                # too
+                for beam in range(num_beams):
+                    first_beam = sentence * num_beams
+                    hypotheses[sentence].add(
+                        scores[sentence, beam] / length**length_penalty,
+                        sequences[first_beam + beam, 1:].tolist(),
+                    )
+            output_ids.append(hypotheses[sentence].best())
+        return output_ids
+
+
+class BeamHypotheses:
+    """Best finished hypotheses of a sentence in a beam search"""
+
+    def __init__(self, num_beams):
+        self.num_beams = num_beams
+        self.hypotheses = []
+
+    def add(self, score, sequence):
+        if len(self.hypotheses) < self.num_beams:
+            self.hypotheses.append((score, sequence))
+        elif score > self.worst_score():
+            self.hypotheses.remove(min(self.hypotheses, key=lambda h: h[0]))
+            self.hypotheses.append((score, sequence))
+
+    def worst_score(self):
+        return min(score for score, _ in self.hypotheses)
+
+    def is_done(self, stop):
+        """Whether the sentence is finished, ``stop'' is True to stop as soon
+        as there are enough hypotheses or the best score that the running
+        beams can get"""
+        if len(self.hypotheses) < self.num_beams:
+            return False
+        if stop is True:
+            return True
+        return self.worst_score() >= stop
+
+    def best(self):
+        return max(self.hypotheses, key=lambda h: h[0])[1]
@@ -0,0 +1,520 @@
+"""Local inference server which owns the translation model and batches the
+``generate'' calls of all the server processes.
+
+Every worker of the Django server (and every document job) translates its
+own chunks, so concurrent requests call ``generate'' with small batches
+which compete for the same cores. With the inference server, the workers
+send the token ids of their batches to a single process (``RemoteBackend''),
+which queues them and translates together the requests received within a
+small wait window (``max_wait_ms''), so the cores run a few large batches
+instead of many small ones.
+
+Usage:
+    python manage.py inference_server
+    python manage.py inference_server --stats
+
+The messages are JSON lines over a Unix socket (or a localhost TCP port,
+see ``parse_address''):
+
+    {"op": "generate", "model": "nllb-200-distilled-600M",
+     "input_ids": [[...]], "lang_dest_id": 256047,
+     "options": {"num_beams": 1, "max_new_tokens": 64}}
+    -> {"output_ids": [[...]]} or {"error": "..."}
+
+    {"op": "variant", "model": "nllb-200-distilled-600M"}
+    -> {"variant": "torch:int8"}, engine and precision of the served model
+
+    {"op": "stats"} -> queue depth, batch sizes and latencies
+    {"op": "models"} -> models loaded by the server
+"""
+import collections
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+from inference_backends import InferenceBackend
+
+# server parameters, see ``configure_inference_server''
+server_options = {
+    # whether the Django server sends the translations to the inference
+    # server instead of loading the model in each process
+    "enabled": False,
+    # path of the Unix socket, or ``host:port'' of a localhost TCP port
+    "address": "inference.sock",
+    # milliseconds the first request of a micro-batch waits for the others
+    "max_wait_ms": 10,
+    # max number of sequences of each ``generate'' call
+    "max_batch_size": 32,
+    # max number of tokens (padding included) of each ``generate'' call
+    "max_batch_tokens": 8192,
+    # seconds a client waits for its translation
+    "timeout": 600,
+}
+
+# upper bounds of the buckets of the batch size histogram
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+# number of recent requests whose latency percentiles are reported
+LATENCY_WINDOW = 1000
+
+
+def configure_inference_server(**kwargs):
+    """Function to change the inference server parameters of the process,
+    see ``server_options''."""
+    unknown = set(kwargs) - set(server_options)
+    if unknown:
+        raise ValueError(f"Unknown inference server options: {unknown}")
+    server_options.update(kwargs)
+
+
+def parse_address(address):
+    """Socket family and address of the server: ``host:port'' is a TCP
+    address, anything else the path of a Unix socket"""
+    host, _, port = str(address).rpartition(":")
+    if host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, str(address)
+
+
+def request_server(address, message, timeout=None):
+    """Function to send a message to the inference server.
+
+    Parameters
+    ----------
+    address : str
+        Address of the server, see ``parse_address''
+    message : dict
+        Request, with its ``op''
+    timeout : float | None
+        Seconds to wait for the answer
+
+    Returns
+    -------
+    answer : dict
+        Answer of the server
+    """
+    family, server_address = parse_address(address)
+    try:
+        connection = socket.socket(family, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        connection.connect(server_address)
+    except (FileNotFoundError, ConnectionRefusedError) as error:
+        raise ConnectionError(
+            f"No inference server at {address}, start it with "
+            "python manage.py inference_server"
+        ) from error
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps(message).encode() + b"\n")
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        raise ConnectionError(f"The inference server {address} closed")
+    return json.loads(line)
+
+
+class RemoteBackend(InferenceBackend):
+    """Backend which sends the ``generate'' calls to the inference server,
+    the model is not loaded in the process.
+
+    Parameters
+    ----------
+    address : str
+        Address of the server, see ``parse_address''
+    timeout : float | None
+        Seconds to wait for each translation
+    model_name : str | None
+        Model of the server which translates, by default its default one
+    """
+
+    def __init__(self, address, timeout=None, model_name=None):
+        self.address = address
+        self.timeout = timeout
+        self.model_name = model_name
+
+    @property
+    def variant(self):
+        """Variant of the model served by the server, which loads it with
+        its own settings: it is asked on every use so that the translation
+        memory follows a change of engine or precision of the server"""
+        answer = request_server(
+            self.address,
+            {"op": "variant", "model": self.model_name},
+            self.timeout,
+        )
+        if "error" in answer:
+            raise RuntimeError(f"Inference server error: {answer['error']}")
+        return answer["variant"]
+
+    def generate(self, input_ids, lang_dest_id, **options):
+        answer = request_server(
+            self.address,
+            {
+                "op": "generate",
+                "model": self.model_name,
+                "input_ids": [list(ids) for ids in input_ids],
+                "lang_dest_id": lang_dest_id,
+                "options": options,
+            },
+            self.timeout,
+        )
+        if "error" in answer:
+            raise RuntimeError(f"Inference server error: {answer['error']}")
+        return answer["output_ids"]
+
+    def stats(self):
+        """Statistics of the server, see ``ServerStats.summary''"""
+        return request_server(self.address, {"op": "stats"}, self.timeout)
+
+
+class PendingRequest:
+    """Request waiting in the queue of the server"""
+
+    def __init__(self, model_name, input_ids, lang_dest_id, options):
+        self.model_name = model_name
+        self.input_ids = input_ids
+        self.lang_dest_id = lang_dest_id
+        self.max_new_tokens = options.pop("max_new_tokens", None)
+        self.options = options
+        self.received = time.time()
+        self.started = None
+        self.output_ids = None
+        self.error = None
+        self.done = threading.Event()
+
+    @property
+    def key(self):
+        """Requests with the same key are translated in the same call"""
+        return (
+            self.model_name,
+            self.lang_dest_id,
+            json.dumps(self.options, sort_keys=True),
+            self.max_new_tokens is None,
+        )
+
+    @property
+    def tokens(self):
+        return max(len(ids) for ids in self.input_ids)
+
+
+class ServerStats:
+    """Queue depth, batch sizes and latencies of the server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.sequences = 0
+        self.batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.waits = collections.deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+
+    def enqueued(self):
+        with self.lock:
+            self.queued += 1
+
+    def batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.sequences += size
+            bucket = np.searchsorted(BATCH_SIZE_BUCKETS, size)
+            self.batch_sizes[bucket] += 1
+
+    def finished(self, request):
+        with self.lock:
+            self.queued -= 1
+            self.requests += 1
+            self.errors += request.error is not None
+            now = time.time()
+            self.latencies.append(now - request.received)
+            self.waits.append(request.started - request.received)
+
+    def summary(self):
+        """Function to summarize the statistics.
+
+        Returns
+        -------
+        summary : dict
+            ``queue_depth'' (requests waiting or being translated),
+            ``batch_sizes'' (number of ``generate'' calls by number of
+            sequences) and the percentiles of the ``latency'' and of the
+            ``queue_wait'' of the recent requests, in seconds
+        """
+        with self.lock:
+            labels = [f"<={size}" for size in BATCH_SIZE_BUCKETS]
+            labels.append(f">{BATCH_SIZE_BUCKETS[-1]}")
+            return {
+                "uptime": time.time() - self.started,
+                "queue_depth": self.queued,
+                "requests": self.requests,
+                "errors": self.errors,
+                "batches": self.batches,
+                "mean_batch_size": self.sequences / max(self.batches, 1),
+                "batch_sizes": dict(zip(labels, self.batch_sizes)),
+                "latency": percentiles(self.latencies),
+                "queue_wait": percentiles(self.waits),
+            }
+
+
+def percentiles(values):
+    """Median, p90 and p99 of a list of values"""
+    if not values:
+        return {"p50": None, "p90": None, "p99": None}
+    p50, p90, p99 = np.percentile(list(values), [50, 90, 99])
+    return {"p50": p50, "p90": p90, "p99": p99}
+
+
+class MicroBatcher:
+    """Thread which translates the queued requests in micro-batches: once a
+    request arrives, the requests received during ``max_wait_ms'' (or until
+    ``max_batch_size'' sequences are queued) are grouped by target language
+    and decoding options, and each group is translated with as few
+    ``generate'' calls as the batch limits allow.
+
+    The requests of a group may have different caps of generated tokens,
+    the call generates up to the largest one and the translations of each
+    request are cut at its own cap.
+
+    Parameters
+    ----------
+    get_backend : callable
+        Called with the name of the model of the requests (None for the
+        default one), returns the loaded model, see
+        ``model_registry.get_model''
+    stats : ServerStats
+        Statistics updated by the thread
+    """
+
+    def __init__(self, get_backend, stats):
+        self.get_backend = get_backend
+        self.stats = stats
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, request):
+        """Queues a request and waits for its translation"""
+        self.stats.enqueued()
+        self.queue.put(request)
+        request.done.wait()
+        return request
+
+    def collect(self):
+        """Requests of the next micro-batch"""
+        requests = [self.queue.get()]
+        sequences = len(requests[0].input_ids)
+        deadline = requests[0].received + server_options["max_wait_ms"] / 1e3
+        while sequences < server_options["max_batch_size"]:
+            # the requests queued during the previous call do not wait
+            timeout = max(deadline - time.time(), 0)
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            requests.append(request)
+            sequences += len(request.input_ids)
+        return requests
+
+    @staticmethod
+    def split(requests):
+        """Splits a group of requests in ``generate'' calls within the batch
+        limits, the requests are never split"""
+        calls = [[]]
+        sequences = tokens = 0
+        for request in sorted(requests, key=lambda r: r.tokens):
+            sequences += len(request.input_ids)
+            tokens = max(tokens, request.tokens)
+            too_large = (
+                sequences > server_options["max_batch_size"]
+                or sequences * tokens > server_options["max_batch_tokens"]
+            )
+            if calls[-1] and too_large:
+                calls.append([])
+                sequences = len(request.input_ids)
+                tokens = request.tokens
+            calls[-1].append(request)
+        return calls
+
+    def run(self):
+        while True:
+            groups = {}
+            for request in self.collect():
+                groups.setdefault(request.key, []).append(request)
+            for group in groups.values():
+                # a failing group fails its requests, the batcher goes on
+                # with the next ones
+                try:
+                    for call in self.split(group):
+                        self.translate(call)
+                except Exception as error:
+                    print(f"Inference server error: {error!r}")
+                    self.fail(group, error)
+
+    def fail(self, requests, error):
+        """Answers with an error the requests which are not done yet"""
+        for request in requests:
+            if request.done.is_set():
+                continue
+            request.started = request.started or time.time()
+            request.error = repr(error)
+            self.stats.finished(request)
+            request.done.set()
+
+    def translate(self, requests):
+        """Translates the requests of a ``generate'' call"""
+        input_ids = [ids for request in requests for ids in request.input_ids]
+        options = dict(requests[0].options)
+        caps = [request.max_new_tokens for request in requests]
+        if caps[0] is not None:
+            options["max_new_tokens"] = max(caps)
+
+        started = time.time()
+        for request in requests:
+            request.started = started
+        self.stats.batch(len(input_ids))
+        try:
+            backend = self.get_backend(requests[0].model_name)
+            output_ids = backend.generate(
+                input_ids, requests[0].lang_dest_id, **options
+            )
+        except Exception as error:
+            print(f"Inference server error: {error!r}")
+            output_ids = None
+            for request in requests:
+                request.error = repr(error)
+
+        start = 0
+        for request in requests:
+            if output_ids is not None:
+                end = start + len(request.input_ids)
+                request.output_ids = [
+                    ids[: request.max_new_tokens]
+                    for ids in output_ids[start:end]
+                ]
+                start = end
+            self.stats.finished(request)
+            request.done.set()
+
+
+def validate_generate(message):
+    """Checks the fields of a ``generate'' message before it is queued, a
+    malformed request is answered with an error instead of reaching the
+    batcher"""
+    input_ids = message.get("input_ids")
+    if (
+        not isinstance(input_ids, list)
+        or not input_ids
+        or not all(
+            isinstance(ids, list)
+            and ids
+            and all(isinstance(token, int) for token in ids)
+            for ids in input_ids
+        )
+    ):
+        raise ValueError(
+            "input_ids must be a non-empty list of non-empty lists of ints"
+        )
+    if not isinstance(message.get("lang_dest_id"), int):
+        raise ValueError("lang_dest_id must be an int")
+    if not isinstance(message.get("options", {}), dict):
+        raise ValueError("options must be an object")
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Answers the messages of a connection, see the module docstring"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                answer = self.answer(json.loads(line))
+            except Exception as error:
+                answer = {"error": repr(error)}
+            self.wfile.write(json.dumps(answer).encode() + b"\n")
+            self.wfile.flush()
+
+    def answer(self, message):
+        if message.get("op") == "stats":
+            return self.server.stats.summary()
+        if message.get("op") == "models":
+            return self.server.describe_models()
+        if message.get("op") == "variant":
+            backend = self.server.batcher.get_backend(message.get("model"))
+            return {"variant": backend.variant}
+        if message.get("op") != "generate":
+            raise ValueError(f"Unknown operation {message.get('op')}")
+        validate_generate(message)
+        request = self.server.batcher.submit(
+            PendingRequest(
+                message.get("model"),
+                message["input_ids"],
+                message["lang_dest_id"],
+                dict(message.get("options", {})),
+            )
+        )
+        if request.error is not None:
+            return {"error": request.error}
+        return {"output_ids": request.output_ids}
+
+
+class ThreadingUnixServer(
+    socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(
+    socketserver.ThreadingMixIn, socketserver.TCPServer
+):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(get_backend, address=None, describe_models=None):
+    """Function to run the inference server until it is interrupted.
+
+    Parameters
+    ----------
+    get_backend : callable
+        Called with the name of a model (None for the default one), returns
+        the loaded model, see ``model_registry.get_model''
+    address : str | None
+        Address of the server, by default the one of ``server_options''
+    describe_models : callable | None
+        Returns the description of the loaded models, see
+        ``model_registry.resident_models''
+    """
+    address = address or server_options["address"]
+    family, server_address = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(server_address):
+            try:
+                request_server(address, {"op": "stats"}, timeout=5)
+            except ConnectionError:
+                # socket of a previous server which did not exit cleanly
+                os.remove(server_address)
+            else:
+                raise RuntimeError(f"An inference server runs on {address}")
+        server = ThreadingUnixServer(server_address, RequestHandler)
+    else:
+        server = ThreadingTCPServer(server_address, RequestHandler)
+
+    server.stats = ServerStats()
+    server.batcher = MicroBatcher(get_backend, server.stats)
+    server.describe_models = describe_models or dict
+    server.batcher.start()
+    print(f"Inference server listening on {address}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(server_address):
+            os.remove(server_address)
@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import fasttext
+from metrics import count_cache
+
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+DEFAULT_MODEL_PATH = os.path.join(projpath, "models", "lid218e.bin")
+
+
+class LanguageIdentifier:
+    """Language identification with the lid218e fasttext model. The model
+    is loaded once and shared by all the threads of the process, and the
+    results of single texts are cached.
+
+    Parameters
+    ----------
+    model_path : str
+        Path to the lid218e.bin model
+    cache_size : int
+        Max number of texts whose result is cached
+    max_segments : int
+        Max number of segments of a document used to infer its language
+    max_characters : int
+        Max number of characters of a document used to infer its language
+    """
+
+    def __init__(
+        self,
+        model_path=DEFAULT_MODEL_PATH,
+        cache_size=1024,
+        max_segments=200,
+        max_characters=20000,
+    ):
+        self.model_path = model_path
+        self.cache_size = cache_size
+        self.max_segments = max_segments
+        self.max_characters = max_characters
+        self.model = None
+        self.load_time = None
+        self.lock = threading.Lock()
+        # (text, k) -> predictions
+        self.cache = OrderedDict()
+
+    def load(self):
+        """Loads the model if it has not been loaded yet"""
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    start = time.time()
+                    self.model = fasttext.load_model(self.model_path)
+                    self.load_time = time.time() - start
+                    print(
+                        "Language identification model loaded in "
+                        f"{self.load_time:.2f} s"
+                    )
+        return self.model
+
+    def predict(self, texts, k=1):
+        """Function to score several segments in one call.
+
+        Parameters
+        ----------
+        texts : list
+            Segments whose language we want to know
+        k : int
+            Number of candidate languages returned for each segment
+
+        Returns
+        -------
+        predictions : list
+            For each segment, list of (language, probability) tuples sorted
+            by probability
+        """
+        if not texts:
+            return []
+        model = self.load()
+        # replace newlines as they are not accepted by the model
+        texts = [text.replace("\n", " ") for text in texts]
+        labels, probabilities = model.predict(texts, k=k)
+        return [
+            [
+                (label.replace("__label__", ""), float(probability))
+                for label, probability in zip(text_labels, text_probs)
+            ]
+            for text_labels, text_probs in zip(labels, probabilities)
+        ]
+
+    def detect(self, text, k=1):
+        """Cached prediction of a single text, see ``predict''"""
+        key = (text, k)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                count_cache("language_identification", 1, 0)
+                return self.cache[key]
+        count_cache("language_identification", 0, 1)
+
+        prediction = self.predict([text], k=k)[0]
+
+        with self.lock:
+            self.cache[key] = prediction
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return prediction
+
+    def sample(self, texts):
+        """Evenly spaced non-empty segments of a document, bounded by
+        ``max_segments'' and ``max_characters''"""
+        texts = [text.strip() for text in texts if text.strip()]
+        if len(texts) > self.max_segments:
+            step = len(texts) / self.max_segments
+            texts = [texts[int(i * step)] for i in range(self.max_segments)]
+
+        sampled = []
+        n_characters = 0
+        for text in texts:
+            text = text[: self.max_characters - n_characters]
+            if not text:
+                break
+            sampled.append(text)
+            n_characters += len(text)
+        return sampled
+
+    def detect_document(self, texts, k=1):
+        """Function to infer the language of a document from a sample of its
+        segments. The probabilities of the segments are weighted by their
+        length.
+
+        Parameters
+        ----------
+        texts : list
+            Segments (paragraphs, pages...) of the document
+        k : int
+            Number of candidate languages returned
+
+        Returns
+        -------
+        candidates : list
+            List of (language, score) tuples sorted by score, the scores of
+            all the languages sum 1
+        """
+        segments = self.sample(texts)
+        if not segments:
+            return []
+
+        scores = {}
+        for segment, prediction in zip(
+            segments, self.predict(segments, k=3)
+        ):
+            for language, probability in prediction:
+                scores[language] = (
+                    scores.get(language, 0) + probability * len(segment)
+                )
+
+        total = sum(scores.values()) or 1
+        candidates = sorted(
+            ((language, score / total) for language, score in scores.items()),
+            key=lambda candidate: candidate[1],
+            reverse=True,
+        )
+        return candidates[:k]
+
+
+# process-wide language identifier, see ``configure_language_identifier''
+language_identifier = None
+
+
+def configure_language_identifier(preload=False, **kwargs):
+    """Function to (re)configure the process-wide language identifier, the
+    keyword arguments are passed to ``LanguageIdentifier''. The model is
+    loaded immediately when ``preload'' is True, otherwise on first use."""
+    global language_identifier
+    language_identifier = LanguageIdentifier(**kwargs)
+    if preload:
+        language_identifier.load()
+    return language_identifier
+
+
+def get_language_identifier():
+    """Returns the process-wide language identifier, it is created with the
+    default parameters the first time if it was not configured."""
+    if language_identifier is None:
+        configure_language_identifier()
+    return language_identifier
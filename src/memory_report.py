@@ -0,0 +1,87 @@
+"""Memory of the server processes, to check that the workers share the
+weights of the model.
+
+Usage:
+    python src/memory_report.py <pid of the gunicorn master>
+
+The resident memory (RSS) of every worker counts the shared pages, the
+proportional one (PSS) divides them between the processes which share them.
+When the weights are shared, the sum of the PSS of the workers is close to a
+single copy of the model, while the sum of their RSS is a copy per worker.
+"""
+import os
+import sys
+
+# fields of /proc/<pid>/smaps_rollup, in kB
+FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared_clean",
+    "Shared_Dirty": "shared_dirty",
+    "Private_Clean": "private_clean",
+    "Private_Dirty": "private_dirty",
+}
+
+
+def process_memory(pid="self"):
+    """Function to read the memory of a process (Linux only).
+
+    Parameters
+    ----------
+    pid : int | str
+        Process id, by default the current process
+
+    Returns
+    -------
+    memory : dict
+        Resident, proportional, shared and private memory in MiB
+    """
+    memory = {"pid": os.getpid() if pid == "self" else int(pid)}
+    memory.update({name: 0.0 for name in FIELDS.values()})
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            field, _, value = line.partition(":")
+            if field in FIELDS:
+                memory[FIELDS[field]] = int(value.split()[0]) / 1024
+    memory["shared"] = memory.pop("shared_clean") + memory.pop("shared_dirty")
+    memory["private"] = memory.pop("private_clean") + memory.pop(
+        "private_dirty"
+    )
+    return memory
+
+
+def child_processes(pid):
+    """Ids of the child processes of a process"""
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            children.extend(int(child) for child in f.read().split())
+    return children
+
+
+def memory_report(pid):
+    """Memory of a process and of its children, see ``process_memory''"""
+    return [process_memory(pid)] + [
+        process_memory(child) for child in child_processes(pid)
+    ]
+
+
+if __name__ == "__main__":
+    report = memory_report(sys.argv[1] if len(sys.argv) > 1 else os.getpid())
+    header = (
+        f"{'pid':>8} | {'RSS MiB':>9} {'PSS MiB':>9} | "
+        f"{'shared':>9} {'private':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for memory in report:
+        print(
+            f"{memory['pid']:>8} | {memory['rss']:>9.1f} "
+            f"{memory['pss']:>9.1f} | {memory['shared']:>9.1f} "
+            f"{memory['private']:>9.1f}"
+        )
+    print("-" * len(header))
+    print(
+        f"{'total':>8} | {sum(m['rss'] for m in report):>9.1f} "
+        f"{sum(m['pss'] for m in report):>9.1f} |"
+    )
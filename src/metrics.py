@@ -0,0 +1,262 @@
+"""In-process metrics of the translations, exposed in the Prometheus text
+format by the ``metrics/'' endpoint.
+
+The seconds spent on each stage (load of the document, language detection,
+rasterization, OCR, chunking, generation, rendering, save...) are aggregated
+in histograms labelled by document type, with counters of the translated
+segments, chunks and tokens and of the hits of the caches. The document
+type is set by ``document_metrics'' for everything observed in the same
+thread (or context), the text box translations are labelled ``text''.
+
+The metrics are kept by each process: with several server workers, each
+scrape reads the metrics of the worker which answers it.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+# document type of the translation being measured, see ``document_metrics''
+current_document_type = contextvars.ContextVar(
+    "current_document_type", default="text"
+)
+
+# metrics of the process, in the order they are exposed
+registry = []
+
+# seconds, from a few milliseconds (chunking) to minutes (documents)
+STAGE_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300
+)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class Metric:
+    """Metric with a value per combination of its labels"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                f"Metric {self.name} has the labels {self.labels}, "
+                f"got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+            for name, value in pairs
+        )
+        return "{" + ",".join(f'{n}="{v}"' for n, v in escaped) + "}"
+
+    def samples(self):
+        raise NotImplementedError
+
+    def exposition(self):
+        """Lines of the metric in the Prometheus text format"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(
+            f"{name}{labels} {value:g}"
+            for name, labels, value in self.samples()
+        )
+        return lines
+
+
+class Counter(Metric):
+    """Value which only increases"""
+
+    kind = "counter"
+
+    def inc(self, value=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        with self.lock:
+            return [
+                (self.name, self.label_text(key), value)
+                for key, value in sorted(self.values.items())
+            ]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0)
+            )
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    samples.append(
+                        (
+                            f"{self.name}_bucket",
+                            self.label_text(key, [("le", bound)]),
+                            cumulative,
+                        )
+                    )
+                samples.append(
+                    (f"{self.name}_sum", self.label_text(key), total)
+                )
+                samples.append(
+                    (f"{self.name}_count", self.label_text(key), cumulative)
+                )
+        return samples
+
+
+STAGE_SECONDS = Histogram(
+    "translation_stage_seconds",
+    "Seconds spent on each stage of the translations.",
+    ("document_type", "stage"),
+)
+DOCUMENTS = Counter(
+    "translation_documents_total",
+    "Translated documents by result.",
+    ("document_type", "status"),
+)
+SEGMENTS = Counter(
+    "translation_segments_total",
+    "Texts sent to the translation (paragraphs, runs, OCR blocks...).",
+    ("document_type",),
+)
+CHUNKS = Counter(
+    "translation_chunks_total",
+    "Chunks translated by the model.",
+    ("document_type",),
+)
+TOKENS = Counter(
+    "translation_tokens_total",
+    "Source tokens of the chunks and generated tokens.",
+    ("document_type", "kind"),
+)
+BATCH_SIZE = Histogram(
+    "translation_generate_batch_size",
+    "Chunks of each generate call.",
+    ("document_type",),
+    BATCH_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "translation_cache_requests_total",
+    "Lookups of the caches (translation memory, language identification, "
+    "OCR readers) by result.",
+    ("cache", "result"),
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "translation_model_load_seconds",
+    "Seconds spent loading the translation models.",
+    ("model",),
+)
+
+# keys of the ``timings'' of ``translation_app.translate_text'' and of
+# ``translation_app.translate_document'' and their stage, the translation
+# stage is split in ``chunking'' and ``generate'' by ``batch_translation''
+TIMING_STAGES = {
+    "preprocess": "load",
+    "language_detection": "language_detection",
+    "text_layer": "text_layer",
+    "text_layer_busy": "text_layer",
+    "rasterize_busy": "rasterize",
+    "ocr_busy": "ocr",
+    "translate": "translate",
+    "translate_busy": "translate",
+    "render_busy": "render",
+    "save": "save",
+    "total": "total",
+}
+
+
+@contextlib.contextmanager
+def document_metrics(document_type):
+    """Context in which the metrics are labelled with a document type"""
+    token = current_document_type.set(document_type)
+    try:
+        yield
+    finally:
+        current_document_type.reset(token)
+
+
+def document_type():
+    """Document type of the current context"""
+    return current_document_type.get()
+
+
+def observe_stage(stage, seconds, document_type=None):
+    """Adds the seconds spent on a stage"""
+    STAGE_SECONDS.observe(
+        seconds,
+        document_type=document_type or current_document_type.get(),
+        stage=stage,
+    )
+
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """Measures the seconds spent on a stage in the current context"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.time() - start)
+
+
+def observe_timings(timings, document_type=None):
+    """Adds the stages of the ``timings'' of a translated document, see
+    ``TIMING_STAGES''"""
+    for key, stage in TIMING_STAGES.items():
+        if key in timings:
+            observe_stage(stage, timings[key], document_type)
+
+
+def count_cache(cache, hits, misses):
+    """Counts the hits and misses of a cache"""
+    if hits:
+        CACHE_REQUESTS.inc(hits, cache=cache, result="hit")
+    if misses:
+        CACHE_REQUESTS.inc(misses, cache=cache, result="miss")
+
+
+def render_metrics():
+    """Metrics of the process in the Prometheus text format"""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.exposition())
+    return "\n".join(lines) + "\n"
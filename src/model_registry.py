@@ -0,0 +1,270 @@
+"""Translation models served by the process.
+
+Several NLLB variants can be served: the requests choose one by its name or
+by a tier (e.g. ``fast'' or ``quality''), and the models are loaded the first
+time they are requested. When the weights of the resident models would
+exceed the memory budget, the least recently used models are evicted (the
+translations which are using an evicted model finish with it, its memory is
+released afterwards).
+"""
+import collections
+import gc
+import os
+import threading
+import time
+
+from inference_backends import load_backend, OnnxBackend, TorchBackend
+from inference_server import RemoteBackend, request_server
+from metrics import MODEL_LOAD_SECONDS
+
+# registry parameters, see ``configure_model_registry''
+registry_options = {
+    # models which can be served, by name, with the options of
+    # ``inference_backends.load_backend'' of each one, e.g. its
+    # ``onnx_path'' or ``precision'', and its ``model_path'' (by default,
+    # the facebook repository of the name)
+    "models": {"nllb-200-distilled-600M": {}},
+    # names of the models which can also be requested by their tier
+    "tiers": {},
+    # model (or tier) of the requests which do not choose one
+    "default": "nllb-200-distilled-600M",
+    # MiB of weights of the resident models, None for no limit
+    "memory_budget_mb": None,
+    # options of ``load_backend'' shared by all the models
+    "backend_options": {},
+    # address of the inference server which holds the models, None to load
+    # them in the process, see ``inference_server''
+    "remote": None,
+    # seconds the remote models wait for each translation
+    "remote_timeout": None,
+}
+
+# loaded models, the least recently used first
+resident = collections.OrderedDict()
+# MiB of weights of each model the last time it was loaded
+model_sizes = {}
+registry_lock = threading.RLock()
+# a model is loaded by a single thread, the others wait for it
+load_locks = collections.defaultdict(threading.Lock)
+
+
+def configure_model_registry(**kwargs):
+    """Function to change the registry parameters of the process, see
+    ``registry_options''. The resident models are kept."""
+    unknown = set(kwargs) - set(registry_options)
+    if unknown:
+        raise ValueError(f"Unknown model registry options: {unknown}")
+    registry_options.update(kwargs)
+    for tier, name in registry_options["tiers"].items():
+        if name not in registry_options["models"]:
+            raise ValueError(f"Tier {tier} points to an unknown model {name}")
+    resolve_model(registry_options["default"])
+
+
+def resolve_model(name=None):
+    """Function to get the name of a model from a name or a tier.
+
+    Parameters
+    ----------
+    name : str | None
+        Name or tier of the model, the default one if None or empty
+
+    Returns
+    -------
+    model_name : str
+        Name of the model
+    """
+    name = name or registry_options["default"]
+    name = registry_options["tiers"].get(name, name)
+    if name not in registry_options["models"]:
+        raise ValueError(
+            f"Unknown model {name}, use one of {model_choices()}"
+        )
+    return name
+
+
+def model_choices():
+    """Tiers and names of the models which can be requested"""
+    return list(registry_options["tiers"]) + list(registry_options["models"])
+
+
+class ResidentModel:
+    """Loaded model with its usage"""
+
+    def __init__(self, name, backend, load_time):
+        self.name = name
+        self.backend = backend
+        self.load_time = load_time
+        self.memory_mb = backend_memory(backend)
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.uses = 0
+
+
+def model_bytes(model):
+    """Bytes of the weights of a torch model: its parameters and buffers,
+    and the packed weights of the dynamically quantized (int8) layers, which
+    are not parameters. The tensors shared by several layers (e.g. the tied
+    embeddings) are counted once."""
+    import torch
+
+    tensors = list(model.parameters()) + list(model.buffers())
+    for module in model.modules():
+        packed = getattr(module, "_packed_params", None)
+        if hasattr(packed, "_weight_bias"):
+            tensors.extend(packed._weight_bias())
+    sizes = {}
+    for tensor in tensors:
+        # the bias of a quantized layer can be None
+        if isinstance(tensor, torch.Tensor):
+            sizes[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+    return sum(sizes.values())
+
+
+def backend_memory(backend):
+    """MiB of the weights of a loaded backend, 0 for the remote ones"""
+    if isinstance(backend, TorchBackend):
+        return model_bytes(backend.model) / 2**20
+    if isinstance(backend, OnnxBackend):
+        return sum(
+            os.path.getsize(OnnxBackend.graph_path(backend.model_path, graph))
+            for graph in ("encoder", "decoder")
+        ) / 2**20
+    return 0.0
+
+
+def get_model(name=None):
+    """Function to get a model of the registry, it is loaded if it is not
+    resident.
+
+    Parameters
+    ----------
+    name : str | None
+        Name or tier of the model, the default one if None or empty
+
+    Returns
+    -------
+    model_name : str
+        Name of the model
+    backend : InferenceBackend
+        Loaded model
+    """
+    model_name = resolve_model(name)
+    with registry_lock:
+        if model_name in resident:
+            return model_name, use_model(model_name)
+
+    with load_locks[model_name]:
+        with registry_lock:
+            # another thread may have loaded it while waiting
+            if model_name in resident:
+                return model_name, use_model(model_name)
+            # room for the model, if its size is known
+            evict_models(model_sizes.get(model_name, 0))
+
+        start = time.time()
+        backend = load_model_backend(model_name)
+        load_time = time.time() - start
+        MODEL_LOAD_SECONDS.observe(load_time, model=model_name)
+
+        with registry_lock:
+            resident[model_name] = ResidentModel(
+                model_name, backend, load_time
+            )
+            model_sizes[model_name] = resident[model_name].memory_mb
+            evict_models(0, keep=model_name)
+            print(
+                f"Model {model_name} loaded in {load_time:.2f} s "
+                f"({model_sizes[model_name]:.0f} MiB)"
+            )
+            return model_name, use_model(model_name)
+
+
+def use_model(model_name):
+    """Marks a resident model as the most recently used one"""
+    model = resident[model_name]
+    resident.move_to_end(model_name)
+    model.last_used = time.time()
+    model.uses += 1
+    return model.backend
+
+
+def load_model_backend(model_name):
+    """Loads a model of the registry with its options"""
+    if registry_options["remote"] is not None:
+        return RemoteBackend(
+            registry_options["remote"],
+            registry_options["remote_timeout"],
+            model_name,
+        )
+    options = dict(registry_options["backend_options"])
+    options.update(registry_options["models"][model_name])
+    model_path = options.pop("model_path", f"facebook/{model_name}")
+    return load_backend(model_path, **options)
+
+
+def evict_models(needed_mb, keep=None):
+    """Evicts the least recently used models until the resident ones and
+    ``needed_mb'' fit in the memory budget"""
+    budget = registry_options["memory_budget_mb"]
+    if budget is None:
+        return
+    evicted = False
+    for model_name in list(resident):
+        used = sum(model.memory_mb for model in resident.values())
+        if used + needed_mb <= budget:
+            break
+        if model_name == keep:
+            continue
+        print(f"Model {model_name} evicted ({used:.0f} MiB resident)")
+        del resident[model_name]
+        evicted = True
+    if evicted:
+        gc.collect()
+
+
+def evict_model(name):
+    """Evicts a model of the registry, if it is resident"""
+    with registry_lock:
+        resident.pop(resolve_model(name), None)
+    gc.collect()
+
+
+def resident_models():
+    """Function to describe the models of the registry.
+
+    Returns
+    -------
+    description : dict
+        Configured ``models'' and ``tiers'', ``memory_budget_mb'' and the
+        ``resident'' models, the least recently used first, with their
+        variant, MiB of weights, load time, number of uses and timestamps.
+        If the models are held by the inference server, its registry is
+        described.
+    """
+    if registry_options["remote"] is not None:
+        return request_server(
+            registry_options["remote"],
+            {"op": "models"},
+            registry_options["remote_timeout"],
+        )
+    with registry_lock:
+        return {
+            "models": list(registry_options["models"]),
+            "tiers": registry_options["tiers"],
+            "default": resolve_model(),
+            "memory_budget_mb": registry_options["memory_budget_mb"],
+            "memory_mb": sum(model.memory_mb for model in resident.values()),
+            "resident": [
+                {
+                    "name": model.name,
+                    "variant": model.backend.variant,
+                    "memory_mb": model.memory_mb,
+                    "load_time": model.load_time,
+                    "loaded_at": model.loaded_at,
+                    "last_used": model.last_used,
+                    "uses": model.uses,
+                }
+                for model in resident.values()
+            ],
+        }
@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import easyocr
+from metrics import count_cache
+
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+EQUIVALENCES_PATH = os.path.join(projpath, "json", "bcp47_to_easyocr.json")
+# attributes of an ``easyocr.Reader'' set by ``getDetectorPath'', which is
+# only called when the reader loads its own detector
+DETECTION_ATTRIBUTES = (
+    "get_textbox",
+    "get_detector",
+    "detect_network",
+    "detector_path",
+)
+
+
+def module_size(module):
+    """Bytes taken by the parameters and buffers of a torch module"""
+    if module is None:
+        return 0
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class ReaderPool:
+    """Pool of warm easyocr readers, one per language. The detection network
+    does not depend on the language, so it is loaded once and shared by all
+    the readers, and only the recognition network is loaded per language.
+    The least recently used readers are evicted when the memory taken by
+    their networks exceeds the budget.
+
+    Parameters
+    ----------
+    memory_budget_mb : float | None
+        Max memory (in MB) taken by the readers, None for no limit
+    gpu : bool
+        Whether to run the networks on GPU
+    """
+
+    def __init__(self, memory_budget_mb=None, gpu=False):
+        self.memory_budget = (
+            None if memory_budget_mb is None else memory_budget_mb * 1024**2
+        )
+        self.gpu = gpu
+        with open(EQUIVALENCES_PATH) as f:
+            self.equivalences = json.load(f)
+        self.lock = threading.Lock()
+        # easyocr language -> (reader, bytes of its recognition network)
+        self.readers = OrderedDict()
+        # detection network and the functions which run it, set on the
+        # readers by easyocr only when they load the detector themselves
+        self.detector = None
+        self.detection_attributes = {}
+        self.detector_size = 0
+        self.load_times = {}
+
+    def easyocr_language(self, language):
+        """easyocr accepts its own syntax for language, we must change the
+        BCP-47 code of the translation model"""
+        easyocr_lang = self.equivalences.get(language)
+        if easyocr_lang is None:
+            raise ValueError(f"Language not supported by the OCR: {language}")
+        return easyocr_lang
+
+    def get_reader(self, language):
+        """Function to get the reader of a language, it is created if it is
+        not in the pool.
+
+        Parameters
+        ----------
+        language : str
+            Langugage code in BCP-47 of the text
+
+        Returns
+        -------
+        reader : easyocr.Reader
+            Reader of the language
+        """
+        easyocr_lang = self.easyocr_language(language)
+        with self.lock:
+            if easyocr_lang in self.readers:
+                self.readers.move_to_end(easyocr_lang)
+                count_cache("ocr_reader", 1, 0)
+                return self.readers[easyocr_lang][0]
+            count_cache("ocr_reader", 0, 1)
+
+            start = time.time()
+            if self.detector is None:
+                reader = easyocr.Reader([easyocr_lang], gpu=self.gpu)
+                self.detector = reader.detector
+                self.detection_attributes = {
+                    name: getattr(reader, name)
+                    for name in DETECTION_ATTRIBUTES
+                    if hasattr(reader, name)
+                }
+                self.detector_size = module_size(self.detector)
+            else:
+                # share the detection network already loaded, the readers
+                # built without detector also lack the functions using it
+                reader = easyocr.Reader(
+                    [easyocr_lang], gpu=self.gpu, detector=False
+                )
+                reader.detector = self.detector
+                for name, value in self.detection_attributes.items():
+                    setattr(reader, name, value)
+            self.load_times[easyocr_lang] = time.time() - start
+            print(
+                f"OCR reader '{easyocr_lang}' loaded in "
+                f"{self.load_times[easyocr_lang]:.2f} s"
+            )
+
+            self.readers[easyocr_lang] = (
+                reader,
+                module_size(reader.recognizer),
+            )
+            self.evict()
+            return reader
+
+    def memory_used(self):
+        """Bytes taken by the networks of the readers in the pool"""
+        return self.detector_size + sum(
+            size for _, size in self.readers.values()
+        )
+
+    def evict(self):
+        """Removes the least recently used readers until the pool fits in the
+        memory budget, the most recently used one is always kept"""
+        if self.memory_budget is None:
+            return
+        while (
+            len(self.readers) > 1 and self.memory_used() > self.memory_budget
+        ):
+            easyocr_lang, _ = self.readers.popitem(last=False)
+            print(f"OCR reader '{easyocr_lang}' evicted")
+
+    def prewarm(self, languages):
+        """Loads the readers of the given BCP-47 languages"""
+        for language in languages:
+            self.get_reader(language)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "readers": list(self.readers),
+                "memory_mb": self.memory_used() / 1024**2,
+                "load_times": dict(self.load_times),
+            }
+
+
+# process-wide pool of readers, see ``configure_reader_pool''
+reader_pool = None
+
+
+def configure_reader_pool(prewarm_languages=(), **kwargs):
+    """Function to (re)configure the process-wide pool of readers, the
+    keyword arguments are passed to ``ReaderPool''. The readers of
+    ``prewarm_languages'' are loaded immediately."""
+    global reader_pool
+    reader_pool = ReaderPool(**kwargs)
+    reader_pool.prewarm(prewarm_languages)
+    return reader_pool
+
+
+def get_reader_pool():
+    """Returns the process-wide pool of readers, it is created with the
+    default parameters the first time if it was not configured."""
+    if reader_pool is None:
+        configure_reader_pool()
+    return reader_pool
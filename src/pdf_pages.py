@@ -0,0 +1,169 @@
+import os
+import shutil
+import threading
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+
+# rasterization parameters, see ``configure_rasterization''
+rasterization_options = {
+    # resolution of the rasterized pages
+    "dpi": 200,
+    # pages rasterized by each poppler call
+    "pages_per_batch": 4,
+    # poppler threads rasterizing the pages of a batch
+    "thread_count": 2,
+    # memory (in MB) taken by the pages before spilling them to disk
+    "max_memory_mb": 1024,
+}
+
+
+def configure_rasterization(**kwargs):
+    """Function to change the rasterization parameters of the process, see
+    ``rasterization_options''."""
+    unknown = set(kwargs) - set(rasterization_options)
+    if unknown:
+        raise ValueError(f"Unknown rasterization options: {unknown}")
+    rasterization_options.update(kwargs)
+
+
+def count_pages(doc_filepath):
+    """Number of pages of a pdf"""
+    return pdfinfo_from_path(doc_filepath)["Pages"]
+
+
+def iter_pdf_pages(
+    doc_filepath,
+    first_page=1,
+    last_page=None,
+    dpi=None,
+    pages_per_batch=None,
+):
+    """Generator of the rasterized pages of a pdf. Pages are rasterized on
+    demand, a few of them at a time, so the whole document is never held in
+    memory by poppler.
+
+    Parameters
+    ----------
+    doc_filepath : str
+        String with complete path to the document
+    first_page : int
+        First page to rasterize (starting at 1)
+    last_page : int | None
+        Last page to rasterize, by default the last page of the document
+    dpi : int | None
+        Resolution of the pages, see ``rasterization_options''
+    pages_per_batch : int | None
+        Pages rasterized by each poppler call, see ``rasterization_options''
+
+    Yields
+    ------
+    page : int
+        Number of the page (starting at 1)
+    image : np.ndarray
+        RGB image of the page
+    """
+    dpi = dpi or rasterization_options["dpi"]
+    if pages_per_batch is None:
+        pages_per_batch = rasterization_options["pages_per_batch"]
+    if last_page is None:
+        last_page = count_pages(doc_filepath)
+
+    for first in range(first_page, last_page + 1, pages_per_batch):
+        last = min(first + pages_per_batch - 1, last_page)
+        images = convert_from_path(
+            doc_filepath,
+            dpi=dpi,
+            first_page=first,
+            last_page=last,
+            thread_count=rasterization_options["thread_count"],
+        )
+        for offset, image in enumerate(images):
+            yield first + offset, np.array(image.convert("RGB"))
+
+
+class PageStore:
+    """Images of the pages of a pdf as numpy arrays. They are kept in memory
+    while they fit in the memory ceiling, the pages added beyond it are
+    spilled to disk as raw ``.npy'' files (no image encoding) and loaded
+    back when requested.
+
+    Parameters
+    ----------
+    spill_path : str
+        Folder where the pages are spilled to
+    max_memory_mb : float | None
+        Memory ceiling (in MB), see ``rasterization_options''
+    """
+
+    def __init__(self, spill_path, max_memory_mb=None):
+        self.spill_path = spill_path
+        if max_memory_mb is None:
+            max_memory_mb = rasterization_options["max_memory_mb"]
+        self.max_memory = max_memory_mb * 1024**2
+        # page -> np.ndarray for the pages in memory, path for the spilled
+        self.images = {}
+        self.memory_used = 0
+        self.lock = threading.Lock()
+
+    def spilled(self, page):
+        return isinstance(self.images.get(page), str)
+
+    def set(self, page, image):
+        """Stores (or replaces) the image of a page"""
+        with self.lock:
+            if page in self.images and not self.spilled(page):
+                self.memory_used -= self.images[page].nbytes
+
+            in_memory = self.memory_used + image.nbytes <= self.max_memory
+            if in_memory:
+                self.images[page] = image
+                self.memory_used += image.nbytes
+
+        if not in_memory:
+            os.makedirs(self.spill_path, exist_ok=True)
+            path = os.path.join(self.spill_path, f"page_{page}.npy")
+            np.save(path, image)
+            self.images[page] = path
+
+    def get(self, page):
+        """Image of a page"""
+        image = self.images[page]
+        if isinstance(image, str):
+            image = np.load(image)
+        return image
+
+    def pages(self):
+        """Numbers of the stored pages, in order"""
+        return sorted(self.images)
+
+    def __len__(self):
+        return len(self.images)
+
+    def clear(self):
+        """Removes the pages from memory and disk"""
+        self.images = {}
+        self.memory_used = 0
+        shutil.rmtree(self.spill_path, ignore_errors=True)
+
+
+class PdfDocument:
+    """Pdf document being translated.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the original pdf
+    segments : SegmentStore
+        Paragraph texts, bounding boxes and pages obtained with the OCR
+    pages : PageStore
+        Images of the pages, the bounding boxes refer to them
+    rendered : bool
+        Whether the translated text has already been written on the pages
+    """
+
+    def __init__(self, filename, segments, pages, rendered=False):
+        self.filename = filename
+        self.segments = segments
+        self.pages = pages
+        self.rendered = rendered
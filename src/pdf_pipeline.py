@@ -0,0 +1,464 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from transformers import AutoModelForSeq2SeqLM
+from ocr_readers import get_reader_pool
+from pdf_pages import count_pages, iter_pdf_pages, PageStore, PdfDocument
+from pdf_text_layer import extract_text_layer
+from preprocess_pdf import detect_language, ocr_page, DETECTION_PAGES
+from segment_store import SegmentStore
+from save_document import render_page
+from tokenizer_registry import get_tokenizer
+from translate_pdf import translate
+
+
+# pipeline parameters, see ``configure_pipeline''
+pipeline_options = {
+    # whether the pdfs are translated with the pipeline or stage by stage
+    "enabled": True,
+    # threads running the OCR, they share the warm reader of the language
+    "ocr_workers": 2,
+    # processes writing the translated text on the pages, 0 to render them
+    # in the translation thread
+    "render_workers": 2,
+    # pages waiting between two stages
+    "queue_size": 4,
+    # max number of OCR'd pages whose paragraphs are translated together
+    "pages_per_translation": 4,
+}
+
+# signals the end of the pages to the next stage
+END = None
+
+# pool of processes rendering the pages, shared by all the documents
+render_executor = None
+render_executor_lock = threading.Lock()
+
+
+def configure_pipeline(**kwargs):
+    """Function to change the pipeline parameters of the process, see
+    ``pipeline_options''."""
+    global render_executor
+    unknown = set(kwargs) - set(pipeline_options)
+    if unknown:
+        raise ValueError(f"Unknown pipeline options: {unknown}")
+    pipeline_options.update(kwargs)
+    # the pool is created again with the new number of processes
+    with render_executor_lock:
+        if render_executor is not None:
+            render_executor.shutdown(wait=False)
+            render_executor = None
+
+
+def get_render_executor():
+    """Returns the pool of rendering processes, it is created the first
+    time. The processes are spawned instead of forked, as forking a process
+    with running torch threads may deadlock."""
+    global render_executor
+    with render_executor_lock:
+        if render_executor is None:
+            render_executor = ProcessPoolExecutor(
+                max_workers=pipeline_options["render_workers"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return render_executor
+
+
+class PipelineError(Exception):
+    """Raised to stop the stages when another one has failed"""
+
+
+class PagePipeline:
+    """Translation of a pdf where each page flows independently through the
+    rasterization, OCR, translation and rendering stages. The stages are
+    connected by bounded queues, so a page is OCR'd while the previous ones
+    are being translated or rendered and only a few pages are in memory at
+    a time.
+
+    Parameters
+    ----------
+    doc_filepath : str
+        String with complete path to the document
+    language : str | None
+        Langugage code in BCP-47 of the document, inferred from its first
+        pages if None
+    tokenizer : NllbTokenizerFast
+        Shared tokenizer of the model
+    model : transformers model
+        Shared translation model
+    max_tokens : int
+        Max number of tokens of each translated chunk
+    lang_dest_code : str
+        Langugage code in BCP-47 of the desired output
+    batch_size : int
+        Max number of text chunks translated in each ``generate'' call
+    max_batch_tokens : int
+        Max number of tokens (padding included) in each ``generate'' call
+    model_name : str | None
+        Name of the model, used by the translation memory
+    progress_callback : callable | None
+        Called with the fraction of the pages translated
+    decoding_profile : str | None
+        Name of the decoding profile, see ``decoding''
+    """
+
+    def __init__(
+        self,
+        doc_filepath,
+        language,
+        tokenizer,
+        model,
+        max_tokens,
+        lang_dest_code,
+        batch_size=16,
+        max_batch_tokens=4096,
+        model_name=None,
+        progress_callback=None,
+        decoding_profile=None,
+    ):
+        self.doc_filepath = doc_filepath
+        self.language = language
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_tokens = max_tokens
+        self.lang_dest_code = lang_dest_code
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.model_name = model_name
+        self.progress_callback = progress_callback
+        self.decoding_profile = decoding_profile
+
+        queue_size = pipeline_options["queue_size"]
+        self.ocr_queue = queue.Queue(maxsize=queue_size)
+        self.translation_queue = queue.Queue(maxsize=queue_size)
+        # limits the pages being rendered
+        self.render_slots = threading.BoundedSemaphore(queue_size)
+        self.stop = threading.Event()
+        self.errors = []
+        # seconds each stage has been busy, summed over its workers
+        self.timings = {
+            "rasterize": 0.0,
+            "ocr": 0.0,
+            "translate": 0.0,
+            "render": 0.0,
+        }
+        self.timings_lock = threading.Lock()
+        # seconds spent inferring the language, see ``detect_language''
+        self.detection_timings = {}
+
+        # translated pages, spilled next to the document
+        self.pages = PageStore(
+            os.path.join(os.path.dirname(doc_filepath), "pages")
+        )
+        self.segments = []
+        # page -> segments of the pages that do not need to be OCR'd
+        self.extracted = {}
+        self.futures = []
+        self.n_pages = 0
+        self.pages_done = 0
+
+    def add_time(self, stage, start):
+        with self.timings_lock:
+            self.timings[stage] += time.time() - start
+
+    def put(self, stage_queue, item):
+        """Puts an item in a queue, giving up if the pipeline is stopped"""
+        while not self.stop.is_set():
+            try:
+                stage_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineError
+
+    def get(self, stage_queue):
+        """Gets an item of a queue, giving up if the pipeline is stopped"""
+        while not self.stop.is_set():
+            try:
+                return stage_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise PipelineError
+
+    def worker(self, target, *args):
+        """Runs a stage, the pipeline is stopped if it fails"""
+        try:
+            target(*args)
+        except PipelineError:
+            pass
+        except BaseException as error:
+            self.errors.append(error)
+            self.stop.set()
+
+    def rasterize(self, pages, n_ocr_workers):
+        start = time.time()
+        for page, image in pages:
+            self.add_time("rasterize", start)
+            self.put(self.ocr_queue, (page, image))
+            start = time.time()
+        for _ in range(n_ocr_workers):
+            self.put(self.ocr_queue, END)
+
+    def ocr(self, reader):
+        while True:
+            item = self.get(self.ocr_queue)
+            if item is END:
+                self.put(self.translation_queue, END)
+                return
+            page, image = item
+            if page in self.extracted:
+                segments = self.extracted.pop(page)
+            else:
+                start = time.time()
+                segments = ocr_page(reader, image, page)
+                self.add_time("ocr", start)
+            self.put(self.translation_queue, (page, image, segments))
+
+    def next_pages(self):
+        """OCR'd pages ready to be translated, it waits for the first one and
+        takes the rest that are already waiting. Returns the pages and the
+        number of OCR workers that have finished."""
+        items = [self.get(self.translation_queue)]
+        while len(items) < pipeline_options["pages_per_translation"]:
+            try:
+                items.append(self.translation_queue.get_nowait())
+            except queue.Empty:
+                break
+        finished = sum(item is END for item in items)
+        return [item for item in items if item is not END], finished
+
+    def translate_pages(self, items):
+        """Translates the paragraphs of several pages in a single batch"""
+        texts = []
+        for _, _, segments in items:
+            texts.extend(segments.paragraphs)
+        translations = translate(
+            texts,
+            self.tokenizer,
+            self.max_tokens,
+            self.model,
+            self.lang_dest_code,
+            self.batch_size,
+            self.max_batch_tokens,
+            self.model_name,
+            self.language,
+            self.decoding_profile,
+        )
+        offset = 0
+        for _, _, segments in items:
+            segments.translations = translations[
+                offset : offset + len(segments)
+            ]
+            offset += len(segments)
+
+    def render(self, page, image, segments):
+        """Writes the translated text on a page, in the pool of processes if
+        there is one"""
+        if pipeline_options["render_workers"] <= 0:
+            start = time.time()
+            self.page_rendered(page, render_page(image, segments), start)
+            return
+
+        self.render_slots.acquire()
+        start = time.time()
+        future = get_render_executor().submit(render_page, image, segments)
+
+        def done(future):
+            try:
+                self.page_rendered(page, future.result(), start)
+            except BaseException as error:
+                self.errors.append(error)
+                self.stop.set()
+            finally:
+                self.render_slots.release()
+
+        future.add_done_callback(done)
+        self.futures.append(future)
+
+    def page_rendered(self, page, image, start):
+        self.pages.set(page, image)
+        self.add_time("render", start)
+        with self.timings_lock:
+            self.pages_done += 1
+            pages_done = self.pages_done
+        if self.progress_callback is not None and self.n_pages:
+            self.progress_callback(0.9 * pages_done / self.n_pages)
+
+    def translate_and_render(self, n_ocr_workers):
+        finished = 0
+        while finished < n_ocr_workers:
+            items, n_finished = self.next_pages()
+            finished += n_finished
+            if not items:
+                continue
+            start = time.time()
+            self.translate_pages(items)
+            self.add_time("translate", start)
+            for page, image, segments in items:
+                self.segments.append(segments)
+                self.render(page, image, segments)
+
+    def run(self):
+        """Translates the document.
+
+        Returns
+        -------
+        language : str
+            Language of the pdf document
+        document : PdfDocument
+            Pdf document with the translated paragraphs and the translated
+            images of the pages
+        """
+        self.n_pages = count_pages(self.doc_filepath)
+        pages = iter_pdf_pages(self.doc_filepath)
+
+        # the pages with embedded text do not need to be OCR'd
+        start = time.time()
+        text_layer = extract_text_layer(self.doc_filepath)
+        self.timings["text_layer"] = time.time() - start
+        print(f"{len(text_layer)} of {self.n_pages} pages with a text layer")
+        self.extracted = dict(text_layer)
+
+        if self.language is None:
+            first_pages = []
+            if not text_layer:
+                # the first pages are OCR'd to infer the language, they are
+                # sent to the pipeline afterwards
+                start = time.time()
+                first_pages = list(itertools.islice(pages, DETECTION_PAGES))
+                self.add_time("rasterize", start)
+                pages = itertools.chain(first_pages, pages)
+            self.language, ocr_data = detect_language(
+                first_pages, text_layer, self.detection_timings
+            )
+            self.extracted.update(ocr_data)
+
+        # warm reader of the language, shared by the OCR threads
+        reader = None
+        if len(self.extracted) < self.n_pages:
+            reader = get_reader_pool().get_reader(self.language)
+
+        n_ocr_workers = max(1, pipeline_options["ocr_workers"])
+        threads = [
+            threading.Thread(
+                target=self.worker,
+                args=(self.rasterize, pages, n_ocr_workers),
+                name="pdf-rasterize",
+                daemon=True,
+            )
+        ] + [
+            threading.Thread(
+                target=self.worker,
+                args=(self.ocr, reader),
+                name=f"pdf-ocr-{idx}",
+                daemon=True,
+            )
+            for idx in range(n_ocr_workers)
+        ]
+        for thread in threads:
+            thread.start()
+        # the translation runs in the calling thread, with the shared model
+        self.worker(self.translate_and_render, n_ocr_workers)
+        self.stop.set()
+        for thread in threads:
+            thread.join()
+        # wait for the pages still being rendered
+        wait(self.futures)
+
+        if self.errors:
+            self.pages.clear()
+            raise self.errors[0]
+
+        document = PdfDocument(
+            os.path.basename(self.doc_filepath),
+            SegmentStore.concat(self.segments),
+            self.pages,
+            rendered=True,
+        )
+        return self.language, document
+
+
+def translate_document(
+    doc_filepath,
+    language,
+    model_name,
+    models_path,
+    max_tokens,
+    lang_dest_code,
+    loaded_model,
+    batch_size=16,
+    max_batch_tokens=4096,
+    decoding_profile=None,
+    timings=None,
+    progress_callback=None,
+):
+    """Function to translate a pdf with the page pipeline, see
+    ``PagePipeline''.
+
+    Parameters
+    ----------
+    doc_filepath : str
+        String with complete path to the document
+    language : str | None
+        Langugage code in BCP-47 of the document, inferred if None
+    model_name : str
+        Name of the model
+    models_path : str
+        Path to where the model is stored at
+    max_tokens : int
+        Max number of tokens of each translated chunk
+    lang_dest_code : str
+        Langugage code in BCP-47 of the desired output
+    loaded_model :
+        Model loaded when running the django server
+    batch_size : int
+        Max number of text chunks translated in each ``generate'' call
+    max_batch_tokens : int
+        Max number of tokens (padding included) in each ``generate'' call
+    decoding_profile : str | None
+        Name of the decoding profile, see ``decoding''
+    timings : dict | None
+        If given, the seconds each stage has been busy are stored in it
+    progress_callback : callable | None
+        Called with the fraction of the pages translated
+
+    Returns
+    -------
+    language : str
+        Language of the pdf document
+    document : PdfDocument
+        Translated pdf document, its pages are already rendered
+    """
+    tokenizer = get_tokenizer(model_name, models_path)
+    if loaded_model:
+        model = loaded_model
+    else:
+        # load models from local when debugging
+        model = AutoModelForSeq2SeqLM.from_pretrained(
+            os.path.join(models_path, f"{model_name}")
+        )
+
+    pipeline = PagePipeline(
+        doc_filepath,
+        language,
+        tokenizer,
+        model,
+        max_tokens,
+        lang_dest_code,
+        batch_size,
+        max_batch_tokens,
+        model_name,
+        progress_callback,
+        decoding_profile,
+    )
+    language, document = pipeline.run()
+    if timings is not None:
+        timings.update(
+            {f"{stage}_busy": busy for stage, busy in pipeline.timings.items()}
+        )
+        timings.update(pipeline.detection_timings)
+    return language, document
@@ -0,0 +1,138 @@
+import subprocess
+import xml.etree.ElementTree as ElementTree
+from pdf_pages import rasterization_options
+from segment_store import SegmentStore
+
+
+# text layer parameters, see ``configure_text_layer''
+text_layer_options = {
+    # whether the embedded text is used instead of the OCR when available
+    "enabled": True,
+    # min number of characters of a page to use its text layer
+    "min_characters": 20,
+    # min fraction of letters and digits in the text of the page, text
+    # layers of scanned documents or broken fonts are mostly symbols
+    "min_alphanumeric": 0.5,
+}
+
+
+def configure_text_layer(**kwargs):
+    """Function to change the text layer parameters of the process, see
+    ``text_layer_options''."""
+    unknown = set(kwargs) - set(text_layer_options)
+    if unknown:
+        raise ValueError(f"Unknown text layer options: {unknown}")
+    text_layer_options.update(kwargs)
+
+
+def local_name(element):
+    """Tag of an xml element without its namespace"""
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def parse_bbox_layout(xhtml, first_page=1, scale=1.0):
+    """Function to read the blocks of text of the ``pdftotext -bbox-layout''
+    output, each block is a paragraph.
+
+    Parameters
+    ----------
+    xhtml : str
+        Output of ``pdftotext -bbox-layout''
+    first_page : int
+        Number of the first page of the output
+    scale : float
+        Factor from pdf points to pixels of the rasterized pages
+
+    Returns
+    -------
+    pages : dict
+        Page -> SegmentStore with the blocks of the page
+    """
+    root = ElementTree.fromstring(xhtml)
+    pages = {}
+    page_elements = [e for e in root.iter() if local_name(e) == "page"]
+    for page, page_element in enumerate(page_elements, start=first_page):
+        paragraphs = []
+        boxes = []
+        for block in page_element.iter():
+            if local_name(block) != "block":
+                continue
+            lines = [
+                " ".join(
+                    word.text or ""
+                    for word in line
+                    if local_name(word) == "word"
+                )
+                for line in block
+                if local_name(line) == "line"
+            ]
+            text = " ".join(line for line in lines if line)
+            if not text:
+                continue
+            paragraphs.append(text)
+            boxes.append(
+                [
+                    float(block.get(coordinate)) * scale
+                    for coordinate in ("xMin", "yMin", "xMax", "yMax")
+                ]
+            )
+        pages[page] = SegmentStore(paragraphs, boxes, [page] * len(boxes))
+    return pages
+
+
+def usable(segments):
+    """Whether the text layer of a page can replace the OCR"""
+    text = "".join("".join(segments.paragraphs).split())
+    if len(text) < text_layer_options["min_characters"]:
+        return False
+    alphanumeric = sum(character.isalnum() for character in text)
+    return alphanumeric / len(text) >= text_layer_options["min_alphanumeric"]
+
+
+def extract_text_layer(doc_filepath, first_page=1, last_page=None, dpi=None):
+    """Function to extract the embedded text of a pdf with its bounding
+    boxes, scaled to the resolution of the rasterized pages. Only the pages
+    with a usable text layer are returned, the rest must be OCR'd.
+
+    Parameters
+    ----------
+    doc_filepath : str
+        String with complete path to the document
+    first_page : int
+        First page to extract (starting at 1)
+    last_page : int | None
+        Last page to extract, by default the last page of the document
+    dpi : int | None
+        Resolution of the rasterized pages, see ``rasterization_options''
+
+    Returns
+    -------
+    pages : dict
+        Page -> SegmentStore with the paragraphs of the pages with text
+    """
+    if not text_layer_options["enabled"]:
+        return {}
+
+    dpi = dpi or rasterization_options["dpi"]
+    command = ["pdftotext", "-bbox-layout", "-f", str(first_page)]
+    if last_page is not None:
+        command += ["-l", str(last_page)]
+    command += [doc_filepath, "-"]
+    try:
+        output = subprocess.run(
+            command, capture_output=True, check=True
+        ).stdout
+        # pdf coordinates are in points, 72 per inch
+        pages = parse_bbox_layout(output, first_page, dpi / 72)
+    except (
+        OSError,
+        subprocess.CalledProcessError,
+        ElementTree.ParseError,
+    ) as error:
+        print(f"Text layer not available, the pages will be OCR'd: {error}")
+        return {}
+    return {
+        page: segments
+        for page, segments in pages.items()
+        if usable(segments)
+    }
@@ -1,13 +1,16 @@
-from pdf2image import convert_from_path
-import easyocr
 import os
-import pandas as pd
-import json
-from utils import detect_language_from_images
+import time
+from utils import language_detection
+from ocr_readers import get_reader_pool
+from pdf_pages import iter_pdf_pages, PageStore, PdfDocument
+from pdf_text_layer import extract_text_layer
+from segment_store import SegmentStore
 
 
 def convert_pdf2image(doc_filepath):
-    """Function to convert a PDF into a set of images.
+    """Function to convert a PDF into a set of images. The pages are
+    rasterized a few at a time and kept as numpy arrays, they are only
+    written to disk if they exceed the memory ceiling of the store.
 
     Parameters
     ----------
@@ -16,28 +19,92 @@ def convert_pdf2image(doc_filepath):
 
     Returns
     -------
-    img_list : list
-        List of the converted images
+    pages : PageStore
+        Images of the pages
     """
-    filepath = os.path.abspath(__file__)
-    projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
-    tmp_path = os.path.join(projpath, "input", "tmp")
+    # the spilled pages are stored next to the document
+    pages = PageStore(os.path.join(os.path.dirname(doc_filepath), "pages"))
 
-    # Store Pdf with convert_from_path function
-    images = convert_from_path(doc_filepath)
+    for page, image in iter_pdf_pages(doc_filepath):
+        pages.set(page, image)
 
-    # list of filepaths to the images
-    img_list = []
+    return pages
 
-    for num, image in enumerate(images):
-        # Save pages as images in the pdf
-        image.save(os.path.join(tmp_path, f"page_{num+1}.png"))
-        img_list.append(os.path.join(tmp_path, f"page_{num+1}.png"))
 
-    return img_list
+# reader used to OCR the first pages when the language is not given, always
+# the same one so the detection does not depend on the previous documents.
+# Its output is kept when the document is in a language of that reader
+DETECTION_LANGUAGE = "eng_Latn"
+# max number of pages OCR'd to infer the language
+DETECTION_PAGES = 3
+# characters of text enough to infer the language
+DETECTION_CHARACTERS = 500
 
 
-def preprocess_text(doc_filepath, language):
+def detect_language(first_pages, text_layer, timings=None):
+    """Function to infer the language of a pdf. The embedded text is used
+    if the document has it, otherwise the first pages are OCR'd until there
+    is enough text. The OCR'd segments are returned so these pages are not
+    OCR'd again when the reader of the language is the same.
+
+    Parameters
+    ----------
+    first_pages : list
+        (page, image) tuples of the first pages of the document
+    text_layer : dict
+        Page -> SegmentStore of the pages with a text layer
+    timings : dict | None
+        If given, the seconds spent inferring the language and the seconds
+        of OCR reused afterwards (``language_detection_saved'') are stored
+
+    Returns
+    -------
+    language : str
+        Inferred language
+    segments : dict
+        Page -> SegmentStore of the OCR'd pages that can be reused
+    """
+    start = time.time()
+    reader_pool = get_reader_pool()
+    detection_language = DETECTION_LANGUAGE
+    segments = {}
+    ocr_time = 0.0
+    if text_layer:
+        texts = [
+            paragraph
+            for page_segments in text_layer.values()
+            for paragraph in page_segments.paragraphs
+        ]
+    else:
+        reader = reader_pool.get_reader(detection_language)
+        texts = []
+        for page, image in first_pages[:DETECTION_PAGES]:
+            ocr_start = time.time()
+            segments[page] = ocr_page(reader, image, page)
+            ocr_time += time.time() - ocr_start
+            texts.extend(segments[page].paragraphs)
+            if sum(len(text) for text in texts) >= DETECTION_CHARACTERS:
+                break
+
+    # documents without text are handled as the detection language
+    language = language_detection(texts) or detection_language
+
+    # the easyocr language is only needed if the pages have been OCR'd, the
+    # documents with a text layer can be in a language without OCR reader
+    if segments and reader_pool.easyocr_language(
+        language
+    ) != reader_pool.easyocr_language(detection_language):
+        # the pages must be OCR'd again with the reader of the language
+        segments = {}
+        ocr_time = 0.0
+
+    if timings is not None:
+        timings["language_detection"] = time.time() - start
+        timings["language_detection_saved"] = ocr_time
+    return language, segments
+
+
+def preprocess_text(doc_filepath, language, timings=None):
     """Function to preprocess text from a .pdf file.
 
     Parameters
@@ -47,79 +114,73 @@ def preprocess_text(doc_filepath, language):
     language : str | None
         Language of the original document if provided, if not it should be
         ``None'' and it will be inferred.language
+    timings : dict | None
+        If given, the seconds spent inferring the language are stored in it,
+        see ``detect_language''
 
     Returns
     -------
     language : str
         Language of the pdf document
-    ocr_data: pd.DataFrame
-        Pandas DataFrame with all the paragraph texts and its bounding boxes
+    document: PdfDocument
+        Pdf document with a SegmentStore with all the paragraph texts and
+        its bounding boxes, and the images of the pages
     """
 
-    # paths
-    filepath = os.path.abspath(__file__)
-    projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
-    json_path = os.path.join(projpath, "json", "bcp47_to_easyocr.json")
+    pages = convert_pdf2image(doc_filepath)
 
-    images = convert_pdf2image(doc_filepath)
+    # the pages with embedded text do not need to be OCR'd
+    text_layer = extract_text_layer(doc_filepath)
+    print(f"{len(text_layer)} of {len(pages)} pages with a text layer")
 
-    # use the google tesseract engine to convert the images to string
-    # TODO: it is better to use TESSERACT than easyOCR?
+    # pages whose segments are already known
+    extracted = dict(text_layer)
     if language is None:
-        language = detect_language_from_images(img_list=images)
+        language, ocr_data = detect_language(
+            [
+                (page, pages.get(page))
+                for page in pages.pages()[:DETECTION_PAGES]
+            ],
+            text_layer,
+            timings,
+        )
+        extracted.update(ocr_data)
+
+    if len(extracted) < len(pages):
+        # warm reader of the language, the pool translates the language code
+        # to the easyocr syntax
+        reader = get_reader_pool().get_reader(language)
+
+    # iterate over the images
+    ocr_data = SegmentStore.concat(
+        extracted[page]
+        if page in extracted
+        else ocr_page(reader, pages.get(page), page)
+        for page in pages.pages()
+    )
 
-    # easyocr accepts its own syntax for language, we must change this for the
-    # tranlation model
-    with open(json_path) as f:
-        equivalences = json.load(f)
+    document = PdfDocument(os.path.basename(doc_filepath), ocr_data, pages)
 
-    easyocr_lang = equivalences.get(language)
+    return language, document
 
-    # TODO: Enable GPU
-    reader = easyocr.Reader([easyocr_lang], gpu=False)
 
-    # empty parameters initialization
-    text_list = []
-    page_list = []
-    x_min_list = []
-    y_min_list = []
-    x_max_list = []
-    y_max_list = []
-    height_list = []
-    width_list = []
+def ocr_page(reader, image, page):
+    """Function to extract the paragraphs of a page and their bounding boxes.
 
-    # iterate over the images
-    for page, image in enumerate(images):
-        # extract paragraphs and its coordinates
-        bounds = reader.readtext(image, detail=1, paragraph=True)
-
-        # gather the info for each paragraph
-        for paragraph in bounds:
-            text_list.append(paragraph[1])
-            page_list.append(page + 1)
-            # bbox
-            xmin, ymin = paragraph[0][0]
-            xmax, ymax = paragraph[0][2]
-            x_min_list.append(xmin)
-            y_min_list.append(ymin)
-            x_max_list.append(xmax)
-            y_max_list.append(ymax)
-            height_list.append(ymax - ymin)
-            width_list.append(xmax - xmin)
-
-        # update the page
-        page += 1
-
-    # convert into a pandas dataframe
-    ocr_data = pd.DataFrame(
-        {
-            "paragraph": text_list,
-            "xmin": x_min_list,
-            "xmax": x_max_list,
-            "ymin": y_min_list,
-            "ymax": y_max_list,
-            "page": page_list,
-        }
-    )
+    Parameters
+    ----------
+    reader : easyocr.Reader
+        Reader of the language of the document
+    image : np.ndarray
+        Image of the page
+    page : int
+        Number of the page
 
-    return language, ocr_data
+    Returns
+    -------
+    ocr_data : SegmentStore
+        Paragraph texts of the page, its bounding boxes and page number
+    """
+    # extract paragraphs and its coordinates
+    bounds = reader.readtext(image, detail=1, paragraph=True)
+    return SegmentStore.from_ocr(bounds, page)
@@ -0,0 +1,133 @@
+"""On-demand profiling of the translation of a document.
+
+When a job is profiled, the translation and the save of the document run
+under cProfile and the PyTorch profiler, and their artifacts are written
+next to the translated document:
+
+- ``<output>.pstats'': cProfile statistics, to be read with ``pstats'' or
+  snakeviz
+- ``<output>.profile.txt'': functions of the statistics with the highest
+  cumulative time
+- ``<output>.trace.json'': Chrome trace of the PyTorch operators, to be
+  opened in chrome://tracing or Perfetto
+
+cProfile only sees the thread translating the document (the OCR and
+rasterization threads of the pdf pipeline are not included), the PyTorch
+profiler records the operators of every thread. The documents which are not
+profiled do not pay anything, the profilers are only created when needed.
+"""
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+
+profiling_options = {
+    # profile every document, the jobs can also ask for it one by one
+    "enabled": False,
+    # also record a Chrome trace of the PyTorch operators
+    "torch": True,
+    # order and number of functions of the text summary
+    "sort": "cumulative",
+    "top": 50,
+}
+
+ARTIFACT_SUFFIXES = (".pstats", ".profile.txt", ".trace.json")
+
+# only one PyTorch profiler can run at the same time in a process
+torch_profiler_lock = threading.Lock()
+
+
+def configure_profiling(**kwargs):
+    """Function to set the profiling options, see ``profiling_options''"""
+    unknown = set(kwargs) - set(profiling_options)
+    if unknown:
+        raise ValueError(f"Unknown profiling options: {sorted(unknown)}")
+    profiling_options.update(kwargs)
+
+
+def profiling_enabled(profile=None):
+    """Whether a document is profiled: the choice of the job if given, the
+    ``enabled'' option otherwise"""
+    if profile is None:
+        return profiling_options["enabled"]
+    return bool(profile)
+
+
+def artifact_paths(output_file):
+    """Paths of the profiling artifacts of a translated document"""
+    return [output_file + suffix for suffix in ARTIFACT_SUFFIXES]
+
+
+@contextlib.contextmanager
+def torch_trace(trace_path):
+    """Records the PyTorch operators in a Chrome trace, nothing is recorded
+    if another document is already traced"""
+    if not profiling_options["torch"] or not torch_profiler_lock.acquire(
+        blocking=False
+    ):
+        yield
+        return
+    try:
+        from torch.profiler import ProfilerActivity, profile
+
+        with profile(activities=[ProfilerActivity.CPU]) as profiler:
+            yield
+        profiler.export_chrome_trace(trace_path)
+    finally:
+        torch_profiler_lock.release()
+
+
+@contextlib.contextmanager
+def profile_document(output_file):
+    """Function to profile the code run in the context, the artifacts are
+    written next to ``output_file''.
+
+    Parameters
+    ----------
+    output_file : str
+        Path of the translated document
+
+    Yields
+    ------
+    artifacts : list
+        Filled at the end with the paths of the written artifacts
+    """
+    stats_path, summary_path, trace_path = artifact_paths(output_file)
+    # artifacts of a previous translation of a document with the same name
+    for path in (stats_path, summary_path, trace_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    artifacts = []
+    profiler = cProfile.Profile()
+    start = time.time()
+    try:
+        with torch_trace(trace_path):
+            profiler.enable()
+            try:
+                yield artifacts
+            finally:
+                profiler.disable()
+    finally:
+        profiler.dump_stats(stats_path)
+        summary = io.StringIO()
+        summary.write(
+            f"Profile of {os.path.basename(output_file)}, "
+            f"{time.time() - start:.2f} s\n"
+        )
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats(profiling_options["sort"]).print_stats(
+            profiling_options["top"]
+        )
+        with open(summary_path, "w") as f:
+            f.write(summary.getvalue())
+        artifacts.extend(
+            path
+            for path in (stats_path, summary_path, trace_path)
+            if os.path.exists(path)
+        )
+        print(f"Profile saved: {', '.join(artifacts)}")
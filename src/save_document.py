@@ -1,8 +1,8 @@
 import os
 from tqdm import tqdm
-import cv2
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+from text_layout import draw_text
 
 
 def save_translated_doc(document, output_path, document_type):
@@ -11,8 +11,8 @@ def save_translated_doc(document, output_path, document_type):
 
     Parameters
     ----------
-    document : File containing all the document info, could be a pandas
-    dataframe if the input document was a pdf or a word or pptx document
+    document : File containing all the document info, could be a
+    PdfDocument if the input document was a pdf or a word or pptx document
 
     output_path : str
         Path to where the translation will be stored at
@@ -34,255 +34,161 @@ def save_translated_doc(document, output_path, document_type):
     else:
         # when the document is PDF we must overwrite the translated text over
         # the original text on every image given their positions
-        overwrite_text_on_images(document)
+        overwrite_text_on_images(document, output_path)
 
     print("Document saved.")
 
 
-def overwrite_text_on_images(document):
+def overwrite_text_on_images(document, output_path):
     """Function needed for replacing the translated pdf text chunks over
     the images extracted from the input pdf
 
     Parameters
     ----------
-    document : pd.DataFrame
-    Input document after OCR
+    document : PdfDocument
+    Input document after OCR, with the images of its pages
+
+    output_path : str
+    Path to where the translated pdf will be stored at
 
     Returns
     -------
     The document images are automatically saved
     """
+    segments = document.segments
 
-    # define necessary paths
-    filepath = os.path.abspath(__file__)
-    projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
-    img_path = os.path.join(projpath, "input", "tmp")
-    output_path = os.path.join(projpath, "media", "translated_documents")
-
-    # tmp folder contains the images extracted from the pdf so we will iter
-    # over them
-
-    images = [file for file in os.listdir(img_path) if file.endswith(".png")]
-    pdf_file = [
-        file for file in os.listdir(img_path) if file.endswith(".pdf")
-    ][0]
-    translated_images = []
     print("Overriting text on PDF images...")
-    # images are named 'page_i.png', order the image list
-    ordered_imgs = sorted(
-        images, key=lambda x: int(x.replace("page_", "").replace(".png", ""))
-    )
-    for image in tqdm(ordered_imgs):
-        # Load the image
-        path = os.path.join(img_path, image)
-        img = cv2.imread(path)
-        # get the page(all in the format ``page_{}.png'')
-        page = int(image.split(".")[0].replace("page_", ""))
-        # filter for the boxes on the page
-        aux = document[document.page == page]
-        # overlaping correction
-        aux = overalapping_correction(aux)
-        # iter over the boxes of that page
-        for idx, attributes in aux.iterrows():
-            upper_left = (attributes.xmin, attributes.ymax)
-            bottom_right = (attributes.xmax, attributes.ymin)
-            translated_text = attributes.translated_paragraph
-            # inpaint the original image
-            img = inpaint_algorithm(
-                img, upper_left, bottom_right, translated_text
-            )
+    for idx, page in enumerate(tqdm(document.pages.pages())):
+        if document.rendered:
+            # the translated text was already written by the pipeline
+            img = document.pages.get(page)
+        else:
+            # load the image, a copy so the stored page is not modified
+            img = np.array(document.pages.get(page))
+            # filter for the boxes on the page
+            img = render_page(img, segments.page_segments(page))
 
-        # at the end we save the image
-        cv2.imwrite(os.path.join(img_path, "translated_" + image), img)
-        # open the image with PIL
-        pil_im = Image.open(os.path.join(img_path, "translated_" + image))
-        pil_im = pil_im.convert(
-            "RGB"
-        )  # to prevent errors: cannot save mode RGBA
-        translated_images.append(pil_im)
-
-    # make a single pdf from img list
-    image = translated_images[0]
-    translated_images.pop(0)
-    image.save(
-        os.path.join(output_path, "translated_" + pdf_file),
-        "PDF",
-        resolution=100.0,
-        save_all=True,
-        append_images=translated_images,
-    )
-
-
-def inpaint_algorithm(image, upper_left, bottom_right, translated_text):
-    """Function to interpolate the background of a text box with a rectangular mask"""
-    # band of pixels in which compute the median
-    outer_pixels = 5
-    # get the median of the pixels just in the outer border of our bbox:
-    #   _____
-    #
-    # |    |
-    # ____
-
-    # conditions over the height
-    up_contour = image[
-        upper_left[1] : (upper_left[1] + outer_pixels),
-        upper_left[0] : bottom_right[0],
-        :,
-    ].reshape(outer_pixels, -1, 3)
-    bottom_contour = image[
-        (bottom_right[1] - outer_pixels) : bottom_right[1],
-        upper_left[0] : bottom_right[0],
-        :,
-    ].reshape(outer_pixels, -1, 3)
-    # conditions over the width
-    left_contour = image[
-        bottom_right[1] : upper_left[1],
-        (upper_left[0] - outer_pixels) : upper_left[0],
-        :,
-    ].reshape(outer_pixels, -1, 3)
-    right_contour = image[
-        bottom_right[1] : upper_left[1],
-        bottom_right[0] : (bottom_right[0] + outer_pixels),
-        :,
-    ].reshape(outer_pixels, -1, 3)
-
-    # concatenate over the 2º axis
-    border = np.concatenate(
-        (up_contour, bottom_contour, left_contour, right_contour), axis=1
-    )
-
-    # calculate the median color of the pixel borders
-    median_color = np.median(border, axis=(0, 1))
-
-    # draw a rectangle in that colour
-    image = cv2.rectangle(
-        image, upper_left, bottom_right, color=median_color, thickness=-1
-    )
-
-    # write text on the image
-    image = write_text_on_rectangle(
-        image,
-        translated_text,
-        {
-            "left": upper_left[0],
-            "top": bottom_right[1],
-            "right": bottom_right[0],
-            "bottom": upper_left[1],
-        },
-        "arial.ttf",
-    )
-
-    # back to numpy array
-    image = np.array(image)
+        # the pages are appended to the pdf one by one, so the translated
+        # images are not held in memory
+        pil_im = Image.fromarray(img).convert("RGB")
+        pil_im.save(output_path, "PDF", resolution=100.0, append=idx > 0)
 
-    return image
+    document.pages.clear()
 
 
-def write_text_on_rectangle(image, text, coords, font):
-    """
-    coords: (left=w, top=x, right=y, bottom=z)
-    """
-    # opens the image
-    img = Image.fromarray(image)
+def render_page(img, segments):
+    """Function to overwrite the translated text of the boxes of a page. The
+    boxes are inpainted together and the page is converted to a PIL image
+    once to write all the texts.
+
+    Parameters
+    ----------
+    img : np.ndarray
+    Image of the page, it is modified
 
-    max_width = coords.get("right") - coords.get("left")
-    max_height = coords.get("bottom") - coords.get("top")
+    segments : SegmentStore
+    Boxes of the page with their translated paragraphs
 
-    FONT_SIZE = 72
-    FONT_FAMILY = f"/home/ubuntu/LLM-translator/fonts/{font}"
+    Returns
+    -------
+    img : np.ndarray
+    Translated image of the page
+    """
+    if len(segments) == 0:
+        return img
+
+    # overlaping correction
+    boxes = clip_boxes(segments.corrected_boxes(), img.shape)
+
+    # interpolate the background of the boxes
+    img = inpaint_boxes(img, boxes)
+
+    # write the texts on the image
+    pil_im = Image.fromarray(img)
+    draw = ImageDraw.Draw(pil_im)
+    for (xmin, ymin, xmax, ymax), translated_text in zip(
+        boxes, segments.translations
+    ):
+        if xmax > xmin and ymax > ymin:
+            draw_text(
+                draw,
+                translated_text,
+                {"left": xmin, "top": ymin, "right": xmax, "bottom": ymax},
+            )
 
-    # initialization
-    line_heights = 1e10
-    draw = ImageDraw.Draw(img)
+    return np.asarray(pil_im)
 
-    while line_heights > max_height:
-        # create the ImageFont instance
-        font = ImageFont.truetype(FONT_FAMILY, size=FONT_SIZE)
 
-        # get shorter lines
-        lines = text_wrap(text, font, max_width)
+def clip_boxes(boxes, shape):
+    """Rounds the (xmin, ymin, xmax, ymax) boxes to pixels inside the page"""
+    boxes = np.rint(np.asarray(boxes, dtype=float)).astype(int)
+    height, width = shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width - 1)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height - 1)
+    return boxes
 
-        # TODO: add a margin to add between lines
-        origin = (coords.get("left"), coords.get("top"))
-        line_heights = get_y_and_heights(lines, font, draw, origin)
 
-        # decrease the font several points
-        FONT_SIZE -= 2
+def border_colors(image, boxes, outer_pixels=5):
+    """Function to compute the median colour of the band of pixels around
+    each box:
+      _____
+    |       |
+    |       |
+      _____
 
-    # finally write the text
-    short_text = "\n".join(lines)
-    draw.text(
-        origin,
-        short_text,
-        font=font,
-        fill="black",
-    )
-    return img
+    The pixels of all the bands of the page are labelled with their box and
+    the medians are computed at once by sorting them by box and value.
 
+    Parameters
+    ----------
+    image : np.ndarray
+        Image of the page
+    boxes : np.ndarray
+        (xmin, ymin, xmax, ymax) pixel boxes, see ``clip_boxes''
+    outer_pixels : int
+        Width of the band of pixels
 
-def get_y_and_heights(text_wrapped, font, draw, origin):
-    """
-    Gets the vertical size of a given text:
-    https://stackoverflow.com/questions/43060479/
+    Returns
+    -------
+    colors : np.ndarray
+        Median colour of each box, white if its band is empty
     """
-    short_text = "\n".join(text_wrapped)
-    bbox = draw.textbbox(origin, short_text, font=font)
-    # bbox returns (left, top, right, bottom) bounding box
-    height_text = bbox[3] - bbox[1]
-    return height_text
-
-
-def text_wrap(text, font, max_width):
-    lines = []
-    # If the width of the text is smaller than image width
-    # we don't need to split it, just add it to the lines array
-    # and return
-    if font.getsize(text)[0] <= max_width:
-        lines.append(text)
-    else:
-        # split the line by spaces to get words
-        words = text.split(" ")
-        i = 0
-        # append every word to a line while its width is shorter than image
-        # width
-        while i < len(words):
-            line = ""
-            while (
-                i < len(words)
-                and font.getsize(line + words[i])[0] <= max_width
-            ):
-                line = line + words[i] + " "
-                i += 1
-            if not line:
-                line = words[i]
-                i += 1
-            # when the line gets longer than the max width do not append the
-            # word, add the line to the lines array
-            lines.append(line.strip())
-    return lines
-
-
-def overalapping_correction(df):
-    """corrects the overlapping of bboxes by readjusting their ypos"""
-    aux = df.copy()
-
-    # initialize the first bottom value of the bbox in the 'y' coord
-    ymax_prev, xmin_prev, xmax_prev = aux.iloc[0].loc[["ymax", "xmin", "xmax"]]
-
-    for row in aux[1:].itertuples():
-        ymin, ymax, xmin, xmax = row.ymin, row.ymax, row.xmin, row.xmax
-
-        # overlapping conditions
-        condition_1 = ymin < ymax_prev
-        condition_2 = (xmin < xmax_prev) & (xmax > xmax_prev)
-        condition_3 = (xmax > xmin_prev) & (xmax < xmax_prev)
-        overlapping_condition = condition_1 & (condition_2 | condition_3)
-
-        if overlapping_condition:
-            # update the row in the dataframe
-            aux["ymin"].at[row.Index] = ymax_prev
-
-        # update the prev
-        ymax_prev, xmin_prev, xmax_prev = ymax, xmin, xmax
-
-    return aux
+    height, width = image.shape[:2]
+    labels = np.full((height, width), -1, dtype=np.int32)
+    for idx, (xmin, ymin, xmax, ymax) in enumerate(boxes):
+        labels[
+            max(ymin - outer_pixels, 0) : ymax + outer_pixels + 1,
+            max(xmin - outer_pixels, 0) : xmax + outer_pixels + 1,
+        ] = idx
+    # the pixels inside the boxes are text, not background
+    for xmin, ymin, xmax, ymax in boxes:
+        labels[ymin : ymax + 1, xmin : xmax + 1] = -1
+
+    in_band = labels >= 0
+    owners = labels[in_band]
+    pixels = image[in_band].reshape(len(owners), -1)
+
+    colors = np.full((len(boxes), pixels.shape[1]), 255.0)
+    counts = np.bincount(owners, minlength=len(boxes))
+    has_band = counts > 0
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[has_band]
+    counts = counts[has_band]
+    for channel in range(pixels.shape[1]):
+        # pixels sorted by box and, within each box, by value
+        values = pixels[np.lexsort((pixels[:, channel], owners)), channel]
+        colors[has_band, channel] = (
+            values[starts + (counts - 1) // 2].astype(float)
+            + values[starts + counts // 2]
+        ) / 2
+
+    return colors
+
+
+def inpaint_boxes(image, boxes):
+    """Function to interpolate the background of the text boxes of a page
+    with rectangles of the median colour of their borders, the image is
+    modified in place"""
+    colors = border_colors(image, boxes)
+    for (xmin, ymin, xmax, ymax), color in zip(boxes, colors):
+        image[ymin : ymax + 1, xmin : xmax + 1] = color
+    return image
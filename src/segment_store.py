@@ -0,0 +1,125 @@
+import numpy as np
+
+
+# columns of the bounding boxes
+XMIN, YMIN, XMAX, YMAX = range(4)
+
+
+class SegmentStore:
+    """Paragraphs extracted from the pages of a pdf, stored by columns: the
+    pages and the bounding boxes are numpy arrays and the texts and their
+    translations are lists of strings. The segments are sorted by page, so
+    the segments of a page are a contiguous slice.
+
+    Parameters
+    ----------
+    paragraphs : list
+        Texts of the paragraphs
+    boxes : np.ndarray
+        (xmin, ymin, xmax, ymax) bounding box of each paragraph
+    pages : np.ndarray
+        Page of each paragraph (starting at 1), in ascending order
+    translations : list | None
+        Translated texts of the paragraphs, if already translated
+    """
+
+    def __init__(self, paragraphs, boxes, pages, translations=None):
+        self.paragraphs = list(paragraphs)
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.pages = np.asarray(pages, dtype=np.int32)
+        self.translations = translations
+
+    @classmethod
+    def from_ocr(cls, bounds, page):
+        """Segments of a page from the ``readtext'' output of easyocr, with
+        ``detail=1'' and ``paragraph=True''"""
+        paragraphs = [paragraph[1] for paragraph in bounds]
+        # upper left and bottom right corners of the bbox
+        boxes = [
+            (*paragraph[0][0], *paragraph[0][2]) for paragraph in bounds
+        ]
+        return cls(paragraphs, boxes, np.full(len(bounds), page))
+
+    @classmethod
+    def concat(cls, stores):
+        """Joins the segments of several stores, sorted by page"""
+        stores = list(stores)
+        if not stores:
+            return cls([], [], [])
+        pages = np.concatenate([store.pages for store in stores])
+        order = np.argsort(pages, kind="stable")
+        paragraphs = [p for store in stores for p in store.paragraphs]
+        translations = None
+        if all(store.translations is not None for store in stores):
+            translations = [t for store in stores for t in store.translations]
+            translations = [translations[idx] for idx in order]
+        return cls(
+            [paragraphs[idx] for idx in order],
+            np.concatenate([store.boxes for store in stores])[order],
+            pages[order],
+            translations,
+        )
+
+    def __len__(self):
+        return len(self.paragraphs)
+
+    def page_bounds(self, page):
+        """Start and end of the slice of the segments of a page"""
+        start, end = np.searchsorted(self.pages, [page, page + 1])
+        return int(start), int(end)
+
+    def page_segments(self, page):
+        """Segments of a page, the arrays are views of the store"""
+        start, end = self.page_bounds(page)
+        return SegmentStore(
+            self.paragraphs[start:end],
+            self.boxes[start:end],
+            self.pages[start:end],
+            None
+            if self.translations is None
+            else self.translations[start:end],
+        )
+
+    def corrected_boxes(self):
+        """Bounding boxes with the overlapping corrected, see
+        ``overlap_correction''"""
+        return overlap_correction(self.boxes, self.pages)
+
+
+def overlap_correction(boxes, pages):
+    """Function to correct the overlapping of the bboxes by readjusting their
+    ypos: the top of a box is moved to the bottom of the previous box of the
+    page when they overlap.
+
+    Parameters
+    ----------
+    boxes : np.ndarray
+        (xmin, ymin, xmax, ymax) bounding boxes, in reading order
+    pages : np.ndarray
+        Page of each box
+
+    Returns
+    -------
+    boxes : np.ndarray
+        Corrected copy of the boxes
+    """
+    boxes = np.array(boxes)
+    if len(boxes) < 2:
+        return boxes
+
+    current, previous = boxes[1:], boxes[:-1]
+    # overlapping conditions
+    condition_1 = current[:, YMIN] < previous[:, YMAX]
+    condition_2 = (current[:, XMIN] < previous[:, XMAX]) & (
+        current[:, XMAX] > previous[:, XMAX]
+    )
+    condition_3 = (current[:, XMAX] > previous[:, XMIN]) & (
+        current[:, XMAX] < previous[:, XMAX]
+    )
+    same_page = pages[1:] == pages[:-1]
+    overlapping = same_page & condition_1 & (condition_2 | condition_3)
+
+    boxes[1:, YMIN] = np.where(
+        overlapping, previous[:, YMAX], current[:, YMIN]
+    )
+    return boxes
@@ -0,0 +1,89 @@
+"""Weights of the translation model memory mapped from a flat file.
+
+The weights are written once to a raw file (with a JSON index of the name,
+dtype, shape and offset of every tensor) and the parameters of the model
+are views of a copy-on-write memory map of the file. The weights are only
+read, so their pages stay in the page cache and are shared by every process
+which maps the same file, e.g. all the workers of the server, instead of
+each worker holding its own copy.
+"""
+import json
+import os
+
+import numpy as np
+import torch
+
+# offsets of the tensors are aligned to this number of bytes
+ALIGNMENT = 64
+
+
+def save_weights(model, path):
+    """Function to write the weights of a model to a flat file.
+
+    Parameters
+    ----------
+    model : transformers model
+        Model whose ``state_dict'' is written
+    path : str
+        Path of the raw file, the index is written to ``path.json''
+    """
+    index = {}
+    # tied weights are written once
+    offsets = {}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        for name, tensor in model.state_dict().items():
+            key = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape))
+            if key not in offsets:
+                padding = -f.tell() % ALIGNMENT
+                f.write(b"\0" * padding)
+                offsets[key] = f.tell()
+                data = tensor.detach().contiguous().reshape(-1)
+                f.write(data.view(torch.uint8).numpy().tobytes())
+            index[name] = {
+                "dtype": str(tensor.dtype).replace("torch.", ""),
+                "shape": list(tensor.shape),
+                "offset": offsets[key],
+            }
+    with open(f"{tmp_path}.json", "w") as f:
+        json.dump(index, f)
+    # the index is renamed last, it marks the file as complete
+    os.replace(tmp_path, path)
+    os.replace(f"{tmp_path}.json", f"{path}.json")
+
+
+def map_weights(model, path):
+    """Function to replace the weights of a model by views of the memory
+    mapped file written by ``save_weights''.
+
+    Parameters
+    ----------
+    model : transformers model
+        Model with the same architecture, its weights are not used
+    path : str
+        Path of the raw file
+
+    Returns
+    -------
+    model : transformers model
+        The same model with the mapped weights
+    """
+    with open(f"{path}.json") as f:
+        index = json.load(f)
+    # copy on write, but the weights are never written
+    buffer = np.memmap(path, dtype=np.uint8, mode="c")
+
+    tensors = model.state_dict(keep_vars=True)
+    missing = set(tensors) - set(index)
+    if missing:
+        raise ValueError(f"Weights missing in {path}: {sorted(missing)}")
+    for name, tensor in tensors.items():
+        entry = index[name]
+        dtype = getattr(torch, entry["dtype"])
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        nbytes = int(np.prod(entry["shape"])) * itemsize
+        data = torch.from_numpy(
+            buffer[entry["offset"] : entry["offset"] + nbytes]
+        )
+        tensor.data = data.view(dtype).reshape(entry["shape"])
+    return model
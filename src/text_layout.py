@@ -0,0 +1,171 @@
+import os
+from functools import lru_cache
+from PIL import ImageFont
+
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+FONTS_PATH = os.path.join(projpath, "fonts")
+DEFAULT_FONT = "arial.ttf"
+
+# font sizes tried when fitting a text in a box
+MAX_FONT_SIZE = 72
+MIN_FONT_SIZE = 4
+# pixels between lines, the default of ``ImageDraw.multiline_text''
+LINE_SPACING = 4
+
+
+@lru_cache(maxsize=256)
+def load_font(font=DEFAULT_FONT, size=MAX_FONT_SIZE):
+    """Font of the ``fonts'' folder of the project with a given size, the
+    fonts are loaded once per size"""
+    return ImageFont.truetype(os.path.join(FONTS_PATH, font), size=size)
+
+
+@lru_cache(maxsize=65536)
+def word_width(word, font=DEFAULT_FONT, size=MAX_FONT_SIZE):
+    """Width in pixels of a word (or any string without line breaks)"""
+    return load_font(font, size).getlength(word)
+
+
+@lru_cache(maxsize=256)
+def line_metrics(font=DEFAULT_FONT, size=MAX_FONT_SIZE):
+    """Height of a line of text and distance between consecutive lines,
+    computed as ``ImageDraw.multiline_text'' does"""
+    loaded_font = load_font(font, size)
+    ascent, descent = loaded_font.getmetrics()
+    line_distance = loaded_font.getbbox("A")[3] + LINE_SPACING
+    return ascent + descent, line_distance
+
+
+def wrap_text(text, max_width, font=DEFAULT_FONT, size=MAX_FONT_SIZE):
+    """Function to split a text in lines no wider than ``max_width''. Every
+    word is measured once, so it is linear in the number of words. Words
+    wider than ``max_width'' are left alone in their own line.
+
+    Parameters
+    ----------
+    text : str
+        Text to split
+    max_width : float
+        Max width in pixels of the lines
+    font : str
+        Name of the font file in the ``fonts'' folder
+    size : int
+        Font size
+
+    Returns
+    -------
+    lines : list
+        Lines of the text
+    fits : bool
+        Whether all the lines are narrower than ``max_width''
+    """
+    space = word_width(" ", font, size)
+    lines = []
+    fits = True
+    line = []
+    line_width = 0
+    for word in text.split():
+        width = word_width(word, font, size)
+        if line and line_width + space + width <= max_width:
+            line.append(word)
+            line_width += space + width
+            continue
+        if line:
+            lines.append(" ".join(line))
+        line = [word]
+        line_width = width
+        fits = fits and width <= max_width
+    if line:
+        lines.append(" ".join(line))
+    return lines, fits
+
+
+def text_height(n_lines, font=DEFAULT_FONT, size=MAX_FONT_SIZE):
+    """Height in pixels of a text of ``n_lines'' lines"""
+    if n_lines == 0:
+        return 0
+    line_height, line_distance = line_metrics(font, size)
+    return (n_lines - 1) * line_distance + line_height
+
+
+def fit_text(
+    text,
+    max_width,
+    max_height,
+    font=DEFAULT_FONT,
+    max_size=MAX_FONT_SIZE,
+    min_size=MIN_FONT_SIZE,
+):
+    """Function to find the largest font size whose wrapped text fits in a
+    box. The size is binary searched, as the wrapped text grows with it.
+
+    Parameters
+    ----------
+    text : str
+        Text to write
+    max_width : float
+        Width in pixels of the box
+    max_height : float
+        Height in pixels of the box
+    font : str
+        Name of the font file in the ``fonts'' folder
+    max_size : int
+        Largest font size tried
+    min_size : int
+        Smallest font size, used when the text does not fit with any size
+
+    Returns
+    -------
+    font : ImageFont.FreeTypeFont
+        Font with the selected size
+    lines : list
+        Lines of the wrapped text
+    """
+    low, high = min_size, max_size
+    best_size, best_lines = min_size, None
+    while low <= high:
+        size = (low + high) // 2
+        lines, fits = wrap_text(text, max_width, font, size)
+        if fits and text_height(len(lines), font, size) <= max_height:
+            best_size, best_lines = size, lines
+            low = size + 1
+        else:
+            high = size - 1
+
+    if best_lines is None:
+        best_lines, _ = wrap_text(text, max_width, font, best_size)
+    return load_font(font, best_size), best_lines
+
+
+def draw_text(draw, text, coords, font=DEFAULT_FONT, fill="black"):
+    """Function to write a text with the largest font size that fits in a
+    box.
+
+    Parameters
+    ----------
+    draw : ImageDraw.ImageDraw
+        Drawing context of the image
+    text : str
+        Text to write
+    coords : dict
+        Box with the ``left'', ``top'', ``right'' and ``bottom'' keys
+    font : str
+        Name of the font file in the ``fonts'' folder
+    fill : str | tuple
+        Colour of the text
+    """
+    loaded_font, lines = fit_text(
+        text,
+        coords["right"] - coords["left"],
+        coords["bottom"] - coords["top"],
+        font,
+    )
+    draw.multiline_text(
+        (coords["left"], coords["top"]),
+        "\n".join(lines),
+        font=loaded_font,
+        fill=fill,
+        spacing=LINE_SPACING,
+    )
@@ -0,0 +1,132 @@
+import functools
+import os
+import threading
+import time
+from transformers import AutoTokenizer
+
+
+# tokenizers loaded in the process, by model name
+tokenizers = {}
+# seconds spent loading each tokenizer
+load_times = {}
+registry_lock = threading.Lock()
+
+
+class SharedTokenizer:
+    """Tokenizer shared by all the threads of the process. The fast
+    tokenizers switch their truncation and padding on every call, so a
+    tokenizer used by two threads at the same time fails with "Already
+    borrowed": the calls and attribute reads are serialized with a lock
+    instead of giving each thread its own copy, so the process (and the
+    workers forked from it) keep a single tokenizer."""
+
+    def __init__(self, tokenizer):
+        self.shared_tokenizer = tokenizer
+        self.shared_lock = threading.RLock()
+
+    def locked_call(self, name, *args, **kwargs):
+        with self.shared_lock:
+            return getattr(self.shared_tokenizer, name)(*args, **kwargs)
+
+    def __call__(self, *args, **kwargs):
+        return self.locked_call("__call__", *args, **kwargs)
+
+    def __len__(self):
+        with self.shared_lock:
+            return len(self.shared_tokenizer)
+
+    def __getattr__(self, name):
+        with self.shared_lock:
+            value = getattr(self.shared_tokenizer, name)
+        if callable(value) and not isinstance(value, type):
+            return functools.partial(self.locked_call, name)
+        return value
+
+
+def get_tokenizer(model_name, models_path=None):
+    """Function to get the tokenizer of a model. It is loaded the first time
+    and shared by all the threads of the process afterwards, see
+    ``SharedTokenizer''. It must not be modified: the source language is
+    given on every call instead of setting ``tokenizer.src_lang'', see
+    ``build_inputs''.
+
+    Parameters
+    ----------
+    model_name : str
+        Name of the model, e.g. ``nllb-200-distilled-600M''
+    models_path : str | None
+        Folder with the local models, the tokenizer is loaded from there if
+        it has been saved with the model. Otherwise it is loaded from the
+        facebook hub repository.
+
+    Returns
+    -------
+    tokenizer : SharedTokenizer
+        Tokenizer of the model, with the interface of NllbTokenizerFast
+    """
+    tokenizer = tokenizers.get(model_name)
+    if tokenizer is not None:
+        return tokenizer
+
+    with registry_lock:
+        # another thread may have loaded it while waiting
+        if model_name not in tokenizers:
+            start = time.time()
+            tokenizers[model_name] = SharedTokenizer(
+                AutoTokenizer.from_pretrained(
+                    tokenizer_path(model_name, models_path)
+                )
+            )
+            load_times[model_name] = time.time() - start
+            print(
+                f"Tokenizer {model_name} loaded in "
+                f"{load_times[model_name]:.2f} s"
+            )
+        return tokenizers[model_name]
+
+
+def tokenizer_path(model_name, models_path=None):
+    """Local folder of the tokenizer if available, hub repository if not"""
+    if models_path is not None:
+        local_path = os.path.join(models_path, model_name)
+        if os.path.exists(os.path.join(local_path, "tokenizer_config.json")):
+            return local_path
+    return os.path.join("facebook/", model_name)
+
+
+def build_inputs(tokenizer, token_ids, src_lang=None):
+    """Function to add the special tokens of the source language to a list
+    of token ids without modifying the shared tokenizer.
+
+    Parameters
+    ----------
+    tokenizer : NllbTokenizerFast
+        tool that converts text to tokens
+    token_ids : list
+        Token ids of the text, without special tokens
+    src_lang : str | None
+        Langugage code in BCP-47 of the text. If None or empty (e.g. the
+        language of the text box has not been chosen), the source language of
+        the tokenizer is used.
+
+    Returns
+    -------
+    input_ids : list
+        Token ids ready to be passed to the model
+
+    Raises
+    ------
+    ValueError
+        If the language is not a language code of the tokenizer
+    """
+    if not src_lang:
+        return tokenizer.build_inputs_with_special_tokens(token_ids)
+
+    lang_id = tokenizer.convert_tokens_to_ids(src_lang)
+    if lang_id is None or lang_id == tokenizer.unk_token_id:
+        raise ValueError(f"Unknown source language: {src_lang!r}")
+    if getattr(tokenizer, "legacy_behaviour", False):
+        # [tokens, </s>, lang_code]
+        return token_ids + [tokenizer.eos_token_id, lang_id]
+    # [lang_code, tokens, </s>]
+    return [lang_id] + token_ids + [tokenizer.eos_token_id]
@@ -1,7 +1,10 @@
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from transformers import AutoModelForSeq2SeqLM
 import os
+from docx.text.run import Run
 from tqdm import tqdm
-from utils import convert_text, basic_preprocessing
+from utils import basic_preprocessing
+from batch_translation import translate_batch
+from tokenizer_registry import get_tokenizer
 
 
 def translate_document(
@@ -12,6 +15,9 @@ def translate_document(
     lang_origin_code,
     lang_dest_code,
     loaded_model,
+    batch_size=16,
+    max_batch_tokens=4096,
+    decoding_profile=None,
 ):
     # Here we start the translating over all the paragraphs of the document
     # by sections, see: https://stackoverflow.com/questions/34779724
@@ -24,6 +30,9 @@ def translate_document(
         lang_origin_code,
         lang_dest_code,
         loaded_model,
+        batch_size,
+        max_batch_tokens,
+        decoding_profile,
     )
 
     translator.translate_document(document)
@@ -31,6 +40,78 @@ def translate_document(
     return document
 
 
+def paragraph_runs(paragraph):
+    """Runs of a paragraph in document order, including the runs of its
+    hyperlinks, which ``paragraph.runs'' leaves out"""
+    return [
+        Run(r, paragraph)
+        for r in paragraph._p.xpath("./w:r | ./w:hyperlink/w:r")
+    ]
+
+
+def redistribute_translation(run_texts, translated_text):
+    """Function to split the translation of a paragraph over its runs, so
+    each fragment keeps the formatting of the original run. The words of the
+    translation are given to the runs in order, proportionally to the
+    characters of each run in the original paragraph: a word goes to the run
+    whose share of the paragraph contains the middle of the word.
+
+    Parameters
+    ----------
+    run_texts : list
+        Original texts of the runs of the paragraph
+    translated_text : str
+        Translation of the whole paragraph
+
+    Returns
+    -------
+    new_texts : list
+        New text of each run, None for the runs without visible characters
+        (spaces, tabs, breaks, images...), which must be left untouched
+    """
+    weights = [len("".join(text.split())) for text in run_texts]
+    total = sum(weights)
+    words = translated_text.split()
+    translated_total = sum(len(word) for word in words)
+
+    # end of the share of each run, in characters of the translation
+    bounds = []
+    cumulative = 0
+    for weight in weights:
+        cumulative += weight
+        bounds.append(cumulative / total * translated_total)
+
+    # the words past the end go to the last run with visible characters
+    last = max(idx for idx, weight in enumerate(weights) if weight)
+    run_words = [[] for _ in run_texts]
+    position = 0
+    idx = 0
+    for word in words:
+        middle = position + len(word) / 2
+        while idx < last and (weights[idx] == 0 or middle > bounds[idx]):
+            idx += 1
+        run_words[idx].append(word)
+        position += len(word)
+
+    new_texts = [
+        " ".join(assigned) if weight else None
+        for assigned, weight in zip(run_words, weights)
+    ]
+    # the words of consecutive runs are separated by a space, unless the
+    # original runs between them already contain one
+    previous = None
+    for idx, new_text in enumerate(new_texts):
+        if not new_text:
+            continue
+        if previous is not None and not any(
+            run_texts[between].isspace()
+            for between in range(previous + 1, idx)
+        ):
+            new_texts[previous] += " "
+        previous = idx
+    return new_texts
+
+
 class docx_translator:
     """
     With the help from: https://stackoverflow.com/questions/34779724
@@ -44,10 +125,12 @@ class docx_translator:
         lang_origin_code,
         lang_dest_code,
         loaded_model,
+        batch_size=16,
+        max_batch_tokens=4096,
+        decoding_profile=None,
     ):
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            os.path.join("facebook/", model_name), src_lang=lang_origin_code
-        )
+        # shared tokenizer, the source language is given on every call
+        self.tokenizer = get_tokenizer(model_name, models_path)
         if loaded_model:
             self.model = loaded_model
         else:
@@ -55,10 +138,20 @@ class docx_translator:
             self.model = AutoModelForSeq2SeqLM.from_pretrained(
                 os.path.join(models_path, f"{model_name}")
             )
+        self.model_name = model_name
         self.max_tokens = max_tokens
+        self.lang_origin_code = lang_origin_code
         self.lang_dest_code = lang_dest_code
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.decoding_profile = decoding_profile
 
     def translate_document(self, document):
+        # runs of the paragraphs to translate and their preprocessed texts,
+        # they are collected over the whole document and translated in
+        # batches at the end
+        self.paragraph_runs = []
+        self.texts = []
         # paragraphs
         self.body_content(document)
         # tables
@@ -68,6 +161,31 @@ class docx_translator:
         # footers
         self.footers(document)
 
+        print("\t☺Translating paragraphs...")
+        translated_texts = translate_batch(
+            self.texts,
+            self.tokenizer,
+            self.model,
+            self.max_tokens,
+            self.lang_dest_code,
+            self.batch_size,
+            self.max_batch_tokens,
+            self.model_name,
+            self.lang_origin_code,
+            self.decoding_profile,
+        )
+        # replace the text on the runs, the translation of each paragraph is
+        # split over its runs so their formatting is kept
+        for runs, translated_text in zip(
+            self.paragraph_runs, translated_texts
+        ):
+            new_texts = redistribute_translation(
+                [run.text for run in runs], translated_text
+            )
+            for run, new_text in zip(runs, new_texts):
+                if new_text is not None:
+                    run.text = new_text
+
     def body_content(self, document):
         print("\t☺Processing paragraphs...")
         for paragraph in tqdm(document.paragraphs):
@@ -106,44 +224,20 @@ class docx_translator:
                             self.Execute(paragraph)
 
     def Execute(self, paragraph):
-        # here we do the translation and preprocessing at the run level,
-        # a lower level than the paragraph itself. That's because each
-        # paragraph is composed by multiple runs
-        for run in paragraph.runs:
-            original_text = run.text
-            # preprocessing
-            original_text = basic_preprocessing(original_text)
-            # initialization
-            translated_text = original_text
-            # dont translate the following cases
-            # empty
-            case1 = original_text == ""
-            # only digits, symbols, and definitely, less than 4 letters
-            case2 = sum([letter.isalpha() for letter in original_text]) <= 3
-            cases = case1 or case2
-            if not cases:
-                # obtains untranslated text list in which each element does not
-                # exceed a certain token length
-                text_chunks = convert_text(
-                    original_text, self.tokenizer, self.max_tokens
-                )
-
-                translated_text = []
-
-                for text_chunk in text_chunks:
-                    inputs = self.tokenizer(text_chunk, return_tensors="pt")
-                    translated_tokens = self.model.generate(
-                        **inputs,
-                        forced_bos_token_id=self.tokenizer.lang_code_to_id[
-                            self.lang_dest_code
-                        ],
-                    )
-                    translated_text_block = self.tokenizer.batch_decode(
-                        translated_tokens, skip_special_tokens=True
-                    )[0]
-                    translated_text.append(translated_text_block)
-
-                # join and substitute in docx properties
-                translated_text = " ".join(translated_text)
-                # replace the text on the run
-                run.text = translated_text
+        # here we collect the paragraph to translate. Each paragraph is
+        # composed by multiple runs (bold, italic, hyperlink fragments...),
+        # it is translated as a whole so the model sees the whole sentences
+        # and the translation is split over the runs afterwards
+        runs = paragraph_runs(paragraph)
+        original_text = "".join(run.text for run in runs)
+        # preprocessing
+        original_text = basic_preprocessing(original_text)
+        # dont translate the following cases
+        # empty
+        case1 = original_text == ""
+        # only digits, symbols, and definitely, less than 4 letters
+        case2 = sum([letter.isalpha() for letter in original_text]) <= 3
+        cases = case1 or case2
+        if not cases:
+            self.paragraph_runs.append(runs)
+            self.texts.append(original_text)
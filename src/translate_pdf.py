@@ -1,7 +1,8 @@
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from transformers import AutoModelForSeq2SeqLM
 import os
-from tqdm import tqdm
-from utils import convert_text, basic_preprocessing
+from utils import basic_preprocessing
+from batch_translation import translate_batch
+from tokenizer_registry import get_tokenizer
 
 
 def translate_document(
@@ -12,11 +13,13 @@ def translate_document(
     lang_origin_code,
     lang_dest_code,
     loaded_model,
+    batch_size=16,
+    max_batch_tokens=4096,
+    decoding_profile=None,
 ):
-    # obtains tokenizer associated to detected text language
-    tokenizer = AutoTokenizer.from_pretrained(
-        os.path.join("facebook/", model_name), src_lang=lang_origin_code
-    )
+    # obtains the shared tokenizer, the detected text language is given on
+    # every call
+    tokenizer = get_tokenizer(model_name, models_path)
 
     if loaded_model:
         model = loaded_model
@@ -28,41 +31,61 @@ def translate_document(
 
     # Here we start the translating over the paragraphs of the document
     print("Translating paragraphs...")
-    tqdm.pandas()
-    document["translated_paragraph"] = document.paragraph.progress_apply(
-        lambda x: translate(x, tokenizer, max_tokens, model, lang_dest_code)
+    segments = document.segments
+    segments.translations = translate(
+        segments.paragraphs,
+        tokenizer,
+        max_tokens,
+        model,
+        lang_dest_code,
+        batch_size,
+        max_batch_tokens,
+        model_name,
+        lang_origin_code,
+        decoding_profile,
     )
 
     return document
 
 
-def translate(text, tokenizer, max_tokens, model, lang_dest_code):
-    """Auxiliary translation function encapsulated in a lambda"""
+def translate(
+    texts,
+    tokenizer,
+    max_tokens,
+    model,
+    lang_dest_code,
+    batch_size=16,
+    max_batch_tokens=4096,
+    model_name=None,
+    lang_origin_code=None,
+    decoding_profile=None,
+):
+    """Auxiliary translation function over all the OCR paragraphs"""
 
     # initialization
-    translated_text = text
+    translated_texts = list(texts)
     # do not translate empty or digits
-    if not (text == "" or text.isdigit()):
-        # first some basic preprocessing
-        text = basic_preprocessing(text)
-        # obtains untranslated text list in which each element does not
-        # exceed a certain token length
-        text_chunks = convert_text(text, tokenizer, max_tokens)
-
-        translated_text = []
-
-        for text_chunk in text_chunks:
-            inputs = tokenizer(text_chunk, return_tensors="pt")
-            translated_tokens = model.generate(
-                **inputs,
-                forced_bos_token_id=tokenizer.lang_code_to_id[lang_dest_code],
-            )
-            translated_text_block = tokenizer.batch_decode(
-                translated_tokens, skip_special_tokens=True
-            )[0]
-            translated_text.append(translated_text_block)
+    to_translate = [
+        idx
+        for idx, text in enumerate(texts)
+        if not (text == "" or text.isdigit())
+    ]
+    # first some basic preprocessing
+    cleaned_texts = [basic_preprocessing(texts[idx]) for idx in to_translate]
+    translations = translate_batch(
+        cleaned_texts,
+        tokenizer,
+        model,
+        max_tokens,
+        lang_dest_code,
+        batch_size,
+        max_batch_tokens,
+        model_name,
+        lang_origin_code,
+        decoding_profile,
+    )
+    # place de translated values
+    for idx, translated_text in zip(to_translate, translations):
+        translated_texts[idx] = translated_text
 
-        # join and substitute in docx properties
-        translated_text = " ".join(translated_text)
-    # place de translated value
-    return translated_text
+    return translated_texts
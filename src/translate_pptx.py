@@ -1,7 +1,9 @@
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from transformers import AutoModelForSeq2SeqLM
 import os
 from tqdm import tqdm
-from utils import convert_text, basic_preprocessing
+from utils import basic_preprocessing
+from batch_translation import translate_batch
+from tokenizer_registry import get_tokenizer
 
 
 def translate_document(
@@ -12,6 +14,9 @@ def translate_document(
     lang_origin_code,
     lang_dest_code,
     loaded_model,
+    batch_size=16,
+    max_batch_tokens=4096,
+    decoding_profile=None,
 ):
     # initialize the class
     translator = pptx_translator(
@@ -21,6 +26,9 @@ def translate_document(
         lang_origin_code,
         lang_dest_code,
         loaded_model,
+        batch_size,
+        max_batch_tokens,
+        decoding_profile,
     )
 
     translator.translate_document(document)
@@ -41,10 +49,12 @@ class pptx_translator:
         lang_origin_code,
         lang_dest_code,
         loaded_model,
+        batch_size=16,
+        max_batch_tokens=4096,
+        decoding_profile=None,
     ):
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            os.path.join("facebook/", model_name), src_lang=lang_origin_code
-        )
+        # shared tokenizer, the source language is given on every call
+        self.tokenizer = get_tokenizer(model_name, models_path)
         if loaded_model:
             self.model = loaded_model
         else:
@@ -52,14 +62,36 @@ class pptx_translator:
             self.model = AutoModelForSeq2SeqLM.from_pretrained(
                 os.path.join(models_path, f"{model_name}")
             )
+        self.model_name = model_name
         self.max_tokens = max_tokens
+        self.lang_origin_code = lang_origin_code
         self.lang_dest_code = lang_dest_code
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.decoding_profile = decoding_profile
 
     def translate_document(self, document):
-        print("Translating slides...")
+        # paragraphs of every text frame, they are collected over the whole
+        # presentation and translated in batches at the end
+        self.paragraphs = []
+        print("Browsing slides...")
         for slide in tqdm(document.slides):
             self.browse_slide(slide)
 
+        print("Translating slides...")
+        new_texts = self.make_text_modification(
+            [para.text for para in self.paragraphs]
+        )
+
+        # Store it in presentation without modifying font parameters
+        for para, new_text in zip(self.paragraphs, new_texts):
+            if len(para.runs) > 0:
+                self.replace_paragraph_text_retaining_initial_formatting(
+                    para, new_text
+                )
+            else:
+                para.text = new_text
+
     def browse_shape(self, shape):
         """PowerPoint Shapes might be of different kind.
             Each kind of shape has its own way to deal with text.
@@ -88,29 +120,19 @@ class pptx_translator:
 
     def change_text_frame_text(self, text_frame):
         """
-        Operate text modifications to a shape which contains/is a text_frame.
+        Collect the paragraphs of a shape which contains/is a text_frame,
+        they are modified once the whole presentation has been browsed.
 
         PARAMETERS:
         shape : pptx.shapes.shapetree.SlideShapes
             Original value.
         RETURNS:
         text_frame: pptx.shapes.shapetree.SlideShapes
-            Modified values.
+            Original value.
         """
         # For each paragraph of the shape's text_frame
-        for idx in range(len(text_frame.paragraphs)):
-            # Prepare new text
-            old_text = text_frame.paragraphs[idx].text
-            new_text = self.make_text_modification(old_text)
-
-            # Store it in presentation without modifying font parameters
-            para = text_frame.paragraphs[idx]
-            if len(para.runs) > 0:
-                self.replace_paragraph_text_retaining_initial_formatting(
-                    para, new_text
-                )
-            else:
-                text_frame.paragraphs[idx].text = new_text
+        for para in text_frame.paragraphs:
+            self.paragraphs.append(para)
 
         return text_frame
 
@@ -174,33 +196,32 @@ class pptx_translator:
             p.remove(run._r)
         paragraph.runs[0].text = new_text
 
-    def make_text_modification(self, text):
+    def make_text_modification(self, texts):
         # initialization
-        translated_text = text
+        translated_texts = list(texts)
         # do not translate empty or digits
-        if not (text == "" or text.isdigit()):
-            # preprocessing
-            cleaned_text = basic_preprocessing(text)
-            # obtains untranslated text list in which each element does not
-            # exceed a certain token length
-            text_chunks = convert_text(
-                cleaned_text, self.tokenizer, self.max_tokens
-            )
-            translated_chunks = []
-            for text_chunk in text_chunks:
-                inputs = self.tokenizer(text_chunk, return_tensors="pt")
-                translated_tokens = self.model.generate(
-                    **inputs,
-                    forced_bos_token_id=self.tokenizer.lang_code_to_id[
-                        self.lang_dest_code
-                    ],
-                )
-                translated_text_block = self.tokenizer.batch_decode(
-                    translated_tokens, skip_special_tokens=True
-                )[0]
-                translated_chunks.append(translated_text_block)
-
-            # join
-            translated_text = " ".join(translated_chunks)
+        to_translate = [
+            idx
+            for idx, text in enumerate(texts)
+            if not (text == "" or text.isdigit())
+        ]
+        # preprocessing
+        cleaned_texts = [
+            basic_preprocessing(texts[idx]) for idx in to_translate
+        ]
+        translations = translate_batch(
+            cleaned_texts,
+            self.tokenizer,
+            self.model,
+            self.max_tokens,
+            self.lang_dest_code,
+            self.batch_size,
+            self.max_batch_tokens,
+            self.model_name,
+            self.lang_origin_code,
+            self.decoding_profile,
+        )
+        for idx, translated_text in zip(to_translate, translations):
+            translated_texts[idx] = translated_text
 
-        return translated_text
+        return translated_texts
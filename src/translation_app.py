@@ -1,6 +1,10 @@
+import contextlib
 import os
+import shutil
 import time
 from save_document import save_translated_doc
+from metrics import DOCUMENTS, document_metrics, observe_timings
+from profiling import profile_document, profiling_enabled
 
 
 def translate_text(
@@ -12,6 +16,11 @@ def translate_text(
     lang_dest_code,
     document_type,
     loaded_model,
+    batch_size=16,
+    max_batch_tokens=4096,
+    decoding_profile=None,
+    timings=None,
+    progress_callback=None,
 ):
     """Function to generate a list of strings with a limited number of tokens.
     Each string will be processed with the NLLB model so it should not exceed
@@ -35,6 +44,18 @@ def translate_text(
         Langugage code in BCP-47 of the desired output
     loaded_model :
         Model loaded when running the django server
+    batch_size : int
+        Max number of text chunks translated in each ``generate'' call
+    max_batch_tokens : int
+        Max number of tokens (padding included) in each ``generate'' call
+    decoding_profile : str | None
+        Name of the decoding profile, see ``decoding''. By default, the one
+        of the documents.
+    timings : dict | None
+        If given, the seconds spent on each stage are stored in it
+    progress_callback : callable | None
+        Called with the fraction of the translation completed after each
+        stage
 
 
     Returns
@@ -54,12 +75,46 @@ def translate_text(
     else:
         raise ValueError("Unsupported file type")
 
+    if timings is None:
+        timings = {}
+
+    if document_type in ["pdf", "PDF"] and pdf_pipeline_enabled():
+        # the pages flow through the stages independently
+        from pdf_pipeline import translate_document as translate_pdf
+
+        start = time.time()
+        _, translated_document = translate_pdf(
+            doc_filepath=doc_filepath,
+            language=lang_orig_code,
+            model_name=model_name,
+            models_path=models_path,
+            max_tokens=max_tokens,
+            lang_dest_code=lang_dest_code,
+            loaded_model=loaded_model,
+            batch_size=batch_size,
+            max_batch_tokens=max_batch_tokens,
+            decoding_profile=decoding_profile,
+            timings=timings,
+            progress_callback=progress_callback,
+        )
+        timings["pipeline"] = time.time() - start
+        return translated_document
+
     # read and handle the different document inputs
+    start = time.time()
+    # the pdfs also report the time spent inferring their language
+    pdf_options = {}
+    if document_type in ["pdf", "PDF"]:
+        pdf_options["timings"] = timings
     language, document = preprocess_text(
-        doc_filepath=doc_filepath, language=lang_orig_code
+        doc_filepath=doc_filepath, language=lang_orig_code, **pdf_options
     )
+    timings["preprocess"] = time.time() - start
+    if progress_callback is not None:
+        progress_callback(0.2)
 
     # now we will translate the paragraphs for the document based on its type
+    start = time.time()
     translated_document = translate_document(
         document=document,
         model_name=model_name,
@@ -68,16 +123,77 @@ def translate_text(
         lang_origin_code=language,
         lang_dest_code=lang_dest_code,
         loaded_model=loaded_model,
+        batch_size=batch_size,
+        max_batch_tokens=max_batch_tokens,
+        decoding_profile=decoding_profile,
     )
+    timings["translate"] = time.time() - start
+    if progress_callback is not None:
+        progress_callback(0.9)
 
     return translated_document
 
 
-def translate_document(filename, dst_lang, loaded_model=None):
+def pdf_pipeline_enabled():
+    """Whether the pdfs are translated with the page pipeline"""
+    from pdf_pipeline import pipeline_options
+
+    return pipeline_options["enabled"]
+
+
+def translate_document(
+    filename,
+    dst_lang,
+    loaded_model=None,
+    batch_size=16,
+    max_batch_tokens=4096,
+    decoding_profile=None,
+    model_name="nllb-200-distilled-600M",
+    input_path=None,
+    progress_callback=None,
+    profile=None,
+    output_filename=None,
+):
+    """Function to translate a document and save the translation in the
+    media folder.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the document, it must be stored in ``input_path''
+    dst_lang : str
+        Langugage code in BCP-47 of the desired output
+    loaded_model :
+        Model loaded when running the django server
+    batch_size : int
+        Max number of text chunks translated in each ``generate'' call
+    max_batch_tokens : int
+        Max number of tokens (padding included) in each ``generate'' call
+    decoding_profile : str | None
+        Name of the decoding profile, see ``decoding''
+    model_name : str
+        Name of the model, used to get its tokenizer
+    input_path : str | None
+        Folder where the document is stored, it is removed at the end. By
+        default, the ``input/tmp'' folder of the project.
+    progress_callback : callable | None
+        Called with the fraction of the translation completed after each
+        stage
+    profile : bool | None
+        Whether the translation and the save are profiled, the artifacts
+        are written next to the translated document (see ``profiling''). By
+        default, the ``enabled'' profiling option.
+    output_filename : str | None
+        Name of the translated document in the media folder. By default,
+        the name of the document with the ``translated_'' prefix.
+
+    Returns
+    -------
+    timings : dict
+        Seconds spent on each stage of the translation
+    """
     # select document to translate
     doc_name = filename
-    # select model
-    model_name = "nllb-200-distilled-600M"
     # select language code in bcp-47 (if None it will be inferred)
     scr_lang = None
     # set a maximum number of tokens to translate in each text block. The
@@ -90,42 +206,65 @@ def translate_document(filename, dst_lang, loaded_model=None):
     projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
     models_path = os.path.join(projpath, "models")
     # input file is saved into tmp folder
-    input_path = os.path.join(projpath, "input", "tmp")
+    shared_tmp_folder = input_path is None
+    if shared_tmp_folder:
+        input_path = os.path.join(projpath, "input", "tmp")
     doc_filepath = os.path.join(input_path, doc_name)
     output_path = os.path.join(projpath, "media", "translated_documents")
-    output_filename = f"translated_{doc_name}"
+    if output_filename is None:
+        output_filename = f"translated_{doc_name}"
     output_file = os.path.join(output_path, output_filename)
 
     # get document type (docx, pdf, pptx...)
     doc_type = doc_name.split(".")[-1]
 
-    # execute text translation
+    # execute text translation, the metrics are labelled with the type
+    metrics_type = doc_type.lower()
     start = time.time()
-    translated_document = translate_text(
-        doc_filepath=doc_filepath,
-        max_tokens=max_tokens,
-        models_path=models_path,
-        model_name=model_name,
-        lang_orig_code=scr_lang,
-        lang_dest_code=dst_lang,
-        document_type=doc_type,
-        loaded_model=loaded_model,
-    )
+    timings = {}
+    if profiling_enabled(profile):
+        profiler = profile_document(output_file)
+    else:
+        profiler = contextlib.nullcontext()
+    try:
+        with profiler, document_metrics(metrics_type):
+            translated_document = translate_text(
+                doc_filepath=doc_filepath,
+                max_tokens=max_tokens,
+                models_path=models_path,
+                model_name=model_name,
+                lang_orig_code=scr_lang,
+                lang_dest_code=dst_lang,
+                document_type=doc_type,
+                loaded_model=loaded_model,
+                batch_size=batch_size,
+                max_batch_tokens=max_batch_tokens,
+                decoding_profile=decoding_profile,
+                timings=timings,
+                progress_callback=progress_callback,
+            )
 
-    save_translated_doc(translated_document, output_file, doc_type)
+            save_start = time.time()
+            save_translated_doc(translated_document, output_file, doc_type)
+            timings["save"] = time.time() - save_start
+    except Exception:
+        DOCUMENTS.inc(document_type=metrics_type, status="failed")
+        raise
 
-    # empty the tmp folder
-    # create temporal folder if not exists:
-    if os.path.exists(input_path):
-        # empty the folder
-        for file in os.listdir(input_path):
-            os.remove(os.path.join(input_path, file))
-        # remove the folder
-        os.rmdir(input_path)
+    # remove the tmp folder
+    shutil.rmtree(input_path, ignore_errors=True)
 
-    # create the empty folder for storing the images
-    os.makedirs(input_path)
+    if shared_tmp_folder:
+        # create the empty folder for storing the images
+        os.makedirs(input_path)
 
     end = time.time()
+    timings["total"] = end - start
+    observe_timings(timings, metrics_type)
+    DOCUMENTS.inc(document_type=metrics_type, status="done")
+    if progress_callback is not None:
+        progress_callback(1.0)
 
     print(f"Total time:{end-start} s")
+
+    return timings
@@ -0,0 +1,276 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+# the persistent tier is stored next to the django database
+DEFAULT_DB_PATH = os.path.join(projpath, "translation_memory.sqlite3")
+
+
+def normalize_segment(text):
+    """Function to normalize a segment before using it as a key, so that
+    the same text with different unicode forms or whitespaces is found."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class TranslationMemory:
+    """Cache of translated segments keyed by (model name, source language,
+    target language, normalized segment text). It has two tiers: an
+    in-process LRU dictionary and a persistent SQLite table shared between
+    documents, requests and processes.
+
+    Parameters
+    ----------
+    db_path : str | None
+        Path to the SQLite database, if None only the in-process tier is used
+    max_memory_entries : int
+        Max number of segments kept in the in-process tier
+    max_db_entries : int
+        Max number of segments kept in the SQLite tier, the least recently
+        used ones are removed when exceeded
+    ttl : float | None
+        Seconds after which a stored translation expires
+    eviction_interval : int
+        The expired and exceeding segments of the SQLite tier are removed
+        every ``eviction_interval'' stores of each process, so the table can
+        temporarily exceed ``max_db_entries'' by the segments stored since
+    """
+
+    def __init__(
+        self,
+        db_path=DEFAULT_DB_PATH,
+        max_memory_entries=10000,
+        max_db_entries=1000000,
+        ttl=None,
+        eviction_interval=100,
+    ):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_db_entries = max_db_entries
+        self.ttl = ttl
+        self.eviction_interval = eviction_interval
+        self.stores_since_eviction = 0
+        self.lock = threading.Lock()
+        # key -> (translation, creation time)
+        self.memory = OrderedDict()
+        self.counters = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+        # the SQLite connection is opened by each process the first time it
+        # is used, see ``connection''
+        self.process_connection = None
+        self.connection_pid = None
+
+    @property
+    def connection(self):
+        """Connection to the persistent tier of the current process, None if
+        there is no persistent tier. A SQLite connection must not be used
+        across a fork, so the workers forked from the process which
+        configured the memory open their own one."""
+        if self.db_path is None:
+            return None
+        if self.connection_pid != os.getpid():
+            connection = sqlite3.connect(
+                self.db_path, check_same_thread=False, timeout=30
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS translation_memory ("
+                "key TEXT PRIMARY KEY, model_name TEXT, src_lang TEXT, "
+                "tgt_lang TEXT, segment TEXT, translation TEXT, "
+                "created REAL, last_used REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS translation_memory_last_used "
+                "ON translation_memory (last_used)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS translation_memory_created "
+                "ON translation_memory (created)"
+            )
+            connection.commit()
+            self.process_connection = connection
+            self.connection_pid = os.getpid()
+        return self.process_connection
+
+    @staticmethod
+    def make_key(model_name, src_lang, tgt_lang, text, variant=""):
+        segment = normalize_segment(text)
+        key = "\x1f".join(
+            [model_name, variant, src_lang or "", tgt_lang, segment]
+        )
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def lookup(self, model_name, src_lang, tgt_lang, texts, variant=""):
+        """Function to look up several segments at once. The ``variant'' of
+        the translations (decoding profile, engine and precision of the
+        model...) is part of the key, see ``store''.
+
+        Returns
+        -------
+        found : dict
+            Index of the segment in ``texts'' -> stored translation, only for
+            the segments found in the cache
+        """
+        now = time.time()
+        keys = [
+            self.make_key(model_name, src_lang, tgt_lang, text, variant)
+            for text in texts
+        ]
+        found = {}
+        pending = {}
+        with self.lock:
+            # in-process tier
+            for idx, key in enumerate(keys):
+                entry = self.memory.get(key)
+                if entry is not None and not self.expired(entry[1], now):
+                    self.memory.move_to_end(key)
+                    found[idx] = entry[0]
+                    self.counters["memory_hits"] += 1
+                else:
+                    self.memory.pop(key, None)
+                    pending.setdefault(key, []).append(idx)
+
+            # persistent tier
+            if pending and self.connection is not None:
+                rows = []
+                pending_keys = list(pending)
+                # sqlite limits the number of parameters of a query
+                for start in range(0, len(pending_keys), 500):
+                    batch = pending_keys[start : start + 500]
+                    rows.extend(
+                        self.connection.execute(
+                            "SELECT key, translation, created FROM "
+                            "translation_memory WHERE key IN "
+                            f"({','.join('?' * len(batch))})",
+                            batch,
+                        ).fetchall()
+                    )
+                hit_keys = []
+                for key, translation, created in rows:
+                    if self.expired(created, now):
+                        continue
+                    hit_keys.append((now, key))
+                    self.remember(key, translation, created)
+                    for idx in pending.pop(key):
+                        found[idx] = translation
+                        self.counters["db_hits"] += 1
+                if hit_keys:
+                    self.connection.executemany(
+                        "UPDATE translation_memory SET last_used = ? "
+                        "WHERE key = ?",
+                        hit_keys,
+                    )
+                    self.connection.commit()
+
+            self.counters["misses"] += sum(len(v) for v in pending.values())
+
+        return found
+
+    def store(
+        self, model_name, src_lang, tgt_lang, texts, translations, variant=""
+    ):
+        """Function to store several translated segments at once. They are
+        only found by the lookups of the same ``variant''."""
+        now = time.time()
+        rows = []
+        with self.lock:
+            for text, translation in zip(texts, translations):
+                key = self.make_key(
+                    model_name, src_lang, tgt_lang, text, variant
+                )
+                self.remember(key, translation, now)
+                rows.append(
+                    (
+                        key,
+                        model_name,
+                        src_lang,
+                        tgt_lang,
+                        normalize_segment(text),
+                        translation,
+                        now,
+                        now,
+                    )
+                )
+            if rows and self.connection is not None:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO translation_memory VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self.stores_since_eviction += 1
+                if self.stores_since_eviction >= self.eviction_interval:
+                    self.evict(now)
+                self.connection.commit()
+
+    def remember(self, key, translation, created):
+        """Adds an entry to the in-process LRU tier"""
+        self.memory[key] = (translation, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def evict(self, now):
+        """Removes the expired and the least recently used segments of the
+        persistent tier"""
+        self.stores_since_eviction = 0
+        if self.ttl is not None:
+            self.connection.execute(
+                "DELETE FROM translation_memory WHERE created < ?",
+                (now - self.ttl,),
+            )
+        n_entries = self.connection.execute(
+            "SELECT COUNT(*) FROM translation_memory"
+        ).fetchone()[0]
+        if n_entries > self.max_db_entries:
+            self.connection.execute(
+                "DELETE FROM translation_memory WHERE key IN (SELECT key "
+                "FROM translation_memory ORDER BY last_used LIMIT ?)",
+                (n_entries - self.max_db_entries,),
+            )
+
+    def stats(self):
+        """Hit/miss counters and number of entries of each tier"""
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+            if self.connection is not None:
+                stats["db_entries"] = self.connection.execute(
+                    "SELECT COUNT(*) FROM translation_memory"
+                ).fetchone()[0]
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM translation_memory")
+                self.connection.commit()
+
+
+# process-wide translation memory, see ``configure_translation_memory''
+translation_memory = None
+
+
+def configure_translation_memory(enabled=True, **kwargs):
+    """Function to (re)configure the process-wide translation memory, the
+    keyword arguments are passed to ``TranslationMemory''. When disabled,
+    ``get_translation_memory'' returns None."""
+    global translation_memory
+    translation_memory = TranslationMemory(**kwargs) if enabled else False
+    return translation_memory
+
+
+def get_translation_memory():
+    """Returns the process-wide translation memory, it is created with the
+    default parameters the first time if it was not configured."""
+    if translation_memory is None:
+        configure_translation_memory()
+    return translation_memory or None
@@ -1,9 +1,16 @@
-import fasttext
 import os
+import re
+import time
+import torch
 from unidecode import unidecode
-from pytesseract import image_to_string
-from PIL import Image
-from transformers import AutoModelForSeq2SeqLM
+from transformers import AutoConfig, AutoModelForSeq2SeqLM
+from transformers.modeling_utils import no_init_weights
+from language_identification import get_language_identifier
+from shared_weights import map_weights, save_weights
+
+
+# numeric precisions of the translation model, see ``load_model''
+PRECISIONS = ("fp32", "bf16", "int8")
 
 
 def handle_non_ascii(_string):
@@ -31,147 +38,289 @@ def basic_preprocessing(_string):
     return clean_string
 
 
-def convert_text(original_paragraph, tokenizer, max_tokens):
-    """Function to generate a list of strings with a limited number of tokens
-    given the max_tokens parameter. The sentence is splited by ". " as a
-    separator and the sentences are combined (or not) based on if they
-    exceed (or not) the number of tokens limit given the tokenizer.
+# sentence boundaries: terminal punctuation followed by whitespace (latin,
+# cyrillic, greek, arabic, devanagari...) or east asian full stops, which
+# are not followed by a space
+SENTENCE_BOUNDARIES = re.compile(
+    r"(?<=[.!?;\u2026\u061f\u06d4\u0964\u0965])\s+"
+    r"|(?<=[\u3002\uff01\uff1f\uff1b])\s*"
+)
+# clause boundaries, used to split sentences that exceed the token limit
+CLAUSE_BOUNDARIES = re.compile(
+    r"(?<=[,:\u060c\u3001\uff0c\uff1a])\s*"
+)
+
+
+def split_sentences(paragraph):
+    """Function to split a paragraph into sentences. Besides the latin
+    full stop, the question/exclamation marks and the full stops of the
+    arabic, devanagari and CJK scripts are considered as separators.
 
     Parameters
     ----------
-    original_paragraph : str
+    paragraph : str
         String considered as paragraph
-    tokenizer : NllbTokenizerFast
-        tool that converts text to tokens
-    max_tokens : max_tokens
-        Max number of tokens included in each original_text_list element
 
     Returns
     -------
-    text_groups : ndarray
-        1D array with the concatenated strings of the elements of each group.
+    sentences : list
+        Non-empty sentences of the paragraph
     """
+    sentences = SENTENCE_BOUNDARIES.split(paragraph.strip())
+    return [sentence.strip() for sentence in sentences if sentence.strip()]
 
-    # initializes empty list in which text strings will be introduced
-    limited_tokens_sentences = []
-
-    # strip the original paragraph
-    original_paragraph = original_paragraph.strip()
 
-    # makes a list of sentences (here we consider a ". ")
-    sentences_list = original_paragraph.split(". ")
+def split_long_sentence(sentence, sentence_ids, tokenizer, max_tokens):
+    """Function to split a sentence which exceeds the token limit by
+    itself. It is split by clauses first and, if some clause still exceeds
+    the limit, by windows of ``max_tokens'' tokens.
 
-    # initializes string in which text will be stored
-    cummulative_sentence = sentences_list[0].strip()
-    for text in sentences_list[1:]:
-        # create temporal sentence variable which adds or substracts text
-        t_cummulative_sentence = cummulative_sentence + ". " + text.strip()
-        n_tokens = tokenizer(t_cummulative_sentence, return_tensors="pt")[
+    Returns
+    -------
+    pieces : list
+        List of (text, input_ids) tuples
+    """
+    clauses = [
+        clause.strip()
+        for clause in CLAUSE_BOUNDARIES.split(sentence)
+        if clause.strip()
+    ]
+    if len(clauses) > 1:
+        clauses_ids = tokenizer(clauses, add_special_tokens=False)[
             "input_ids"
-        ].shape[1]
-
-        # if cummulative sentence + appended sentence exceeds total length
-        if n_tokens > max_tokens:
-            limited_tokens_sentences.append(cummulative_sentence.strip() + ".")
+        ]
+    else:
+        clauses, clauses_ids = [sentence], [sentence_ids]
 
-            # empty the sentence
-            cummulative_sentence = text.strip()
-
-        # if we can still append text blocks to cummulative sentence
-        else:
-            cummulative_sentence += ". " + text
+    pieces = []
+    for clause, clause_ids in zip(clauses, clauses_ids):
+        if len(clause_ids) <= max_tokens:
+            pieces.append((clause, clause_ids))
+            continue
+        for start in range(0, len(clause_ids), max_tokens):
+            window = clause_ids[start : start + max_tokens]
+            pieces.append((tokenizer.decode(window), window))
 
-    # append the last chunk of text.
-    limited_tokens_sentences.append(cummulative_sentence.strip())
+    return pieces
 
-    return limited_tokens_sentences
 
-
-def language_detection(text):
-    """Function to automatically detect a langauge using the lid218e model.
+def chunk_text(original_paragraph, tokenizer, max_tokens):
+    """Function to generate a list of chunks with a limited number of tokens
+    given the max_tokens parameter. The paragraph is splitted into sentences,
+    every sentence is tokenized once and the sentences are greedily packed
+    into chunks by summing their number of tokens.
 
     Parameters
     ----------
-    text : list
-        Text list with the paragraphs in the language that we want to know
+    original_paragraph : str
+        String considered as paragraph
+    tokenizer : NllbTokenizerFast
+        tool that converts text to tokens
+    max_tokens : max_tokens
+        Max number of tokens included in each chunk, special tokens included
 
     Returns
     -------
-    text_lang : str
-        Inferred language
+    chunks : list
+        List of (text, input_ids) tuples. The input_ids do not include the
+        special tokens, see ``tokenizer.build_inputs_with_special_tokens''.
     """
+    sentences = split_sentences(original_paragraph)
+    if not sentences:
+        return [("", [])]
+
+    # tokens available for the text once the special tokens are added
+    max_tokens = max(1, max_tokens - tokenizer.num_special_tokens_to_add())
+
+    # a single tokenizer call for all the sentences of the paragraph
+    sentences_ids = tokenizer(sentences, add_special_tokens=False)[
+        "input_ids"
+    ]
+
+    pieces = []
+    for sentence, sentence_ids in zip(sentences, sentences_ids):
+        if len(sentence_ids) > max_tokens:
+            pieces.extend(
+                split_long_sentence(
+                    sentence, sentence_ids, tokenizer, max_tokens
+                )
+            )
+        else:
+            pieces.append((sentence, sentence_ids))
 
-    # manual set of models path
-    filepath = os.path.abspath(__file__)
-    projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
-    models_path = os.path.join(projpath, "models")
-    # load lid model
-    fasttextmodel = fasttext.load_model(
-        os.path.join(models_path, "lid218e.bin")
-    )
-    # replace newlines as they are not accepted by the model, the model seems
-    # to accept any input lenght so we pass the entire document
-    all_text = " ".join(text).replace("\n", "")
-    # language identification
-    text_lang = fasttextmodel.predict(all_text, k=1)[0][0].replace(
-        "__label__", ""
-    )
+    # greedy packing of the pieces
+    chunks = []
+    chunk_texts, chunk_ids = [], []
+    for text, ids in pieces:
+        if chunk_ids and len(chunk_ids) + len(ids) > max_tokens:
+            chunks.append((" ".join(chunk_texts), chunk_ids))
+            chunk_texts, chunk_ids = [], []
+        chunk_texts.append(text)
+        chunk_ids.extend(ids)
 
-    print(f"Detected language: {text_lang}")
-    return text_lang
+    chunks.append((" ".join(chunk_texts), chunk_ids))
 
+    return chunks
 
-def detect_language_from_images(img_list, page_limit=5):
-    """Function to infer the language of a group of images using the
-    google Tesseract OCR engine + lid218e model.
+
+def convert_text(original_paragraph, tokenizer, max_tokens):
+    """Function to generate a list of strings with a limited number of tokens
+    given the max_tokens parameter, see ``chunk_text''.
 
     Parameters
     ----------
-    img_list : list
-        Path to the images which language we want to know
-
-    page_limit : int
-        Number of document pages to consider when inferring the language
+    original_paragraph : str
+        String considered as paragraph
+    tokenizer : NllbTokenizerFast
+        tool that converts text to tokens
+    max_tokens : max_tokens
+        Max number of tokens included in each original_text_list element
 
     Returns
     -------
-    language : str
-        Inferred language
+    text_groups : list
+        Strings of the chunks of the paragraph.
     """
-    # prevent error on little docs
-    limit = min(page_limit, len(img_list))
+    chunks = chunk_text(original_paragraph, tokenizer, max_tokens)
+    return [text for text, _ in chunks]
+
 
-    # initialize an empty string for storing the text from the images
-    complete_text = []
+def language_detection(text):
+    """Function to automatically detect a langauge using the lid218e model,
+    see ``language_identification.LanguageIdentifier''.
 
-    print("Detecting the language of the document...")
-    # iterate over each of the images
-    for image in img_list[:limit]:
-        im = Image.open(image)
-        text_from_image = image_to_string(im)
-        # append to the cummulative string
-        complete_text.append(text_from_image)
+    Parameters
+    ----------
+    text : list
+        Text list with the paragraphs in the language that we want to know
 
-    # now we will infer the language from the given text
-    language = language_detection(complete_text)
+    Returns
+    -------
+    text_lang : str
+        Inferred language
+    """
+    # the model is loaded once per process and only a bounded sample of the
+    # paragraphs is scored
+    candidates = get_language_identifier().detect_document(text)
+    text_lang = candidates[0][0] if candidates else None
 
-    return language
+    print(f"Detected language: {text_lang}")
+    return text_lang
 
 
-def load_model(model_path):
+def load_model(model_path, precision="fp32", cache_dir=None, mmap=False):
     """Function to load the desired nllb model.
 
     Parameters
     ----------
     model_path : str
         Path in whic the model is stored
+    precision : str
+        ``fp32'', ``bf16'' (weights and activations in bfloat16) or ``int8''
+        (dynamic quantization of the Linear layers)
+    cache_dir : str | None
+        Folder where the int8 weights are cached, so the model is quantized
+        only the first time. If None, it is quantized on every load.
+    mmap : bool
+        If True, the fp32 or bf16 weights are written once to ``cache_dir''
+        and memory mapped, so all the processes which load the model share
+        them, see ``shared_weights''
 
     Returns
     -------
     model : str
         Loaded model class
     """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, use {PRECISIONS}")
+    if mmap and (precision == "int8" or cache_dir is None):
+        raise ValueError(
+            "The memory mapped weights need a cache_dir and fp32 or bf16"
+        )
+
+    start = time.time()
+    if mmap:
+        model = load_mapped_model(model_path, precision, cache_dir)
+    elif precision == "bf16":
+        model = AutoModelForSeq2SeqLM.from_pretrained(
+            model_path, torch_dtype=torch.bfloat16
+        )
+    elif precision == "int8":
+        model = load_quantized_model(model_path, cache_dir)
+    else:
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_path)
+    model.eval()
+    print(
+        f"Model {model_path} ({precision}{', mmap' if mmap else ''}) "
+        f"loaded in {time.time() - start:.2f} s"
+    )
+
+    return model
 
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_path)
 
+def quantize_model(model):
+    """Dynamic int8 quantization of the Linear layers of a model, the
+    activations are quantized on the fly"""
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def cache_file(model_path, cache_dir, precision, extension):
+    """Path of the cached weights of a model, they depend on the torch
+    version"""
+    torch_version = torch.__version__.split("+")[0]
+    return os.path.join(
+        cache_dir,
+        f"{model_path.strip('/').replace('/', '--')}-{precision}-"
+        f"torch{torch_version}.{extension}",
+    )
+
+
+def load_quantized_model(model_path, cache_dir=None):
+    """Function to load the int8 version of a model, from the cache if it has
+    already been quantized, see ``load_model''"""
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = cache_file(model_path, cache_dir, "int8", "pt")
+
+    if cache_path is not None and os.path.exists(cache_path):
+        # empty model with the same architecture, the weights are loaded
+        config = AutoConfig.from_pretrained(model_path)
+        with no_init_weights():
+            model = AutoModelForSeq2SeqLM.from_config(config)
+        model = quantize_model(model)
+        model.load_state_dict(torch.load(cache_path, weights_only=True))
+        return model
+
+    model = quantize_model(AutoModelForSeq2SeqLM.from_pretrained(model_path))
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # written to a temporary file so other processes never read it half
+        # written
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        torch.save(model.state_dict(), tmp_path)
+        os.replace(tmp_path, cache_path)
+        print(f"Quantized model cached in {cache_path}")
     return model
+
+
+def load_mapped_model(model_path, precision, cache_dir):
+    """Function to load a model with its weights memory mapped from the
+    cache, they are written the first time, see ``load_model''"""
+    dtype = torch.bfloat16 if precision == "bf16" else torch.float32
+    cache_path = cache_file(model_path, cache_dir, precision, "bin")
+    if not os.path.exists(f"{cache_path}.json"):
+        os.makedirs(cache_dir, exist_ok=True)
+        model = AutoModelForSeq2SeqLM.from_pretrained(
+            model_path, torch_dtype=dtype
+        )
+        save_weights(model, cache_path)
+        del model
+        print(f"Weights of the model written to {cache_path}")
+
+    # empty model with the same architecture, the weights are mapped
+    config = AutoConfig.from_pretrained(model_path)
+    with no_init_weights():
+        model = AutoModelForSeq2SeqLM.from_config(config, torch_dtype=dtype)
+    return map_weights(model, cache_path)
@@ -0,0 +1,58 @@
+"""Tests of the model registry, with the tiny randomly initialised model of
+the pipeline benchmark so no model is downloaded:
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+filepath = os.path.abspath(__file__)
+projpath = os.path.abspath(os.path.join(filepath, "..", ".."))
+sys.path.insert(0, os.path.join(projpath, "src"))
+sys.path.insert(0, os.path.join(projpath, "benchmarks"))
+
+import model_registry  # noqa: E402
+from model_registry import (  # noqa: E402
+    configure_model_registry,
+    get_model,
+    model_bytes,
+    resident,
+    resident_models,
+)
+from pipeline_fixtures import build_tiny_model  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def tiny_model_path(tmp_path_factory):
+    return build_tiny_model(str(tmp_path_factory.mktemp("models")))
+
+
+@pytest.fixture
+def registry():
+    options = dict(model_registry.registry_options)
+    yield
+    resident.clear()
+    model_registry.model_sizes.clear()
+    model_registry.registry_options.update(options)
+
+
+def test_int8_model_memory(tiny_model_path, registry):
+    configure_model_registry(
+        models={
+            "tiny-fp32": {"model_path": tiny_model_path},
+            "tiny-int8": {"model_path": tiny_model_path, "precision": "int8"},
+        },
+        default="tiny-int8",
+    )
+    model_name, backend = get_model()
+    assert model_name == "tiny-int8"
+
+    get_model("tiny-fp32")
+    int8_mb, fp32_mb = (
+        model["memory_mb"] for model in resident_models()["resident"]
+    )
+    # the packed int8 weights of the Linear layers are counted
+    assert 0 < int8_mb < fp32_mb
+    assert model_bytes(backend.model) == pytest.approx(int8_mb * 2**20)